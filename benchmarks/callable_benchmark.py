@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+# (c) 2015 Tuomas Airaksinen
+#
+# This file is part of Automate.
+#
+# Automate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Automate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Automate.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+    Microbenchmark of interpreted (Callable.call) versus compiled (automate.compiler)
+    evaluation of condition callables.
+
+    Usage::
+
+        python benchmarks/callable_benchmark.py
+"""
+
+import timeit
+
+from automate import *
+from automate.compiler import compile_callable
+
+N = 10000
+
+
+class BenchmarkSystem(System):
+    s1 = UserBoolSensor()
+    s2 = UserBoolSensor(default=True)
+    s3 = UserFloatSensor(default=20.)
+    s4 = UserFloatSensor(default=5.)
+
+
+def conditions():
+    yield 'And(Or(s1, s2), More(s3, 10))', And(Or('s1', 's2'), More('s3', 10))
+    yield 'Sum of 20 sensors', Sum(*(['s3', 's4'] * 10))
+    yield 'And of 50 leaves', And(*([Or('s1', 's2'), More('s3', 's4'), Not('s1'), Value('s2'), Less('s4', 10)] * 10))
+
+
+def run(system, label, condition):
+    condition.setup_callable_system(system)
+    compiled = compile_callable(condition)
+    caller = system.namespace['p']
+    assert compiled(caller) == condition.call(caller)
+    interpreted = min(timeit.repeat(lambda: condition.call(caller), number=N, repeat=3))
+    fast = min(timeit.repeat(lambda: compiled(caller), number=N, repeat=3))
+    print('%-35s interpreted %8.2f us, compiled %6.2f us (%.0fx)' % (
+        label, interpreted / N * 1e6, fast / N * 1e6, interpreted / fast))
+
+
+if __name__ == '__main__':
+    system = BenchmarkSystem(exclude_services=['TextUIService', 'WebService'], name='benchmark')
+    system.namespace['p'] = Program()
+    try:
+        for label, condition in conditions():
+            run(system, label, condition)
+    finally:
+        system.cleanup()
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# (c) 2015 Tuomas Airaksinen
+#
+# This file is part of Automate.
+#
+# Automate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Automate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Automate.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+    Microbenchmark of uncontended acquire/release cost of automate.common.Lock.
+
+    Usage::
+
+        python benchmarks/lock_benchmark.py
+"""
+
+import threading
+import timeit
+
+from automate.common import Lock
+
+N = 100000
+
+
+def acquire_release(lock):
+    with lock:
+        pass
+
+
+def run(label, lock):
+    t = min(timeit.repeat(lambda: acquire_release(lock), number=N, repeat=3))
+    print('%-30s %8.2f us per acquire/release' % (label, t / N * 1e6))
+
+
+if __name__ == '__main__':
+    run('threading.Lock', threading.Lock())
+
+    Lock.debug = True
+    run('Lock (debug_locks=True)', Lock('benchmark'))
+
+    Lock.debug = False
+    run('Lock (debug_locks=False)', Lock('benchmark'))
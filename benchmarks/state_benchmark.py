@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# (c) 2015 Tuomas Airaksinen
+#
+# This file is part of Automate.
+#
+# Automate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Automate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Automate.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+    Benchmark of saving and loading state in pickle and binary formats
+    (:attr:`automate.system.System.state_format`).
+
+    Usage::
+
+        python benchmarks/state_benchmark.py [number of sensors] [history length]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from automate import *
+
+SERVICES = dict(exclude_services=['TextUIService', 'WebService', 'StatusSaverService'])
+
+
+def make_system(num_sensors, history_length):
+    attrs = {'s%d' % i: UserFloatSensor(history_length=history_length) for i in range(num_sensors)}
+    return type('BenchmarkSystem', (System,), attrs)
+
+
+def run(state_format, num_sensors, history_length):
+    filename = os.path.join(tempfile.mkdtemp(), 'state.dmp')
+    system = make_system(num_sensors, history_length)(filename=filename, state_format=state_format,
+                                                      name='benchmark', **SERVICES)
+    t = time.time() - history_length
+    for obj in system.sensors:
+        obj.history = [(t + i, float(i)) for i in range(history_length)]
+    t0 = time.time()
+    system.save_state()
+    save_time = time.time() - t0
+    system.cleanup()
+
+    sys.argv = [__file__]
+    os.utime(filename)
+    t0 = time.time()
+    system = make_system(num_sensors, history_length).load_or_create(filename, name='benchmark', **SERVICES)
+    load_time = time.time() - t0
+    assert len(system.namespace["s0"].history) == history_length, len(system.namespace["s0"].history)
+    system.cleanup()
+    print('%-8s size %8.1f kB, save %6.2f s, load %6.2f s' % (
+        state_format, os.path.getsize(filename) / 1024, save_time, load_time))
+
+
+if __name__ == '__main__':
+    num_sensors = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    history_length = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    for state_format in ('pickle', 'binary'):
+        run(state_format, num_sensors, history_length)
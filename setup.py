@@ -17,8 +17,9 @@ web_requirements = [
 gpio_requirements = ['RPi.GPIO']
 rpio_requirements = ['RPIO']
 arduino_requirements = []
+numpy_requirements = ['numpy']
 
-all_extras_requirements = web_requirements + gpio_requirements + arduino_requirements
+all_extras_requirements = web_requirements + gpio_requirements + arduino_requirements + numpy_requirements
 
 setupopts = dict(
     name="automate",
@@ -44,6 +45,7 @@ setupopts = dict(
         'raspberrypi': gpio_requirements,
         'rpio': rpio_requirements,
         'arduino': arduino_requirements,
+        'numpy': numpy_requirements,
         'all': all_extras_requirements,
     },
 
@@ -22,9 +22,13 @@
 # http://evankelista.net/automate/
 
 import re
-from traits.api import cached_property, on_trait_change, CList, Dict, Instance, Set, Event, Property
+import threading
+from collections import defaultdict
+
+from traits.api import cached_property, on_trait_change, CList, Dict, Instance, Set, Event, Property, Tuple
 from .common import CompareMixin, Lock, deep_iterate, Object, is_iterable, AbstractStatusObject, DictObject, SystemNotReady
 from .systemobject import SystemObject
+from .compiler import NotCompilable
 
 import logging
 
@@ -39,6 +43,15 @@ class AbstractCallable(SystemObject, CompareMixin):
     method which defines their functionality.
     """
 
+    #: If True, return value of :meth:`.call` depends only on the values of the children
+    #: (i.e. there are no side effects, no internal state and no dependency on time or trigger).
+    #: Such callables can be cached by :class:`ConditionCache`.
+    pure = False
+
+    #: Incremented whenever arguments of any callable are changed, or names in the
+    #: namespace are changed (see :class:`ConditionCache`)
+    tree_generation = 0
+
     #: Arguments given for callable are stored here
     _args = CList
 
@@ -48,6 +61,9 @@ class AbstractCallable(SystemObject, CompareMixin):
     #: Lock must be used when accessing :attr:`.state`
     _lock = Instance(Lock, transient=True)
 
+    #: Resolved names: (namespace generation, {name: object})
+    _name_cache = Tuple(transient=True)
+
     #: Property that gives set of all *triggers* of this callable and it's children callables.
     #: Triggers are all those StatusObjects that alter the status (return value of :meth:`.call`) of
     #: Callable.
@@ -107,6 +123,7 @@ class AbstractCallable(SystemObject, CompareMixin):
 
     @on_trait_change('_args, _args_items', post_init=True)
     def objects_changed(self, name, old, new):
+        AbstractCallable.tree_generation += 1
         if not self.system:
             return
         for o in new.added:
@@ -115,6 +132,7 @@ class AbstractCallable(SystemObject, CompareMixin):
 
     @on_trait_change('_kwargs, _kwargs_items', post_init=True)
     def kwargs_changed(self, name, old, new):
+        AbstractCallable.tree_generation += 1
         if not self.system:
             return
         for o in list(new.added.values()):
@@ -172,6 +190,9 @@ class AbstractCallable(SystemObject, CompareMixin):
         if return_value and isinstance(value, AbstractStatusObject):
             return value.status
         if hasattr(value, 'call'):
+            cache = getattr(caller, '_condition_cache', None)
+            if cache is not None:
+                return self.call_eval(cache.call(value, caller, **kwargs), caller, return_value, **kwargs)
             return self.call_eval(value.call(caller, **kwargs), caller, return_value, **kwargs)
         else:
             return value
@@ -220,6 +241,15 @@ class AbstractCallable(SystemObject, CompareMixin):
         """
         raise NotImplementedError
 
+    def _compile(self, compiler):
+        """
+            Give Python expression (:class:`automate.compiler.Expression`) that evaluates
+            like :meth:`.call`. Use ``compiler.expr(self, value)`` for arguments. Raise
+            :class:`~automate.compiler.NotCompilable` if callable must be evaluated via :meth:`.call`.
+            See :mod:`automate.compiler`.
+        """
+        raise NotCompilable
+
     @property
     def objects(self):
         """
@@ -250,13 +280,26 @@ class AbstractCallable(SystemObject, CompareMixin):
     def name_to_system_object(self, value):
         """
         Return object for given name registered in System namespace.
+
+        Resolved names are cached, until names in namespace are changed
+        (see :attr:`.Namespace.generation`).
         """
-        if not self.system:
+        system = self.system
+        if not system:
             raise SystemNotReady
 
         if isinstance(value, (str, Object)):
-            rv = self.system.name_to_system_object(value)
-            return rv if rv else value
+            generation = system.namespace.generation
+            cache = self._name_cache
+            if not cache or cache[0] != generation:
+                cache = self._name_cache = (generation, {})
+            try:
+                return cache[1][value]
+            except KeyError:
+                pass
+            rv = system.name_to_system_object(value)
+            rv = cache[1][value] = rv if rv else value
+            return rv
         else:
             return value
 
@@ -397,4 +440,108 @@ class AbstractCallable(SystemObject, CompareMixin):
         return False
 
     def __hash__(self):
-        return id(self)
\ No newline at end of file
+        return id(self)
+
+class ConditionCache(object):
+
+    """
+        Per-program cache of the values of condition callables, used when
+        :attr:`~automate.system.System.incremental_evaluation` is enabled.
+
+        Condition trees are walked into a dependency graph: each :attr:`~AbstractCallable.pure`
+        callable, whose children are all pure too, is cached, and mapped to the StatusObjects
+        it depends on (:attr:`~AbstractCallable.triggers`). When status of a StatusObject changes,
+        only the callables that depend on it are evaluated again; values of the other
+        subtrees are taken from the cache.
+
+        Graph is rebuilt if condition callables are replaced or arguments of any callable
+        are changed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._roots = ()
+        self._tree_generation = None
+        self._cacheable = set()  # ids of cacheable callables
+        self._dependents = {}  # StatusObject -> ids of callables depending on it
+        self._nodes = []  # keep callables alive, so that ids stay valid
+        self._values = {}
+        self._generation = 0
+
+    def validate(self, roots):
+        """ Rebuild dependency graph, if tree of root callables has changed """
+        roots = tuple(roots)
+        if self._tree_generation == AbstractCallable.tree_generation and \
+                all(a is b for a, b in zip(roots, self._roots)) and len(roots) == len(self._roots):
+            return
+        self.clear()
+        self._roots = roots
+        self._tree_generation = AbstractCallable.tree_generation
+        dependents = defaultdict(set)
+        visited = {}
+
+        def walk(node):
+            if id(node) in visited:
+                return visited[id(node)]
+            visited[id(node)] = False  # guard against cycles
+            self._nodes.append(node)
+            cacheable = node.pure
+            for child in node.children:
+                child = node.name_to_system_object(child)
+                if isinstance(child, AbstractCallable):
+                    cacheable = walk(child) and cacheable
+            if cacheable:
+                self._cacheable.add(id(node))
+                for t in node.triggers:
+                    dependents[t].add(id(node))
+            visited[id(node)] = cacheable
+            return cacheable
+
+        for root in roots:
+            walk(root)
+        self._dependents = dict(dependents)
+        for t in self._dependents:
+            t.on_trait_change(self._status_changed, 'status')
+
+    def clear(self):
+        """ Forget dependency graph and cached values """
+        for t in self._dependents:
+            t.on_trait_change(self._status_changed, 'status', remove=True)
+        with self._lock:
+            self._generation += 1
+            self._values.clear()
+        self._roots = ()
+        self._tree_generation = None
+        self._cacheable = set()
+        self._dependents = {}
+        self._nodes = []
+
+    def invalidate(self, obj):
+        """ Drop cached values of callables that depend on status of obj """
+        keys = self._dependents.get(obj)
+        if not keys:
+            return
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._values.pop(key, None)
+
+    def _status_changed(self, obj, name, old, new):
+        self.invalidate(obj)
+
+    def call(self, node, caller, **kwargs):
+        """ Give cached value of node.call(caller), or evaluate and cache it """
+        key = id(node)
+        if key not in self._cacheable:
+            return node.call(caller, **kwargs)
+        try:
+            return self._values[key]
+        except KeyError:
+            pass
+        generation = self._generation
+        value = node.call(caller, **kwargs)
+        with self._lock:
+            # If some status was changed during evaluation, value might be already outdated
+            if generation == self._generation:
+                self._values[key] = value
+        return value
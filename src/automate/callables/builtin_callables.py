@@ -25,21 +25,21 @@
 import datetime
 
 import re
-import statistics
 import threading
 import xmlrpc.client
 import socket
 import subprocess
 import time
-import collections
 
 from http.client import HTTPException
 
 from traits.api import (CList, Any, Property, Set, Bool, Event, CBool, on_trait_change, cached_property)
 
 from automate.callable import AbstractCallable
+from automate.compiler import Expression, NotCompilable
 from automate.common import deep_iterate, get_modules_all
 from automate.statusobject import StatusObject
+from automate.windowstats import WindowStats
 from automate.common import (threaded, thread_start, is_iterable)
 
 
@@ -345,7 +345,10 @@ class Shell(AbstractAction):
                 cmd, executable='bash', shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
             self.logger.debug('Shell: cmd "%s", pid %s', cmd, process.pid)
             if self._kwargs.get('no_wait', False):
-                thread_start(self.system, lambda: process.communicate(input))
+                if self.system.event_loop:
+                    self.system.event_loop.create_task(self.system.event_loop.wait_process(process, input))
+                else:
+                    thread_start(self.system, lambda: process.communicate(input))
                 return process.pid
             else:
                 out, err = process.communicate(input)
@@ -542,13 +545,20 @@ class Delay(AbstractRunner):
 
             self.logger.info("Scheduling %s", self)
             delay = self.call_eval(self.delay, caller, **kwargs)
-            timer = threading.Timer(delay, None)
-            timer.function = threaded(self.system, self._run, caller, timer, **kwargs)
             time_after_delay = datetime.datetime.now() + datetime.timedelta(seconds=delay)
-            timer.name = "Timer for %s timed at %s (%d sek)" % (self, time_after_delay, delay)
-            timer.start()
+
+            def run():
+                # self._lock is held until timer is assigned
+                with self._lock:
+                    job = timer
+                return self._run(caller, job, **kwargs)
+
+            timer = self._start_timer(delay, run, "Timer for %s timed at %s (%d sek)" % (self, time_after_delay, delay))
             timers.append(timer)
 
+    def _start_timer(self, delay, func, name):
+        return self.system.scheduler.schedule(delay, func, name=name)
+
     def cancel(self, caller):
         with self._lock:
             state = self.get_state(caller)
@@ -589,6 +599,13 @@ class Threaded(Delay):
     def __init__(self, *args, **kwargs):
         super().__init__(0, *args, **kwargs)
 
+    def _start_timer(self, delay, func, name):
+        # Actions may take long, so they are run in a thread of their own instead of the system scheduler
+        timer = threading.Timer(delay, threaded(self.system, func))
+        timer.name = name
+        timer.start()
+        return timer
+
 
 class If(AbstractCallable):
 
@@ -734,6 +751,7 @@ class Min(AbstractMathematical):
         # where x,y,z are anything that can be
         # evaluated as number (Callables, Statusobjects etc).
      """
+    pure = True
 
     def call(self, caller=None, **kwargs):
         val = float("inf")
@@ -741,6 +759,10 @@ class Min(AbstractMathematical):
             val = min(val, self.call_eval(i, caller, **kwargs))
         return val
 
+    def _compile(self, compiler):
+        items = [compiler.expr(self, i) for i in self.objects]
+        return Expression('min((%s,))' % ', '.join(['_inf'] + items), True)
+
 
 class Max(AbstractMathematical):
 
@@ -752,6 +774,7 @@ class Max(AbstractMathematical):
         # where x,y,z are anything that can be
         # evaluated as number (Callables, Statusobjects etc).
     """
+    pure = True
 
     def call(self, caller=None, **kwargs):
         val = -float("inf")
@@ -759,6 +782,10 @@ class Max(AbstractMathematical):
             val = max(val, self.call_eval(i, caller, **kwargs))
         return val
 
+    def _compile(self, compiler):
+        items = [compiler.expr(self, i) for i in self.objects]
+        return Expression('max((%s,))' % ', '.join(['-_inf'] + items), True)
+
 
 class Sum(AbstractMathematical):
 
@@ -770,6 +797,7 @@ class Sum(AbstractMathematical):
         # where x,y,z are anything that can be
         # evaluated as number (Callables, Statusobjects etc).
     """
+    pure = True
 
     def call(self, caller=None, **kwargs):
         _sum = 0.0
@@ -777,6 +805,10 @@ class Sum(AbstractMathematical):
             _sum += self.call_eval(i, caller, **kwargs)
         return _sum
 
+    def _compile(self, compiler):
+        items = [compiler.expr(self, i) for i in self.objects]
+        return Expression('(%s)' % ' + '.join(['0.0'] + items), True)
+
 
 class Product(AbstractMathematical):
 
@@ -789,6 +821,7 @@ class Product(AbstractMathematical):
         # evaluated as number (Callables, Statusobjects etc).
 
     """
+    pure = True
 
     def call(self, caller=None, **kwargs):
         _sum = 1.0
@@ -796,6 +829,10 @@ class Product(AbstractMathematical):
             _sum *= self.call_eval(i, caller, **kwargs)
         return _sum
 
+    def _compile(self, compiler):
+        items = [compiler.expr(self, i) for i in self.objects]
+        return Expression('(%s)' % ' * '.join(['1.0'] + items), True)
+
 
 class Mult(Product):
 
@@ -813,6 +850,7 @@ class Division(AbstractMathematical):
         # evaluated as number (Callables, Statusobjects etc).
 
     """
+    pure = True
 
     def call(self, caller=None, **kwargs):
         if len(self.objects) != 2:
@@ -823,6 +861,11 @@ class Division(AbstractMathematical):
         _val2 = self.call_eval(obj2, caller, **kwargs)
         return _val1 / _val2
 
+    def _compile(self, compiler):
+        if len(self.objects) != 2:
+            raise NotCompilable
+        return Expression('(%s / %s)' % tuple(compiler.expr(self, i) for i in self.objects), True)
+
 
 class Div(Division):
 
@@ -847,10 +890,14 @@ class Anything(AbstractLogical):
 
         Anything(x,y,z...)
     """
+    pure = True
 
     def call(self, caller=None, **kwargs):
         return True
 
+    def _compile(self, compiler):
+        return Expression('True', True)
+
 
 class Or(AbstractLogical):
 
@@ -860,6 +907,7 @@ class Or(AbstractLogical):
 
         Or(x,y,z...) # gives truth value of x or y or z or ,,,
     """
+    pure = True
 
     def call(self, caller=None, **kwargs):
         def _or(list):
@@ -873,6 +921,12 @@ class Or(AbstractLogical):
 
         return _or(self.objects)
 
+    def _compile(self, compiler):
+        name = compiler.bind(self)
+        items = [i if i.scalar else '_truth_or(%s, %s, caller, kwargs)' % (name, i)
+                 for i in (compiler.expr(self, i) for i in self.objects)]
+        return Expression('(True if (%s) else False)' % (' or '.join(items) or 'False'), True)
+
 
 class And(AbstractLogical):
 
@@ -883,6 +937,7 @@ class And(AbstractLogical):
         And(x,y,z...) # gives truth value of x and y and z and ...
 
     """
+    pure = True
 
     def call(self, caller=None, **kwargs):
         def _and(list):
@@ -895,6 +950,12 @@ class And(AbstractLogical):
             return True
         return _and(self.objects)
 
+    def _compile(self, compiler):
+        name = compiler.bind(self)
+        items = [i if i.scalar else '_truth_and(%s, %s, caller, kwargs)' % (name, i)
+                 for i in (compiler.expr(self, i) for i in self.objects)]
+        return Expression('(True if (%s) else False)' % (' and '.join(items) or 'True'), True)
+
 
 class Neg(AbstractLogical):
 
@@ -904,12 +965,18 @@ class Neg(AbstractLogical):
 
         Neg(x) # returns -x
     """
+    pure = True
 
     def call(self, caller=None, **kwargs):
         if len(self.objects) != 1:
             raise RuntimeError('Too many arguments')
         return -self.call_eval(self.obj, caller, **kwargs)
 
+    def _compile(self, compiler):
+        if len(self.objects) != 1:
+            raise NotCompilable
+        return Expression('(-%s)' % compiler.expr(self, self.obj), True)
+
 
 class Inverse(AbstractLogical):
 
@@ -919,12 +986,18 @@ class Inverse(AbstractLogical):
 
         Inv(x) # returns 1/x
     """
+    pure = True
 
     def call(self, caller=None, **kwargs):
         if len(self.objects) != 1:
             raise RuntimeError('Too many arguments')
         return 1./self.call_eval(self.obj, caller, **kwargs)
 
+    def _compile(self, compiler):
+        if len(self.objects) != 1:
+            raise NotCompilable
+        return Expression('(1./%s)' % compiler.expr(self, self.obj), True)
+
 
 class Inv(Inverse):
 
@@ -939,12 +1012,18 @@ class Not(AbstractLogical):
 
         Not(x) # returns not x
     """
+    pure = True
 
     def call(self, caller=None, **kwargs):
         if len(self.objects) != 1:
             raise RuntimeError('Too many arguments')
         return not self.call_eval(self.obj, caller, **kwargs)
 
+    def _compile(self, compiler):
+        if len(self.objects) != 1:
+            raise NotCompilable
+        return Expression('(not %s)' % compiler.expr(self, self.obj), True)
+
 
 class Equal(AbstractLogical):
 
@@ -954,10 +1033,14 @@ class Equal(AbstractLogical):
 
         Equal(x, y) # returns truth value of x == y
     """
+    pure = True
 
     def call(self, caller=None, **kwargs):
         return self.call_eval(self.obj, caller, **kwargs) == self.call_eval(self.value, caller, **kwargs)
 
+    def _compile(self, compiler):
+        return Expression('(%s == %s)' % (compiler.expr(self, self.obj), compiler.expr(self, self.value)), True)
+
 
 class Less(AbstractLogical):
 
@@ -967,6 +1050,7 @@ class Less(AbstractLogical):
 
         Less(x,y) # returns truth value of x < y
     """
+    pure = True
 
     def call(self, caller=None, **kwargs):
         a = self.call_eval(self.obj, caller, **kwargs)
@@ -977,6 +1061,9 @@ class Less(AbstractLogical):
             rv = False
         return rv
 
+    def _compile(self, compiler):
+        return Expression('_less(%s, %s)' % (compiler.expr(self, self.obj), compiler.expr(self, self.value)), True)
+
 class More(AbstractLogical):
 
     """Condition: is x > y
@@ -986,6 +1073,7 @@ class More(AbstractLogical):
         More(x,y) # returns truth value of x > y
 
     """
+    pure = True
 
     def call(self, caller=None, **kwargs):
         a = self.call_eval(self.obj, caller, **kwargs)
@@ -996,6 +1084,9 @@ class More(AbstractLogical):
             rv = False
         return rv
 
+    def _compile(self, compiler):
+        return Expression('_more(%s, %s)' % (compiler.expr(self, self.obj), compiler.expr(self, self.value)), True)
+
 
 class Value(AbstractLogical):
 
@@ -1008,11 +1099,15 @@ class Value(AbstractLogical):
                  # as a condition of Program condition attributes.
 
     """
+    pure = True
     _args = CList
 
     def call(self, caller=None, **kwargs):
         return self.call_eval(self.obj, caller, **kwargs)
 
+    def _compile(self, compiler):
+        return compiler.expr(self, self.obj)
+
 
 class Average(AbstractLogical):
 
@@ -1037,6 +1132,9 @@ class Mean(AbstractLogical):
 
     """Give mean value over last n entries
 
+    If x is a StatusObject, entries are its last n history entries (i.e. status changes),
+    otherwise values of x when Mean was evaluated.
+
     Usage::
 
         Mean(x, 10)
@@ -1050,12 +1148,50 @@ class Mean(AbstractLogical):
         if len(self._args) == 2:
             n = self.call_eval(self._args[1], caller, **kwargs)
 
+        if isinstance(self.obj, StatusObject):
+            window = self.obj.window_stats(count=n)
+            if window.n:
+                return window.mean
+            return self.call_eval(self.obj, caller, **kwargs)
+
         if self._history is None:
-            self._history = collections.deque(maxlen=n)
+            self._history = WindowStats(count=n)
 
         val = self.call_eval(self._args[0], caller, **kwargs)
-        self._history.append(val)
-        return statistics.mean(self._history)
+        self._history.add(time.time(), val)
+        return self._history.mean
+
+
+class MinOverTime(AbstractLogical):
+
+    """Give minimum of status of x over last n seconds
+
+    Usage::
+
+        MinOverTime(x, 10)
+
+    """
+    _args = CList
+
+    def call(self, caller=None, **kwargs):
+        t = self.call_eval(self._args[1], caller, **kwargs)
+        return self.obj.window_stats(seconds=t).min
+
+
+class MaxOverTime(AbstractLogical):
+
+    """Give maximum of status of x over last n seconds
+
+    Usage::
+
+        MaxOverTime(x, 10)
+
+    """
+    _args = CList
+
+    def call(self, caller=None, **kwargs):
+        t = self.call_eval(self._args[1], caller, **kwargs)
+        return self.obj.window_stats(seconds=t).max
 
 
 class AbstractQuery(AbstractCallable):
@@ -24,8 +24,10 @@
 from copy import copy
 import logging
 import re
+import sys
 import keyword
 import threading
+import time
 from collections import Iterable
 from functools import wraps
 
@@ -128,9 +130,24 @@ def has_baseclass(v, s):
 
 class Lock(object):
 
-    """Lock object (similar to threading.Lock) that can print some debug information"""
+    """
+        Lock object (similar to threading.Lock) that can print some debug information.
+
+        By default, only the owner thread and acquire time are recorded in :attr:`context`, and stacks are
+        logged only if waiting for the lock takes longer than :attr:`contention_threshold` seconds.
+        If :attr:`debug` is set, full stack is captured on every acquire (slow, use only for
+        debugging deadlocks). These are process-wide settings, configured by
+        :attr:`automate.system.System.debug_locks` and
+        :attr:`automate.system.System.lock_contention_threshold`.
+    """
     context = None
 
+    #: Capture full stack on every acquire
+    debug = False
+
+    #: Log stacks if waiting for the lock takes longer than this (in seconds)
+    contention_threshold = 1.0
+
     def __init__(self, name="Unnamed lock", silent=False):
         self.logger = logging.getLogger('automate.common.Lock')
         self.name = name
@@ -145,13 +162,40 @@ class Lock(object):
         return self.__exit__(None, None, None)
 
     def __enter__(self):
+        if self.debug:
+            return self._debug_enter()
+        if not self.lock.acquire(False):
+            if not self.lock.acquire(timeout=self.contention_threshold):
+                self._log_contention()
+                self.lock.acquire()
+        self.context = (threading.current_thread(), time.time())
+
+    def _log_contention(self):
+        context = self.context
+        if self.silent:
+            return
+        import traceback
+        waiter_stack = "".join(traceback.format_stack())
+        if isinstance(context, tuple):
+            owner, acquired_at = context
+            # Stack of the owner shows where the lock is being held
+            frame = sys._current_frames().get(owner.ident)
+            owner_stack = "".join(traceback.format_stack(frame)) if frame else '(not available)\n'
+            self.logger.info("Waiting for lock %s for more than %.2f seconds, held by %s for %.2f seconds. "
+                             "Owner context:\n %sWaiting context:\n %s", self.name, self.contention_threshold,
+                             owner.name, time.time() - acquired_at, owner_stack, waiter_stack)
+        else:
+            self.logger.info("Waiting for lock %s for more than %.2f seconds. Current context:\n %s",
+                             self.name, self.contention_threshold, waiter_stack)
+
+    def _debug_enter(self):
         import traceback
         if self.lock.acquire(False):
             pass
         else:
             self.logger.debug("WAITING for lock %s", self.name)
             with self.context_lock:
-                if not self.silent and self.context:
+                if not self.silent and isinstance(self.context, list):
                     current_context = traceback.format_stack()
                     self.logger.debug("Current context:\n %s", "".join(current_context))
                     self.logger.debug("The context, when lock was acquired\n %s", "".join(self.context))
@@ -162,7 +206,10 @@ class Lock(object):
             self.context = traceback.format_stack()
 
     def __exit__(self, type, value, tb):
-        with self.context_lock:
+        if self.debug:
+            with self.context_lock:
+                self.context = None
+        else:
             self.context = None
         self.lock.release()
 
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+# (c) 2015 Tuomas Airaksinen
+#
+# This file is part of Automate.
+#
+# Automate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Automate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Automate.  If not, see <http://www.gnu.org/licenses/>.
+#
+# ------------------------------------------------------------------
+#
+# If you like Automate, please take a look at this page:
+# http://evankelista.net/automate/
+
+"""
+    Compile callable trees into plain Python functions.
+
+    Evaluating a callable tree the ordinary way goes through :meth:`~automate.callable.AbstractCallable.call`
+    and :meth:`~automate.callable.AbstractCallable.call_eval` (name lookups, type checks, recursion)
+    for every node. :func:`compile_callable` resolves objects once and generates a single function,
+    for example ``And(Or(s1, s2), More(s3, 10))`` becomes roughly::
+
+        def compiled(caller=None, **kwargs):
+            return (True if ((True if (_o0.status or _o1.status) else False) and _more(_o2.status, 10))
+                    else False)
+
+    Callables define their code by implementing ``_compile``. Callables that do not (or cannot
+    be compiled with their current arguments) are evaluated via their ordinary :meth:`call`.
+"""
+
+import math
+
+from traits.trait_types import BaseBool, BaseInt, BaseFloat, BaseStr, BaseUnicode
+
+from .common import AbstractStatusObject, is_iterable
+
+SCALAR_TRAIT_TYPES = (BaseBool, BaseInt, BaseFloat, BaseStr, BaseUnicode)
+
+
+class NotCompilable(Exception):
+
+    """ Raised by ``_compile`` implementations, if node must be evaluated via :meth:`call` """
+
+
+def _truth_and(node, value, caller, kwargs):
+    # Iterable values are handled as in And.call: items are evaluated like arguments
+    if is_iterable(value):
+        return all(_truth_and(node, node.call_eval(i, caller, **kwargs), caller, kwargs) for i in value)
+    return value
+
+
+def _truth_or(node, value, caller, kwargs):
+    # Iterable values are handled as in Or.call: items are evaluated like arguments
+    if is_iterable(value):
+        return any(_truth_or(node, node.call_eval(i, caller, **kwargs), caller, kwargs) for i in value)
+    return value
+
+
+def _less(a, b):
+    try:
+        return a < b
+    except TypeError:
+        return False
+
+
+def _more(a, b):
+    try:
+        return a > b
+    except TypeError:
+        return False
+
+
+class Expression(str):
+
+    """ Python expression source. ``scalar`` tells that value can never be iterable. """
+
+    def __new__(cls, source, scalar=False):
+        rv = super().__new__(cls, source)
+        rv.scalar = scalar
+        return rv
+
+
+class CallableCompiler(object):
+
+    """
+        Generates source code of a callable tree. Objects are bound to names in
+        the namespace of the generated function.
+    """
+
+    def __init__(self):
+        self.namespace = {
+            '_truth_and': _truth_and,
+            '_truth_or': _truth_or,
+            '_less': _less,
+            '_more': _more,
+            '_inf': float('inf'),
+        }
+        self._names = {}
+        self.opaque = []  # Callables that are evaluated via call()
+
+    def bind(self, obj):
+        """ Give name for object in the namespace of generated function """
+        key = id(obj)
+        name = self._names.get(key)
+        if name is None:
+            name = self._names[key] = '_o%d' % len(self._names)
+            self.namespace[name] = obj
+        return name
+
+    def expr(self, node, value):
+        """
+            Give expression that evaluates value (argument of node) like
+            ``node.call_eval(value, caller, **kwargs)``
+        """
+        from .callable import AbstractCallable
+        value = node.name_to_system_object(value)
+        if isinstance(value, AbstractStatusObject):
+            trait = value.trait('_status')
+            scalar = trait is not None and isinstance(trait.trait_type, SCALAR_TRAIT_TYPES)
+            return Expression('%s.status' % self.bind(value), scalar)
+        if isinstance(value, AbstractCallable):
+            return self.compile_node(value)
+        if isinstance(value, (list, tuple, dict)):
+            # call_eval evaluates items recursively in callables such as And
+            raise NotCompilable
+        if hasattr(value, 'call'):
+            raise NotCompilable
+        if type(value) in (bool, int) or value is None or (type(value) is float and math.isfinite(value)):
+            return Expression(repr(value), True)
+        return Expression(self.bind(value), isinstance(value, str))
+
+    def compile_node(self, node):
+        """ Give expression that evaluates callable node """
+        try:
+            return node._compile(self)
+        except NotCompilable:
+            self.opaque.append(node)
+            name = self.bind(node)
+            return Expression('%s.call_eval(%s, caller, **kwargs)' % (name, name))
+
+    def compile(self, node):
+        """ Compile callable tree into function ``f(caller=None, **kwargs)`` """
+        try:
+            expr = node._compile(self)
+        except NotCompilable:
+            self.opaque.append(node)
+            expr = '%s.call(caller, **kwargs)' % self.bind(node)
+        source = 'def compiled(caller=None, **kwargs):\n    return %s\n' % expr
+        code = compile(source, '<compiled %s>' % node.__class__.__name__, 'exec')
+        exec(code, self.namespace)
+        func = self.namespace['compiled']
+        func.source = source
+        func.opaque = list(self.opaque)
+        return func
+
+
+def compile_callable(node):
+    """
+        Compile fully set up callable tree into a Python function ``f(caller=None, **kwargs)``
+        that gives the same result as ``node.call(caller, **kwargs)``.
+    """
+    return CallableCompiler().compile(node)
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+# (c) 2015 Tuomas Airaksinen
+#
+# This file is part of Automate.
+#
+# Automate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Automate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Automate.  If not, see <http://www.gnu.org/licenses/>.
+#
+# ------------------------------------------------------------------
+#
+# If you like Automate, please take a look at this page:
+# http://evankelista.net/automate/
+
+"""
+    System-wide index of trigger and target relationships between programs and StatusObjects.
+"""
+
+import threading
+from collections import defaultdict
+
+from traits.trait_notifiers import handle_exception
+
+
+class DependencyIndex(object):
+
+    """
+        Index of :attr:`~automate.program.ProgrammableSystemObject.actual_triggers` and
+        :attr:`~automate.program.ProgrammableSystemObject.actual_targets` of all programs
+        in the system, in both directions. Programs keep it up to date by applying the
+        changes of their triggers and targets (see :meth:`update`), so it is never
+        collected by walking the callables of all programs.
+
+        Status changes are dispatched through the index: each trigger object has a single
+        status change listener (:meth:`status_changed`), that calls
+        :meth:`~automate.program.ProgrammableSystemObject.trigger_status_changed` of the
+        triggered programs in the order they were added.
+
+        Available as :attr:`automate.system.System.dependencies`.
+    """
+
+    kinds = ('triggers', 'targets')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # kind -> program -> set of StatusObjects
+        self._forward = {kind: defaultdict(set) for kind in self.kinds}
+        # kind -> StatusObject -> programs (dict is used as insertion ordered set)
+        self._reverse = {kind: defaultdict(dict) for kind in self.kinds}
+
+    def update(self, program, kind, removed=(), added=()):
+        """ Apply change in triggers or targets (``kind``) of program """
+        forward = self._forward[kind]
+        reverse = self._reverse[kind]
+        subscribe, unsubscribe = [], []
+        with self._lock:
+            for obj in removed:
+                forward[program].discard(obj)
+                programs = reverse.get(obj)
+                if programs is not None:
+                    programs.pop(program, None)
+                    if not programs:
+                        del reverse[obj]
+                        unsubscribe.append(obj)
+            for obj in added:
+                forward[program].add(obj)
+                if not reverse[obj]:
+                    subscribe.append(obj)
+                reverse[obj][program] = None
+            if not forward[program]:
+                del forward[program]
+        if kind == 'triggers':
+            self._subscribe(subscribe, unsubscribe)
+
+    def remove(self, obj):
+        """ Remove object (program and/or StatusObject) from the index """
+        unsubscribe = []
+        with self._lock:
+            for kind in self.kinds:
+                forward, reverse = self._forward[kind], self._reverse[kind]
+                for dependency in forward.pop(obj, ()):
+                    programs = reverse[dependency]
+                    programs.pop(obj, None)
+                    if not programs:
+                        del reverse[dependency]
+                        if kind == 'triggers':
+                            unsubscribe.append(dependency)
+                if kind == 'triggers' and obj in reverse:
+                    unsubscribe.append(obj)
+                for program in reverse.pop(obj, ()):
+                    forward[program].discard(obj)
+                    if not forward[program]:
+                        del forward[program]
+        self._subscribe((), unsubscribe)
+
+    def _subscribe(self, subscribe, unsubscribe):
+        for obj in unsubscribe:
+            obj.on_trait_change(self.status_changed, 'status', remove=True)
+        for obj in subscribe:
+            obj.on_trait_change(self.status_changed, 'status')
+
+    def status_changed(self, obj, name, old, new):
+        """ Dispatch status change of obj to the programs it triggers """
+        with self._lock:
+            programs = tuple(self._reverse['triggers'].get(obj, ()))
+        for program in programs:
+            try:
+                program.trigger_status_changed(obj, name, old, new)
+            except Exception:
+                # Keep other programs running, as if they were separate listeners
+                handle_exception(obj, name, old, new)
+
+    def _get(self, mapping, obj):
+        with self._lock:
+            return frozenset(mapping.get(obj, ()))
+
+    def triggers_of(self, program):
+        """ StatusObjects that trigger program """
+        return self._get(self._forward['triggers'], program)
+
+    def targets_of(self, program):
+        """ StatusObjects that program may change """
+        return self._get(self._forward['targets'], program)
+
+    def triggered_programs(self, obj):
+        """ Programs that are triggered by status changes of obj """
+        return self._get(self._reverse['triggers'], obj)
+
+    def targeting_programs(self, obj):
+        """ Programs that have obj as a target """
+        return self._get(self._reverse['targets'], obj)
+
+    def affected_programs(self, obj):
+        """
+            Programs that would be evaluated, directly or indirectly, if status of obj changes:
+            programs triggered by obj, programs triggered by their targets and so on.
+        """
+        with self._lock:
+            triggers, targets = self._reverse['triggers'], self._forward['targets']
+            affected = set()
+            objs = [obj]
+            while objs:
+                for program in triggers.get(objs.pop(), ()):
+                    if program not in affected:
+                        affected.add(program)
+                        objs.extend(targets.get(program, ()))
+        return frozenset(affected)
+
+    def affecting_objects(self, obj):
+        """
+            Objects whose status changes may, directly or indirectly, change status of obj
+            (via programs that have it as a target)
+        """
+        with self._lock:
+            triggers, targets = self._forward['triggers'], self._reverse['targets']
+            affecting = set()
+            objs = [obj]
+            while objs:
+                for program in targets.get(objs.pop(), ()):
+                    for trigger in triggers.get(program, ()):
+                        if trigger not in affecting:
+                            affecting.add(trigger)
+                            objs.append(trigger)
+        return frozenset(affecting)
+
+    def __repr__(self):
+        return '<%s %d triggered objects, %d targeted objects>' % (
+            self.__class__.__name__, len(self._reverse['triggers']), len(self._reverse['targets']))
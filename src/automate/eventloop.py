@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+# (c) 2015 Tuomas Airaksinen
+#
+# This file is part of Automate.
+#
+# Automate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Automate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Automate.  If not, see <http://www.gnu.org/licenses/>.
+#
+# ------------------------------------------------------------------
+#
+# If you like Automate, please take a look at this page:
+# http://evankelista.net/automate/
+
+"""
+    Optional asyncio core (``System.use_event_loop``).
+
+    A single thread runs an asyncio event loop (:class:`EventLoop`), that waits for everything
+    that Automate otherwise waits for in threads of their own: timers (:class:`EventLoopScheduler`),
+    :class:`~automate.sensors.builtin_sensors.SocketSensor` connections, output of
+    :class:`~automate.sensors.builtin_sensors.ShellSensor` commands, file change events,
+    processes started by ``Shell(..., no_wait=True)`` and the Tornado web server.
+
+    Code that may block (scheduled jobs, i.e. polling sensors and Delay actions) is run in a small
+    thread pool executor, never in the event loop thread. Status changes are still processed
+    by the status worker thread, so the synchronous API of System is unchanged.
+"""
+
+import asyncio
+import concurrent.futures
+import logging
+import threading
+
+from .common import threaded
+from .scheduler import Scheduler
+
+logger = logging.getLogger('automate.eventloop')
+
+
+class EventLoop(object):
+
+    """
+        Asyncio event loop running in a thread of its own, and a thread pool executor
+        (``num_threads`` threads) for blocking functions.
+    """
+
+    def __init__(self, system=None, num_threads=4, name='Event loop'):
+        self.system = system
+        self.loop = asyncio.new_event_loop()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max(int(num_threads), 1))
+        self.loop.set_default_executor(self.executor)
+        self.thread = threading.Thread(target=self._run, name=name)
+        self.thread.daemon = True
+        self._tornado_ioloop = None
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        logger.debug('Event loop starting')
+        self.loop.run_forever()
+        logger.debug('Event loop exiting')
+
+    def start(self):
+        self.thread.start()
+
+    def is_alive(self):
+        return self.thread.is_alive()
+
+    def is_current_thread(self):
+        return threading.current_thread() is self.thread
+
+    def _wrap(self, func, args, kwargs):
+        if self.system is not None:
+            return threaded(self.system, func, *args, **kwargs)
+        return lambda: func(*args, **kwargs)
+
+    def call_soon(self, func, *args, **kwargs):
+        """ Run function in the event loop thread (from any thread), do not wait for it """
+        if self.is_current_thread():
+            self.loop.call_soon(self._wrap(func, args, kwargs))
+        else:
+            self.loop.call_soon_threadsafe(self._wrap(func, args, kwargs))
+
+    def call(self, func, *args, **kwargs):
+        """
+            Run function in the event loop thread and wait for its return value. Asyncio
+            loops are not thread safe, so this is used to set up readers, servers etc.
+        """
+        if self.is_current_thread() or not self.is_alive():
+            return func(*args, **kwargs)
+        future = concurrent.futures.Future()
+
+        def run():
+            try:
+                future.set_result(func(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+        self.loop.call_soon_threadsafe(run)
+        return future.result()
+
+    def create_task(self, coro):
+        """ Run coroutine in the event loop. Returns concurrent.futures.Future. """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run_in_executor(self, func, *args, **kwargs):
+        """ Run (blocking) function in the executor. Returns concurrent.futures.Future. """
+        return self.executor.submit(self._wrap(func, args, kwargs))
+
+    def tornado_ioloop(self):
+        """
+            Tornado IOLoop that runs on this event loop. It is installed as the global IOLoop
+            instance, so Tornado servers created after this use the event loop too.
+        """
+        if self._tornado_ioloop is None:
+            from tornado.platform.asyncio import BaseAsyncIOLoop
+            self._tornado_ioloop = self.call(BaseAsyncIOLoop, asyncio_loop=self.loop)
+            self._tornado_ioloop.install()
+        return self._tornado_ioloop
+
+    async def wait_process(self, process, input=None):
+        """
+            Coroutine that feeds input to a ``subprocess.Popen`` process, reads (and discards) its
+            output and waits until it has exited, without blocking a thread.
+        """
+        if process.stdin:
+            if input:
+                process.stdin.write(input)
+            process.stdin.close()
+        if process.stdout:
+            reader = asyncio.StreamReader()
+            await self.loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), process.stdout)
+            while (await reader.read(4096)):
+                pass
+        while process.poll() is None:
+            await asyncio.sleep(0.1)
+        return process.returncode
+
+    def stop(self, timeout=5.):
+        if self.is_alive():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            if not self.is_current_thread():
+                self.thread.join(timeout)
+        self.executor.shutdown(wait=False)
+        if not self.is_alive():
+            self.loop.close()
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, 'running' if self.is_alive() else 'stopped')
+
+
+class EventLoopScheduler(Scheduler):
+
+    """
+        :class:`~automate.scheduler.Scheduler` that waits for due jobs in the event loop
+        (a single timer handle for the earliest job) and runs them in its executor.
+    """
+
+    def __init__(self, system, event_loop, name='Scheduler'):
+        self.event_loop = event_loop
+        self._handle = None
+        super().__init__(system, num_threads=1, name=name)
+
+    def _start_threads(self):
+        # Must be called with self._condition
+        self.event_loop.call_soon(self._wakeup)
+
+    def _wakeup(self):
+        with self._condition:
+            if self._handle:
+                self._handle.cancel()
+                self._handle = None
+            if self._stopped:
+                return
+            while True:
+                job, wait = self._pop_due()
+                if job is None:
+                    break
+                self.event_loop.run_in_executor(self._run_job, job)
+            if wait is not None:
+                self._handle = self.event_loop.loop.call_later(wait, self._wakeup)
+
+    def stop(self, timeout=5.):
+        super().stop(timeout)
+        if self.event_loop.is_alive():
+            self.event_loop.call_soon(self._wakeup)
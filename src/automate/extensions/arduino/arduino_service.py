@@ -358,9 +358,8 @@ class ArduinoService(AbstractSystemService):
             self.logger.debug('Sending keep-alive message to Arduino')
             self._board.send_sysex(SYSEX_KEEP_ALIVE, [0])
         interval = 60
-        self._keepalive_thread = threading.Timer(interval, threaded(self.system, self._keep_alive))
-        self._keepalive_thread.name = "Arduino keepalive (60s)"
-        self._keepalive_thread.start()
+        self._keepalive_thread = self.system.scheduler.schedule(interval, self._keep_alive,
+                                                                name="Arduino keepalive (60s)")
 
     def _string_data_handler(self, *data):
         str_data = bytearray(data[::2]).decode('ascii')
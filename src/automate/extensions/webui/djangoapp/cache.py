@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# (c) 2015 Tuomas Airaksinen
+#
+# This file is part of automate-webui.
+#
+# automate-webui is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# automate-webui is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with automate-webui.  If not, see <http://www.gnu.org/licenses/>.
+#
+# ------------------------------------------------------------------
+#
+# If you like Automate, please take a look at this page:
+# http://evankelista.net/automate/
+
+"""
+    In-memory caches for web UI views.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache(object):
+
+    """
+        Small cache where entries expire ``ttl`` seconds after they were stored. At most
+        ``maxsize`` entries are kept (least recently stored are removed first).
+    """
+
+    def __init__(self, ttl=10., maxsize=256):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires, value = entry
+            if expires < time.time():
+                del self._data[key]
+                return default
+            return value
+
+    def set(self, key, value):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (time.time() + self.ttl, value)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class FragmentCache(object):
+
+    """
+        Cache of values (rendered HTML fragments etc.) that are computed from an object. Each
+        object has a version counter, that is bumped (:meth:`bump`) when status or configuration
+        of the object changes. Values stored for an older version of the object are not returned.
+        At most ``maxsize`` values are kept (0 disables cache).
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._versions = {}
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def version(self, obj):
+        return self._versions.get(obj, 0)
+
+    def bump(self, obj):
+        with self._lock:
+            self._versions[obj] = self._versions.get(obj, 0) + 1
+
+    def get(self, obj, key, default=None):
+        with self._lock:
+            entry = self._data.get((obj, key))
+            if entry is None or entry[0] != self._versions.get(obj, 0):
+                return default
+            return entry[1]
+
+    def set(self, obj, key, value, version=None):
+        """
+            Store value. ``version`` is the version of obj that value was computed from
+            (read before computing it, so that changes during the computation are not missed).
+        """
+        if self.maxsize <= 0:
+            return
+        if version is None:
+            version = self.version(obj)
+        with self._lock:
+            if version != self._versions.get(obj, 0):
+                return
+            self._data.pop((obj, key), None)
+            self._data[(obj, key)] = (version, value)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
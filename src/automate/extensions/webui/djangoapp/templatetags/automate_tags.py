@@ -128,6 +128,33 @@ def object_status(obj):
         return active_color(obj, obj.get_status_display(), False)
 
 
+# Rendered into cached rows instead of the CSRF token, which is specific to the client
+CSRF_PLACEHOLDER = 'CSRFTOKENPLACEHOLDER'
+
+
+@register.simple_tag(takes_context=True)
+def cached_row(context, template_name, obj, **kwargs):
+    """
+        Same as ``{% include template_name with object=obj ... %}``, but rendered rows are
+        taken from :attr:`WebService.render_cache` as long as obj has not changed. Rows
+        whose status display depends on time (stdev) are not cached.
+    """
+    cache = getattr(context.get('service'), 'render_cache', None)
+    if getattr(obj, 'show_stdev_seconds', 0):
+        cache = None
+    key = (template_name, context.get('source'), context.get('groupview'), tuple(sorted(kwargs.items())))
+    html = cache.get(obj, key) if cache else None
+    if html is None:
+        version = cache.version(obj) if cache else None
+        with context.push(object=obj, csrf_token=CSRF_PLACEHOLDER, **kwargs):
+            html = context.template.engine.get_template(template_name).render(context)
+        if cache:
+            cache.set(obj, key, html, version)
+    if CSRF_PLACEHOLDER in html:
+        html = html.replace(CSRF_PLACEHOLDER, str(context.get('csrf_token', '')))
+    return mark_safe(html)
+
+
 @register.simple_tag
 def condition_string(prog, attr):
     def repl(matchobj):
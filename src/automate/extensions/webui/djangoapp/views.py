@@ -31,7 +31,7 @@ except ImportError:
 
 from django.contrib import messages
 from django.core.urlresolvers import reverse
-from django.http import HttpResponseRedirect, Http404, HttpResponse, JsonResponse
+from django.http import HttpResponseRedirect, Http404, HttpResponse, JsonResponse, HttpResponseBadRequest
 from django.shortcuts import render, redirect
 from django.template import Template, RequestContext
 from django.utils.http import urlencode
@@ -40,7 +40,9 @@ from django.utils.safestring import mark_safe
 from functools import wraps
 from automate.statusobject import AbstractActuator
 from automate.statusobject import AbstractSensor
+from automate.history import history_range, DOWNSAMPLERS
 from .forms import LoginForm, CmdForm, FORMTYPES, QUICK_EDITS, TextForm
+from .cache import TTLCache
 
 
 def set_globals(_service, _system):
@@ -50,6 +52,19 @@ def set_globals(_service, _system):
 
 
 def get_groups(only_user_editable=False, only_user_defined=False, only_groups=False):
+    # Groups change only when objects are added or configuration (tags etc.) is changed
+    cache = service.render_cache
+    key = ('groups', only_user_editable, only_user_defined, only_groups,
+           frozenset(service.user_tags), service.show_hidden)
+    groups = cache.get(service.system, key)
+    if groups is None:
+        version = cache.version(service.system)
+        groups = _get_groups(only_user_editable, only_user_defined, only_groups)
+        cache.set(service.system, key, groups, version)
+    return groups
+
+
+def _get_groups(only_user_editable, only_user_defined, only_groups):
     groups = {}
     if only_user_editable:
         objs = (i for i in service.system.objects_sorted if getattr(i, 'user_editable', False))
@@ -146,12 +161,46 @@ def custom(request, name):
         raise Http404
 
 
+history_cache = TTLCache()
+
+
 @require_login
 def history_json(request, name):
+    """
+        History of object as ``[[time, status], ...]`` (time in milliseconds).
+
+        GET parameters (all optional): ``start`` and ``end`` (milliseconds) limit the time range,
+        ``max_points`` downsamples the series server-side with ``method`` (``lttb``, default,
+        or ``minmax``, see :mod:`automate.history`).
+    """
     obj = service.system.namespace[name]
     if not hasattr(obj, 'history'):
         raise Http404
-    data_points = [(int(t*1000), float(s or 0)) for t, s in obj.history]
+    try:
+        start, end = (float(request.GET[i]) / 1000. if request.GET.get(i) else None for i in ('start', 'end'))
+        max_points = int(request.GET['max_points']) if request.GET.get('max_points') else None
+    except ValueError:
+        return HttpResponseBadRequest('Invalid start, end or max_points')
+    method = request.GET.get('method', 'lttb')
+    if method not in DOWNSAMPLERS:
+        return HttpResponseBadRequest('Unknown method %s' % method)
+
+    history = obj.history_backend or obj.history
+    if history is None:
+        return JsonResponse([], safe=False)
+    # New samples change length of history or time of the last change
+    key = (name, start, end, max_points, method, len(history), obj._last_changed)
+    data_points = history_cache.get(key)
+    if data_points is None:
+        times, statuses = history_range(history, start, end)
+        times = [int(t * 1000) for t in times]
+        statuses = [float(s or 0) for s in statuses]
+        if max_points is not None:
+            data_points = DOWNSAMPLERS[method](times, statuses, max_points)
+        else:
+            data_points = list(zip(times, statuses))
+        history_cache.ttl = service.history_cache_ttl
+        history_cache.set(key, data_points)
     return JsonResponse(data_points, safe=False)
 
 
@@ -184,7 +233,8 @@ def system_view(request):
 def threads(request):
     threads = [(t.name, t) for t in threading.enumerate()]
     threads.sort(key=lambda x: x[0])
-    return render(request, 'views/threads.html', {'threads': threads})
+    jobs = service.system.scheduler.upcoming()
+    return render(request, 'views/threads.html', {'threads': threads, 'jobs': jobs})
 
 
 @require_login
@@ -231,27 +281,38 @@ def tag_view_only_groups(request):
     return tags_view(request, template='views/only_groups.html', only_groups=True)
 
 
+def _info_items(obj):
+    view_items = obj.view[:] + ['class_name', 'data_type', 'next_scheduled_action']
+    if 'change_delay' in view_items and not obj.change_delay:
+        view_items.remove('change_delay')
+        view_items.remove('change_mode')
+    if 'safety_delay' in view_items and not obj.safety_delay:
+        view_items.remove('safety_delay')
+        view_items.remove('safety_mode')
+    if 'reset_delay' in view_items and not obj.reset_delay:
+        view_items.remove('reset_delay')
+    info_items = [(i.capitalize().replace('_', ' '),
+                   getattr(obj, i)) for i in view_items
+                  if (not i.endswith('_str')
+                      and i not in ['tags', 'name', 'priority', 'status', 'history_length',
+                                    'history_frequency']
+                      and (
+                      getattr(obj, i, None) or type(getattr(obj, i, None)) in (int, float)))]
+    return info_items
+
+
 @require_login
 def info_panel(request, name):
     source = request.GET.get('source', 'main')
     if request.is_ajax():
         obj = service.system.namespace[name]
-        view_items = obj.view[:] + ['class_name', 'data_type', 'next_scheduled_action']
-        if 'change_delay' in view_items and not obj.change_delay:
-            view_items.remove('change_delay')
-            view_items.remove('change_mode')
-        if 'safety_delay' in view_items and not obj.safety_delay:
-            view_items.remove('safety_delay')
-            view_items.remove('safety_mode')
-        if 'reset_delay' in view_items and not obj.reset_delay:
-            view_items.remove('reset_delay')
-        info_items = [(i.capitalize().replace('_', ' '),
-                       getattr(obj, i)) for i in view_items
-                      if (not i.endswith('_str')
-                          and i not in ['tags', 'name', 'priority', 'status', 'history_length',
-                                        'history_frequency']
-                          and (
-                          getattr(obj, i, None) or type(getattr(obj, i, None)) in (int, float)))]
+        key = ('info_items', service.render_cache.version(service.system))
+        info_items = service.render_cache.get(obj, key)
+        if info_items is None:
+            version = service.render_cache.version(obj)
+            info_items = _info_items(obj)
+            service.render_cache.set(obj, key, info_items, version)
+        info_items = info_items[:]
         if hasattr(obj, 'stdev'):
             info_items.append(('Stdev (30s)', obj.stdev(30)))
         if hasattr(obj, 'integral'):
@@ -265,12 +326,20 @@ def info_panel(request, name):
 
         callables = ((i.capitalize().replace('_', ' '), i) for i in obj.callables)
 
+        deps = service.system.dependencies
+        dependencies = [(label, sorted(objs, key=lambda o: o.name)) for label, objs in
+                        (('Triggers programs', deps.triggered_programs(obj)),
+                         ('Targeted by programs', deps.targeting_programs(obj)),
+                         ('Affects programs (transitively)', deps.affected_programs(obj)))
+                        if objs]
+
         textform = TextForm({'status': obj.status, 'name': obj.name},
                             source=source) if obj.data_type in ['str', 'unicode'] else None
 
         return render(request, 'info_panel.html',
                       {'i': obj, 'source': source, 'info_items': info_items,
-                       'callables': callables, 'textform': textform})
+                       'callables': callables, 'textform': textform,
+                       'dependencies': dependencies})
     else:
         raise Http404
 
@@ -452,7 +521,7 @@ def reload_service(request, id_):
 def cancel_thread(request, id_):
     id_ = int(id_)
     found = False
-    for t in threading.enumerate():
+    for t in threading.enumerate() + service.system.scheduler.upcoming():
         if id(t) == id_:
             found = True
             try:
@@ -21,6 +21,8 @@ var socket = undefined;
 
 var plot_data = {};
 var plotters = {};
+// Objects whose plots are updated from streamed history samples
+var history_streams = {};
 
 function get_data(data) {
     return [
@@ -79,13 +81,16 @@ function plot(object_name) {
         plotters[object_name].push(plot);
     }
 
-    $.getJSON("/history.json/object/" + object_name, function(data_points) {
+    // Downsampled server-side to about one point per pixel
+    var max_points = Math.max(100, Math.round(targets.first().width()));
+    $.getJSON("/history.json/object/" + object_name, {max_points: max_points}, function(data_points) {
         plot_data[object_name] = data_points;
         $.each(plotters[object_name], function(i, plotter) {
             plotter.setData(get_data(data_points));
             plotter.setupGrid();
             plotter.draw();
         });
+        subscribe_history(object_name);
     });
 
     $("<div id='tooltip-" + object_name + "'></div>").css({
@@ -150,26 +155,63 @@ function object_status_changed(obj)
     $(':input[name="name"][value="' + name + '"]').parent().find('#id_status').val(status);
     var sliders = $('.slider_sensor_'+name);
     sliders.slider('setValue', status);
-    var plotters_ = plotters[name];
-    if(plotters_) {
-        var data = plot_data[name];
-        var prev_t = 0;
+    if(plotters[name] && plot_data[name] && !history_streams[name])
+        append_plot_data(name, [[time, status]]);
+}
 
-        if(data.length > 0)
-            prev_t = data[data.length -1][0];
+function append_plot_data(name, points)
+{
+    var data = plot_data[name];
+    var prev_t = 0;
 
-        data.push([time, status]);
-        $.each(plotters_, function(i, plotter) {
-            plotter.setData(get_data(data));
-            plotter.setupGrid();
-            plotter.draw();
-            if (prev_t) {
-                var xaxis = plotter.getXAxes()[0];
-                var new_left = xaxis.min + (time - prev_t);
-                plotter.pan({left: xaxis.p2c(new_left), top: 0})
-            }
-        });
+    if(data.length > 0)
+        prev_t = data[data.length -1][0];
+
+    for (var i = 0; i < points.length; i++) {
+        // Sample with the same time replaces the last one
+        if (data.length > 0 && data[data.length - 1][0] === points[i][0])
+            data[data.length - 1] = points[i];
+        else
+            data.push(points[i]);
     }
+    var time = data.length > 0 ? data[data.length - 1][0] : 0;
+    $.each(plotters[name] || [], function(i, plotter) {
+        plotter.setData(get_data(data));
+        plotter.setupGrid();
+        plotter.draw();
+        if (prev_t && time > prev_t) {
+            var xaxis = plotter.getXAxes()[0];
+            var new_left = xaxis.min + (time - prev_t);
+            plotter.pan({left: xaxis.p2c(new_left), top: 0})
+        }
+    });
+}
+
+function subscribe_history(name)
+{
+    // Stream history samples that are newer than the ones already plotted
+    if (!socket || socket.readyState !== WebSocket.OPEN || !plot_data[name])
+        return;
+    var data = plot_data[name];
+    var since = data.length > 0 ? data[data.length - 1][0] : null;
+    socket.send(JSON.stringify({action: 'subscribe_history', objects: [name], since: since}));
+    history_streams[name] = true;
+}
+
+function history_received(obj)
+{
+    // Times are delta encoded: t0 and differences to the previous sample
+    var name = obj['name'];
+    if (!plot_data[name])
+        return;
+    var t = obj['t0'];
+    var values = obj['v'];
+    var points = [[t, values[0]]];
+    for (var i = 1; i < values.length; i++) {
+        t += obj['dt'][i - 1];
+        points.push([t, values[i]]);
+    }
+    append_plot_data(name, points);
 }
 
 function update_actuator(obj)
@@ -307,6 +349,31 @@ function refresh_queries() {
     });
 }
 
+function handle_message(obj)
+{
+    switch (obj['action']) {
+        case 'batch':
+            for (var i = 0; i < obj['messages'].length; i++)
+                handle_message(obj['messages'][i]);
+            break;
+        case 'object_status':
+            object_status_changed(obj);
+            break;
+        case 'program_active':
+            program_status_changed(obj);
+            break;
+        case 'log':
+            write_log(obj);
+            break;
+        case 'update_actuator':
+            update_actuator(obj);
+            break;
+        case 'history':
+            history_received(obj);
+            break;
+    }
+}
+
 $(document).ready(function() {
     pre = $('pre.small_log,pre.log');
     pre.scrollTop(pre.prop("scrollHeight"));
@@ -318,21 +385,7 @@ $(document).ready(function() {
     if(window.WebSocket && source !== 'login') {
         socket = new WebSocket(get_websocket_url());
         socket.onmessage = function (evt) {
-            var obj = $.parseJSON(evt.data);
-            switch (obj['action']) {
-                case 'object_status':
-                    object_status_changed(obj);
-                    break;
-                case 'program_active':
-                    program_status_changed(obj);
-                    break;
-                case 'log':
-                    write_log(obj);
-                    break;
-                case 'update_actuator':
-                    update_actuator(obj);
-                    break;
-            }
+            handle_message($.parseJSON(evt.data));
         };
         socket.onclose = function () {
             location.reload();
@@ -350,6 +403,8 @@ $(document).ready(function() {
                     names.push(name)
             }
             socket.send(JSON.stringify({'action': 'subscribe', 'objects': names}));
+            for (var name in plot_data)
+                subscribe_history(name);
             setInterval(function() {
                 socket.send(JSON.stringify({action: 'ping'}));
             }, 20000);
@@ -27,18 +27,27 @@
 
 import json
 import datetime
+from collections import deque
+import threading
 import time
 import os
 
+import tornado.ioloop
 import tornado.web
 from tornado.websocket import WebSocketHandler, WebSocketClosedError
 
-from traits.api import CBool, Tuple, Int, Str, CSet, List, CInt, Dict, Unicode
+from traits.api import CBool, Tuple, Int, Str, CSet, List, CInt, Dict, Unicode, CFloat, Any
 
 from automate.statusobject import StatusObject
+from automate.history import history_since
+from automate.extensions.webui.djangoapp.cache import FragmentCache
 from automate.extensions.wsgi import TornadoService
 from automate import __version__
 
+# Attributes that change with status. Other changes (configuration) may affect rendering
+# of other objects too, so they bump the version of the system in render cache.
+STATUS_ATTRIBUTES = ('status', '_status', '_last_changed', 'changing', 'active', 'program_status_items')
+
 
 class WebService(TornadoService):
 
@@ -65,6 +74,29 @@ class WebService(TornadoService):
     #: Let websocket connection die after ``websocket_timeout`` time of no ping reply from client.
     websocket_timeout = CInt(60 * 5)
 
+    #: Rate (frames per second) at which status changes are pushed to websocket clients. Changes
+    #: of an object within a frame are merged, each change is encoded only once, and each client
+    #: receives the changes of a frame in a single ``batch`` message. If 0, each change is sent
+    #: immediately.
+    websocket_frame_rate = CFloat(10)
+
+    #: Maximum number of messages waiting to be sent to a single websocket client. If a client can not
+    #: keep up, its oldest waiting messages are dropped.
+    websocket_queue_size = CInt(100)
+
+    #: How long (seconds) responses of history.json (range queried and downsampled object histories)
+    #: are cached. Responses are invalidated also when history changes.
+    history_cache_ttl = CFloat(10)
+
+    #: Maximum number of rendered object rows (and other per-object fragments) kept in
+    #: :attr:`render_cache`. 0 disables the cache.
+    render_cache_size = CInt(4096)
+
+    #: Cache of rendered fragments (:class:`~automate.extensions.webui.djangoapp.cache.FragmentCache`).
+    #: Versions of objects are bumped on status and configuration changes, and version of the
+    #: system when configuration of any object (tags, conditions etc.) or set of objects changes.
+    render_cache = Any(transient=True)
+
     #: Tags that are shown in user defined view
     user_tags = CSet(trait=Str, value={'user'})
 
@@ -93,6 +125,12 @@ class WebService(TornadoService):
 
     _sockets = List(transient=True)
 
+    # StatusObject -> (set of changed attributes, time of last change), waiting for the next frame
+    _pending_changes = Any(transient=True)
+    _pending_lock = Any(transient=True)
+    _frame_callback = Any(transient=True)
+    _flush_scheduled = CBool(False, transient=True)
+
     def get_filehandler_class(service):
         class MyFileHandler(tornado.web.StaticFileHandler):
 
@@ -129,7 +167,7 @@ class WebService(TornadoService):
                 self.logger.warning('Insecure settings! Please set proper SECRET_KEY in '
                                     'WebService.django_settings!')
             if not 'TIME_ZONE' in self.django_settings:
-                os.environ.pop('TZ')  # Django uses America/Chicago as default timezone. Let's clean this up.
+                os.environ.pop('TZ', None)  # Django uses America/Chicago as default timezone. Let's clean this up.
                 time.tzset()
             if self.server_url:
                 self.django_settings['SERVER_URL'] = self.server_url
@@ -148,11 +186,20 @@ class WebService(TornadoService):
 
         super().setup()
         if not self.slave:
+            self._pending_changes = {}
+            self._pending_lock = threading.Lock()
+            if self.websocket_frame_rate > 0 and self.is_alive:
+                tornado.ioloop.IOLoop.instance().add_callback(self._start_frames)
             self.system.request_service('LogStoreService').on_trait_change(self.push_log, 'most_recent_line')
 
             self.system.on_trait_change(self.update_sockets, 'objects.status, objects.changing, objects.active, '
                                         'objects.program_status_items')
 
+            self.render_cache = FragmentCache(self.render_cache_size)
+            self.system.on_trait_change(self._object_changed, 'objects.-transient, objects.status, objects.changing, '
+                                        'objects.active, objects.program_status_items')
+            self.system.on_trait_change(self._objects_changed, 'objects_items')
+
     def get_websocket(service):
         if service.slave:
             return service.system.request_service('WebService').get_websocket()
@@ -165,18 +212,47 @@ class WebService(TornadoService):
             def __init__(self, application, request, **kwargs):
                 self.log_requested = False
                 self.subscribed_objects = set()
+                # name -> time of the last history sample sent to client
+                self.history_subscriptions = {}
                 self.last_message = None
                 self.logged_in = False
+                # Messages waiting for the previous write to finish
+                self.outbox = deque(maxlen=service.websocket_queue_size)
+                self.dropped = 0
+                self._writing = False
 
                 super().__init__(application, request, **kwargs)
 
             def check_origin(self, origin):
                 return True
 
-            def write_json(self, **kwargs):
-                msg = json.dumps(kwargs)
+            def send(self, msg):
+                """
+                    Send message (in IOLoop). Only one write is in progress at a time, later messages
+                    wait in the bounded outbox.
+                """
+                if self._writing:
+                    if len(self.outbox) == self.outbox.maxlen:
+                        self.dropped += 1
+                        service.logger.debug('Client %s is too slow, dropping message', self.session_id)
+                    self.outbox.append(msg)
+                    return
                 service.logger.debug('Sending to client %s', msg)
-                self.write_message(msg)
+                try:
+                    future = self.write_message(msg)
+                except WebSocketClosedError:
+                    return
+                if future is not None:
+                    self._writing = True
+                    future.add_done_callback(self._written)
+
+            def _written(self, future):
+                self._writing = False
+                if self.outbox:
+                    self.send(self.outbox.popleft())
+
+            def write_json(self, **kwargs):
+                self.send(json.dumps(kwargs))
 
             def open(self):
                 self.session_id = session_id = getattr(self.request.cookies.get('sessionid', None), 'value', None)
@@ -220,6 +296,24 @@ class WebService(TornadoService):
 
             def _clear_subscriptions(self):
                 self.subscribed_objects.clear()
+                self.history_subscriptions.clear()
+
+            def _subscribe_history(self, objects, since=None):
+                """
+                    Stream history samples of objects, starting from ``since`` (milliseconds, e.g.
+                    time of the last sample client already has). Without ``since``, only new samples
+                    are sent.
+                """
+                since = since / 1000. if since is not None else time.time()
+                for name in objects:
+                    obj = service.system.namespace.get(name, None)
+                    if isinstance(obj, StatusObject) and obj.history is not None:
+                        self.history_subscriptions[name] = since
+                        service.send_history(self, obj)
+
+            def _unsubscribe_history(self, objects):
+                for name in objects:
+                    self.history_subscriptions.pop(name, None)
 
             def _send_command(self, command):
                 if not service.read_only:
@@ -263,34 +357,150 @@ class WebService(TornadoService):
         return WebSocket
 
     def push_log(self, new):
-        for s in self._sockets:
+        if not any(s.log_requested for s in list(self._sockets)):
+            # No client wants log lines (e.g. server is not running), nothing to send
+            return
+        tornado.ioloop.IOLoop.instance().add_callback(self._push_log, new)
+
+    def _push_log(self, new):
+        for s in list(self._sockets):
             if s.log_requested:
-                try:
-                    s.write_json(action='log', data=new)
-                except WebSocketClosedError:
-                    pass
+                s.write_json(action='log', data=new)
+
+    def _start_frames(self):
+        # Called in IOLoop. Changes recorded before the frame timer started are sent right away.
+        self._frame_callback = tornado.ioloop.PeriodicCallback(self.flush_sockets,
+                                                               1000. / self.websocket_frame_rate)
+        self._frame_callback.start()
+        self.flush_sockets()
+
+    def _object_changed(self, obj, attribute, old, new):
+        self.render_cache.bump(obj)
+        if attribute not in STATUS_ATTRIBUTES:
+            self.render_cache.bump(self.system)
+
+    def _objects_changed(self):
+        self.render_cache.bump(self.system)
 
     def update_sockets(self, obj, attribute, old, new):
-        from django.template.loader import render_to_string
-        if isinstance(obj, StatusObject):
-            self.logger.debug('Update_sockets %s %s %s %s', obj, attribute, old, new)
-            for s in self._sockets:
-                if s.last_message and (s.last_message < datetime.datetime.now()
-                                       - datetime.timedelta(seconds=self.websocket_timeout)):
-                    self.logger.info('Closing connection %s due to timeout', s.session_id)
-                    s.on_close()
-                    s.close(code=1000, reason='Timeout')
-                    continue
-                if obj.name in s.subscribed_objects:
-                    if attribute == 'active':
-                        s.write_json(action='program_active', name=obj.name, active=obj.active)
-                    elif attribute in ['status', 'changing']:
-                        s.write_json(action='object_status',
-                                     name=obj.name,
-                                     status=obj.status,
-                                     time=int(1000*time.time()),
-                                     display=obj.get_status_display(),
-                                     changing=obj.changing)
+        if not isinstance(obj, StatusObject) or attribute not in ('status', 'changing', 'active'):
+            return
+        if not self._sockets:
+            # No clients (e.g. server is not running), nothing to send
+            return
+        self.logger.debug('Update_sockets %s %s %s %s', obj, attribute, old, new)
+        # This is run in the thread that changed the status (usually status worker thread), so
+        # change is only recorded here and sent to clients in IOLoop
+        with self._pending_lock:
+            attributes, t = self._pending_changes.get(obj, (set(), None))
+            attributes.add(attribute)
+            self._pending_changes[obj] = attributes, time.time()
+            if self._frame_callback or self._flush_scheduled or not self.is_alive:
+                return
+            self._flush_scheduled = True
+        tornado.ioloop.IOLoop.instance().add_callback(self.flush_sockets)
+
+    def flush_sockets(self):
+        """
+            Send status changes that have been collected since the previous frame (called in IOLoop
+            at ``websocket_frame_rate``, or after each change if it is 0).
+        """
+        with self._pending_lock:
+            pending, self._pending_changes = self._pending_changes, {}
+            self._flush_scheduled = False
+        if pending:
+            self._send_changes(pending)
+
+    def _close_timed_out_sockets(self):
+        timeout = datetime.datetime.now() - datetime.timedelta(seconds=self.websocket_timeout)
+        for s in list(self._sockets):
+            if s.last_message and s.last_message < timeout:
+                self.logger.info('Closing connection %s due to timeout', s.session_id)
+                s.on_close()
+                s.close(code=1000, reason='Timeout')
+
+    def _encode_changes(self, obj, attributes, t):
+        messages = []
+        if 'active' in attributes:
+            messages.append(json.dumps(dict(action='program_active', name=obj.name, active=obj.active)))
+        if 'status' in attributes or 'changing' in attributes:
+            messages.append(json.dumps(dict(action='object_status',
+                                            name=obj.name,
+                                            status=obj.status,
+                                            time=int(1000*t),
+                                            display=obj.get_status_display(),
+                                            changing=obj.changing)))
+        return messages
+
+    def _encode_history(self, obj, since):
+        """
+            Encode history samples of obj at or after ``since`` as a ``history`` message, where times
+            (milliseconds) are delta encoded: ``{"action": "history", "name": name, "t0": first time,
+            "dt": [time differences], "v": [values]}``. Returns ``(time of the last sample, message)``,
+            or None if there are no samples.
+        """
+        # Status worker modifies history without _status_lock, but under _history_lock
+        with obj._history_lock:
+            times, statuses = history_since(obj.history, since)
+        if not times:
+            return None
+        try:
+            values = [float(s or 0) for s in statuses]
+        except (TypeError, ValueError):
+            return None
+        ms = [int(t * 1000) for t in times]
+        msg = json.dumps(dict(action='history', name=obj.name, t0=ms[0],
+                              dt=[b - a for a, b in zip(ms, ms[1:])], v=values))
+        return times[-1], msg
+
+    def send_history(self, socket, obj):
+        """ Send new history samples of obj to socket, if it has subscribed them """
+        msg = self._history_message(socket, obj, {})
+        if msg:
+            socket.send(msg)
+
+    def _history_message(self, socket, obj, encoded):
+        since = socket.history_subscriptions.get(obj.name)
+        if since is None:
+            return None
+        # Subscribers are usually in sync, so samples are encoded once per frame
+        key = obj, since
+        if key not in encoded:
+            encoded[key] = self._encode_history(obj, since)
+        if encoded[key] is None:
+            return None
+        socket.history_subscriptions[obj.name], msg = encoded[key]
+        return msg
+
+    def _send_changes(self, changes):
+        self._close_timed_out_sockets()
+        if not self._sockets:
+            return
+        # Each change is encoded once, regardless of the number of subscribers
+        encoded = [(obj.name, self._encode_changes(obj, attributes, t))
+                   for obj, (attributes, t) in changes.items()]
+        history_objects = [obj for obj, (attributes, t) in changes.items() if 'status' in attributes]
+        encoded_history = {}
+        for s in list(self._sockets):
+            messages = [m for name, msgs in encoded if name in s.subscribed_objects for m in msgs]
+            if s.history_subscriptions:
+                for obj in history_objects:
+                    msg = self._history_message(s, obj, encoded_history)
+                    if msg:
+                        messages.append(msg)
+            if not messages:
+                continue
+            if len(messages) == 1:
+                msg = messages[0]
+            else:
+                msg = '{"action": "batch", "messages": [%s]}' % ', '.join(messages)
+            s.send(msg)
+
+    def cleanup(self):
+        if self._frame_callback:
+            tornado.ioloop.IOLoop.instance().add_callback(self._frame_callback.stop)
+            self._frame_callback = None
+        super().cleanup()
 
     def get_wsgi_application(self):
         from django.core.wsgi import get_wsgi_application
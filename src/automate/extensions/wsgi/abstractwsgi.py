@@ -102,6 +102,11 @@ class TornadoService(AbstractUserService):
         if self.is_alive:
             self.logger.debug('Server is already running, no need to start new')
 
+        event_loop = self.system.event_loop
+        if event_loop:
+            # Tornado runs on the event loop of the system, instead of a thread of its own
+            event_loop.tornado_ioloop()
+
         tornado_app = tornado.web.Application(self.get_tornado_handlers())
 
         if self.ssl_certificate and self.ssl_private_key:
@@ -115,7 +120,10 @@ class TornadoService(AbstractUserService):
         self._http_server = tornado.httpserver.HTTPServer(tornado_app, ssl_options=ssl_options)
 
         try:
-            self._http_server.listen(self.http_port, self.http_ipaddr)
+            if event_loop:
+                event_loop.call(self._http_server.listen, self.http_port, self.http_ipaddr)
+            else:
+                self._http_server.listen(self.http_port, self.http_ipaddr)
         except socket.error as e:
             self.logger.exception('Could not start server: %s', e)
             self._http_server = None
@@ -125,6 +133,8 @@ class TornadoService(AbstractUserService):
 
     def start_ioloop(self):
         global web_thread
+        if self.system.event_loop:
+            return
         ioloop = tornado.ioloop.IOLoop.instance()
         if not ioloop._running:
             web_thread = threading.Thread(target=threaded(self.system, ioloop.start),
@@ -132,7 +142,10 @@ class TornadoService(AbstractUserService):
             web_thread.start()
 
     def cleanup(self):
-        if self.is_alive:
+        if self.is_alive and self.system.event_loop:
+            self.system.event_loop.call(self._http_server.stop)
+            self._http_server = None
+        elif self.is_alive:
             tornado.ioloop.IOLoop.instance().stop()
             self._http_server.stop()
             self._http_server = None
@@ -0,0 +1,426 @@
+# -*- coding: utf-8 -*-
+# (c) 2015 Tuomas Airaksinen
+#
+# This file is part of Automate.
+#
+# Automate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Automate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Automate.  If not, see <http://www.gnu.org/licenses/>.
+#
+# ------------------------------------------------------------------
+#
+# If you like Automate, please take a look at this page:
+# http://evankelista.net/automate/
+
+"""
+    Storage classes for :attr:`~automate.statusobject.StatusObject.history`, and functions
+    to query and downsample histories for plotting.
+"""
+
+import bisect
+import itertools
+from numbers import Number
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def _numeric(status):
+    # Non-numeric statuses are counted as 0 in integrals
+    return status if isinstance(status, Number) else 0.
+
+
+class History(object):
+
+    """
+        Default history store. Drop-in replacement for ``collections.deque(maxlen=...)``
+        of ``(timestamp, status)`` tuples.
+
+        Timestamps and statuses are kept in two parallel lists, so that samples can be
+        looked up by time with binary search. Samples that fall off the beginning are
+        removed in chunks, so appending is amortized O(1).
+
+        Cumulative integral (from the first sample) is maintained for each sample, so
+        that :meth:`integral` needs only two lookups.
+    """
+
+    def __init__(self, iterable=(), maxlen=1000):
+        self.maxlen = max(int(maxlen), 1)
+        self.clear()
+        self.extend(iterable)
+
+    @property
+    def times(self):
+        """ Timestamps as a list """
+        return self._times[self._start:]
+
+    @property
+    def statuses(self):
+        """ Statuses as a list """
+        return self._statuses[self._start:]
+
+    def transpose(self):
+        return self.times, self.statuses
+
+    def status_at(self, T, default=0.):
+        """ Status at time T (i.e. status of the last sample at or before T) """
+        i = bisect.bisect_right(self._times, T, self._start)
+        return self._statuses[i - 1] if i > self._start else default
+
+    def statuses_at(self, Ts, default=0.):
+        """ Statuses at each time in Ts """
+        return [self.status_at(T, default) for T in Ts]
+
+    @property
+    def cumulative(self):
+        """ Cumulative integral at each sample as a list """
+        return self._cumulative[self._start:]
+
+    def cumulative_at(self, T):
+        """ Cumulative integral at time T """
+        i = bisect.bisect_right(self._times, T, self._start)
+        if i == self._start:
+            return self._cumulative[i] if i < len(self._times) else 0.
+        return self._cumulative[i - 1] + _numeric(self._statuses[i - 1]) * (T - self._times[i - 1])
+
+    def integral(self, t_a, t_b):
+        """ Integral of status from t_a to t_b. Status is 0 before the first sample. """
+        return self.cumulative_at(t_b) - self.cumulative_at(t_a)
+
+    def append(self, item):
+        t, s = item
+        if len(self):
+            c = self._cumulative[-1] + _numeric(self._statuses[-1]) * (t - self._times[-1])
+        else:
+            c = 0.
+        if len(self._times) - self._start == self.maxlen:
+            self._start += 1
+            if self._start >= self.maxlen:
+                del self._times[:self._start]
+                del self._statuses[:self._start]
+                del self._cumulative[:self._start]
+                self._start = 0
+        self._times.append(t)
+        self._statuses.append(s)
+        self._cumulative.append(c)
+
+    def extend(self, iterable):
+        for item in iterable:
+            self.append(item)
+
+    def pop(self):
+        if len(self) == 0:
+            raise IndexError('pop from an empty history')
+        self._cumulative.pop()
+        return self._times.pop(), self._statuses.pop()
+
+    def popleft(self):
+        if len(self) == 0:
+            raise IndexError('pop from an empty history')
+        self._start += 1
+        return self._times[self._start - 1], self._statuses[self._start - 1]
+
+    def clear(self):
+        self._times = []
+        self._statuses = []
+        self._cumulative = []
+        self._start = 0
+
+    def copy(self):
+        new = self.__class__.__new__(self.__class__)
+        new.maxlen = self.maxlen
+        new._times = self._times[self._start:]
+        new._statuses = self._statuses[self._start:]
+        new._cumulative = self._cumulative[self._start:]
+        new._start = 0
+        return new
+
+    def __len__(self):
+        return len(self._times) - self._start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(zip(self.times[index], self.statuses[index]))
+        n = len(self)
+        if index < 0:
+            index += n
+        if not 0 <= index < n:
+            raise IndexError('history index out of range')
+        i = self._start + index
+        return self._times[i], self._statuses[i]
+
+    def __iter__(self):
+        return zip(itertools.islice(self._times, self._start, None),
+                   itertools.islice(self._statuses, self._start, None))
+
+    def __reversed__(self):
+        for i in range(len(self._times) - 1, self._start - 1, -1):
+            yield self._times[i], self._statuses[i]
+
+    def __getstate__(self):
+        return {'maxlen': self.maxlen, 'times': self.times, 'statuses': self.statuses}
+
+    def __setstate__(self, state):
+        self.maxlen = state['maxlen']
+        self.clear()
+        self.extend(zip(state['times'], state['statuses']))
+
+    def __repr__(self):
+        return '%s(%r, maxlen=%d)' % (self.__class__.__name__, list(self), self.maxlen)
+
+
+class NumpyHistory(object):
+
+    """
+        Compact history store for numeric statuses. Drop-in replacement for
+        ``collections.deque(maxlen=...)`` of ``(timestamp, status)`` tuples.
+
+        Timestamps and statuses are stored in two preallocated float64 arrays
+        (16 bytes per sample). The arrays have some slack at the end, so appending
+        is amortized O(1) and :attr:`times` and :attr:`statuses` are always
+        contiguous, zero-copy (read only) views to the data. Cumulative integral is
+        maintained in a third array, as in :class:`History`.
+
+        Requires numpy (``pip install automate[numpy]``).
+    """
+
+    #: Minimum number of free slots allocated after maxlen
+    min_slack = 64
+
+    def __init__(self, iterable=(), maxlen=1000):
+        if np is None:
+            raise ImportError('NumpyHistory requires numpy')
+        self._allocate(maxlen)
+        self.extend(iterable)
+
+    def _allocate(self, maxlen):
+        self.maxlen = maxlen = max(int(maxlen), 1)
+        capacity = maxlen + max(maxlen // 8, self.min_slack)
+        self._times = np.empty(capacity, dtype=np.float64)
+        self._statuses = np.empty(capacity, dtype=np.float64)
+        self._cumulative = np.empty(capacity, dtype=np.float64)
+        self._start = 0
+        self._end = 0
+
+    def _compact(self):
+        n = self._end - self._start
+        self._times[:n] = self._times[self._start:self._end]
+        self._statuses[:n] = self._statuses[self._start:self._end]
+        self._cumulative[:n] = self._cumulative[self._start:self._end]
+        self._start, self._end = 0, n
+
+    def _view(self, array):
+        view = array[self._start:self._end]
+        view.flags.writeable = False
+        return view
+
+    @property
+    def times(self):
+        """ Timestamps as numpy array (view) """
+        return self._view(self._times)
+
+    @property
+    def statuses(self):
+        """ Statuses as numpy array (view) """
+        return self._view(self._statuses)
+
+    def transpose(self):
+        return self.times, self.statuses
+
+    def status_at(self, T, default=0.):
+        """ Status at time T (i.e. status of the last sample at or before T) """
+        i = self._start + int(np.searchsorted(self.times, T, 'right'))
+        return float(self._statuses[i - 1]) if i > self._start else default
+
+    def statuses_at(self, Ts, default=0.):
+        """ Statuses at each time in Ts, as numpy array """
+        idx = np.searchsorted(self.times, Ts, 'right') - 1
+        return np.where(idx >= 0, self.statuses[idx.clip(0)] if len(self) else default, default)
+
+    @property
+    def cumulative(self):
+        """ Cumulative integral at each sample as numpy array (view) """
+        return self._view(self._cumulative)
+
+    def cumulative_at(self, T):
+        """ Cumulative integral at time T """
+        if self._end == self._start:
+            return 0.
+        i = self._start + int(np.searchsorted(self.times, T, 'right'))
+        if i == self._start:
+            return float(self._cumulative[i])
+        i -= 1
+        return float(self._cumulative[i] + self._statuses[i] * (T - self._times[i]))
+
+    def integral(self, t_a, t_b):
+        """ Integral of status from t_a to t_b. Status is 0 before the first sample. """
+        return self.cumulative_at(t_b) - self.cumulative_at(t_a)
+
+    def append(self, item):
+        t, s = item
+        if self._end > self._start:
+            last = self._end - 1
+            c = self._cumulative[last] + self._statuses[last] * (t - self._times[last])
+        else:
+            c = 0.
+        if self._end - self._start == self.maxlen:
+            self._start += 1
+        if self._end == len(self._times):
+            self._compact()
+        self._times[self._end] = t
+        self._statuses[self._end] = s
+        self._cumulative[self._end] = c
+        self._end += 1
+
+    def extend(self, iterable):
+        for item in iterable:
+            self.append(item)
+
+    def pop(self):
+        if self._end == self._start:
+            raise IndexError('pop from an empty history')
+        self._end -= 1
+        return float(self._times[self._end]), float(self._statuses[self._end])
+
+    def popleft(self):
+        if self._end == self._start:
+            raise IndexError('pop from an empty history')
+        self._start += 1
+        return float(self._times[self._start - 1]), float(self._statuses[self._start - 1])
+
+    def clear(self):
+        self._start = self._end = 0
+
+    def copy(self):
+        new = self.__class__.__new__(self.__class__)
+        new._allocate(self.maxlen)
+        n = len(self)
+        new._times[:n] = self.times
+        new._statuses[:n] = self.statuses
+        new._cumulative[:n] = self.cumulative
+        new._end = n
+        return new
+
+    def __len__(self):
+        return self._end - self._start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(zip(self.times[index].tolist(), self.statuses[index].tolist()))
+        n = len(self)
+        if index < 0:
+            index += n
+        if not 0 <= index < n:
+            raise IndexError('history index out of range')
+        i = self._start + index
+        return float(self._times[i]), float(self._statuses[i])
+
+    def __iter__(self):
+        return zip(self.times.tolist(), self.statuses.tolist())
+
+    def __reversed__(self):
+        return zip(self.times[::-1].tolist(), self.statuses[::-1].tolist())
+
+    def __getstate__(self):
+        return {'maxlen': self.maxlen, 'times': self.times.copy(), 'statuses': self.statuses.copy()}
+
+    def __setstate__(self, state):
+        self._allocate(state['maxlen'])
+        self.extend(zip(state['times'].tolist(), state['statuses'].tolist()))
+
+    def __repr__(self):
+        return '%s(%r, maxlen=%d)' % (self.__class__.__name__, list(self), self.maxlen)
+
+
+def history_range(history, start=None, end=None):
+    """
+        Samples of history (any history store) from time ``start`` to ``end`` as lists
+        ``(times, statuses)``. Status holds until the next sample, so the sample preceding
+        ``start`` is included too, moved to ``start``.
+    """
+    times, statuses = history.times, history.statuses
+    i = max(bisect.bisect_right(times, start) - 1, 0) if start is not None else 0
+    j = bisect.bisect_right(times, end) if end is not None else len(times)
+    times, statuses = list(times[i:j]), list(statuses[i:j])
+    if start is not None and times and times[0] < start:
+        times[0] = start
+    return times, statuses
+
+
+def history_since(history, T):
+    """
+        Samples of history (any history store) at or after time ``T`` as lists ``(times, statuses)``.
+        Sample at exactly ``T`` is included, because the last sample is replaced in place when
+        samples are more frequent than :attr:`~automate.statusobject.StatusObject.history_frequency`.
+    """
+    times = history.times
+    i = bisect.bisect_left(times, T)
+    return list(times[i:]), list(history.statuses[i:])
+
+
+def lttb(times, values, max_points):
+    """
+        Downsample series to ``max_points`` points with Largest-Triangle-Three-Buckets algorithm,
+        that keeps the visual shape of the series. Returns list of ``(time, value)`` tuples.
+    """
+    n = len(times)
+    if n <= max_points:
+        return list(zip(times, values))
+    if max_points < 3:
+        return [(times[0], values[0]), (times[-1], values[-1])][-max_points:] if max_points > 0 else []
+    bucket = (n - 2) / (max_points - 2)
+    rv = [(times[0], values[0])]
+    a = 0
+    for i in range(max_points - 2):
+        first, last = int(i * bucket) + 1, int((i + 1) * bucket) + 1
+        next_last = min(int((i + 2) * bucket) + 1, n)
+        # Point a, the average of the next bucket and the point of this bucket form a triangle
+        avg_t = sum(times[last:next_last]) / (next_last - last)
+        avg_v = sum(values[last:next_last]) / (next_last - last)
+        t_a, v_a = times[a], values[a]
+        max_area = -1.
+        for k in range(first, last):
+            area = abs((t_a - avg_t) * (values[k] - v_a) - (t_a - times[k]) * (avg_v - v_a))
+            if area > max_area:
+                max_area, a = area, k
+        rv.append((times[a], values[a]))
+    rv.append((times[-1], values[-1]))
+    return rv
+
+
+def minmax(times, values, max_points):
+    """
+        Downsample series to at most ``max_points`` points by taking minimum and maximum of
+        each bucket (``max_points // 2`` buckets of equal number of samples). Keeps all peaks.
+        Returns list of ``(time, value)`` tuples.
+    """
+    n = len(times)
+    if n <= max_points:
+        return list(zip(times, values))
+    buckets = max_points // 2
+    if buckets < 1:
+        return [(times[-1], values[-1])] if max_points > 0 else []
+    rv = []
+    for i in range(buckets):
+        first, last = i * n // buckets, (i + 1) * n // buckets
+        indices = range(first, last)
+        k_min = min(indices, key=values.__getitem__)
+        k_max = max(indices, key=values.__getitem__)
+        for k in sorted({k_min, k_max}):
+            rv.append((times[k], values[k]))
+    return rv
+
+
+#: Downsampling methods by name
+DOWNSAMPLERS = {'lttb': lttb, 'minmax': minmax}
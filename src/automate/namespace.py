@@ -21,10 +21,14 @@
 # If you like Automate, please take a look at this page:
 # http://evankelista.net/automate/
 
+import time
+from collections import defaultdict
+
 from .systemobject import SystemObject
 from .common import Group
 from .service import AbstractService
 from .callable import AbstractCallable
+from . import statefile
 
 
 class Namespace(dict):
@@ -34,6 +38,9 @@ class Namespace(dict):
     """
 
     def __init__(self, system=None, *args, **kwargs):
+        #: Incremented whenever names are added, removed or renamed. Used to invalidate
+        #: cached name resolutions (see :meth:`.AbstractCallable.name_to_system_object`).
+        self.generation = 0
         self.allow_overwrite = []
         self['system'] = self.system = system
         self['reverse'] = self.reverse = {}
@@ -56,7 +63,7 @@ class Namespace(dict):
                 objs.extend(self.give_systemobjects(obj, add_tags | {'group:%s' % name}))
         return objs
 
-    def set_system(self, load_state=None):
+    def set_system(self, load_state=None, restore_state=None):
         if load_state:
             objs = [(i._passed_arguments[1]['name'], i, []) for i in load_state]
         else:
@@ -74,6 +81,8 @@ class Namespace(dict):
         if objs:
             SystemObject._count = max(SystemObject._count, objs[-1][1]._order + 1)
 
+        timings = defaultdict(lambda: {'count': 0, 'setup_system': 0., 'setup_callables': 0.})
+
         self.system.logger.info('Setup obj.system and names in namespace')
 
         for name, obj, groups in objs:
@@ -84,7 +93,11 @@ class Namespace(dict):
 
         self.logger.info('Set up system and groups into object tags')
         for name, obj, groups in objs:
+            t0 = time.perf_counter()
             obj.setup_system(self.system, name, load_state=load_state)
+            timing = timings[obj.__class__.__name__]
+            timing['count'] += 1
+            timing['setup_system'] += time.perf_counter() - t0
 
             if not load_state:
                 is_groups = False
@@ -98,6 +111,10 @@ class Namespace(dict):
         # flush, so that sensor default initial statuses are up to date
         self.system.worker_thread.manual_flush()
 
+        if restore_state:
+            self.system.logger.info('Restoring statuses and histories')
+            statefile.restore_state(self.system, restore_state)
+
         self.system.logger.info('Setup callables. This activates program features.')
 
         def order(x):
@@ -111,12 +128,31 @@ class Namespace(dict):
 
         objs.sort(key=order, reverse=True)
 
-        for name, obj, groups in objs:
-            obj.setup_callables()
+        batched = self.system.batched_startup
+        if batched:
+            self.system.begin_batch()
+            self.system._startup_batch = True
+        try:
+            for name, obj, groups in objs:
+                t0 = time.perf_counter()
+                obj.setup_callables()
+                timings[obj.__class__.__name__]['setup_callables'] += time.perf_counter() - t0
+        finally:
+            if batched:
+                self.system._startup_batch = False
+                t0 = time.perf_counter()
+                self.system.end_batch()
+                timings['evaluation'] = time.perf_counter() - t0
+        self.system.startup_timings = dict(timings)
 
     def __repr__(self):
         return "%s(%s)" % (type(self).__name__, super().__repr__())
 
+    def _names_changed(self):
+        self.generation += 1
+        # Compiled conditions etc. hold resolved references, too
+        AbstractCallable.tree_generation += 1
+
     def __delitem__(self, key):
         o = self[key]
         try:
@@ -128,7 +164,9 @@ class Namespace(dict):
 
         if isinstance(o, SystemObject) and o in self.system.objects:
             self.system.objects.remove(o)
+            self.system.dependencies.remove(o)
         super().__delitem__(key)
+        self._names_changed()
 
     def update(self, d):
         for key, value in list(d.items()):
@@ -149,6 +187,7 @@ class Namespace(dict):
                 raise
 
         super().__setitem__(name, value)
+        self._names_changed()
 
         if name in self.allow_overwrite or is_alias:
             return
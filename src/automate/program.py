@@ -23,12 +23,13 @@
 
 import logging
 
-from traits.api import cached_property, on_trait_change, CFloat, Instance, CBool, CSet, Property
+from traits.api import cached_property, on_trait_change, CFloat, Instance, CBool, CSet, Property, Dict
 
 from .common import (LogicStr, Lock, NameOrSensorActuatorBaseTrait,
-                     AbstractStatusObject)
+                     AbstractStatusObject, SystemNotReady)
 from .systemobject import SystemObject
-from .callable import AbstractCallable
+from .callable import AbstractCallable, ConditionCache
+from .compiler import compile_callable
 
 
 class ProgrammableSystemObject(SystemObject):
@@ -90,6 +91,12 @@ class ProgrammableSystemObject(SystemObject):
 
     _trigger_lock = Instance(Lock, transient=True)
 
+    #: Cache of condition values (see :attr:`~automate.system.System.incremental_evaluation`)
+    _condition_cache = Instance(ConditionCache, transient=True)
+
+    #: Compiled condition functions (see :attr:`~automate.system.System.compile_conditions`)
+    _compiled_conditions = Dict(transient=True)
+
     def __init__(self, *args, **kwargs):
         self._trigger_lock = Lock('triggerlock')
         super().__init__(*args, **kwargs)
@@ -173,6 +180,51 @@ class ProgrammableSystemObject(SystemObject):
         self.logger.debug('_get_actual_targets for %s gives %s', self, actual_targets)
         return actual_targets
 
+    def _get_condition_cache(self):
+        if not self.system or not self.system.incremental_evaluation:
+            if self._condition_cache is not None:
+                self._condition_cache.clear()
+                self._condition_cache = None
+            return None
+        if self._condition_cache is None:
+            self._condition_cache = ConditionCache()
+        self._condition_cache.validate([self.active_condition, self.update_condition])
+        return self._condition_cache
+
+    def _get_compiled_condition(self, condition):
+        generation, compiled_condition, func = self._compiled_conditions.get(id(condition), (None, None, None))
+        if compiled_condition is not condition or generation != AbstractCallable.tree_generation:
+            try:
+                func = compile_callable(condition)
+            except SystemNotReady:
+                return condition.call
+            except Exception as e:
+                self.logger.exception('Could not compile %s: %s', condition, e)
+                func = condition.call
+            # Forget functions of replaced conditions
+            compiled = {key: value for key, value in self._compiled_conditions.items()
+                        if value[1] is self.active_condition or value[1] is self.update_condition}
+            compiled[id(condition)] = (AbstractCallable.tree_generation, condition, func)
+            self._compiled_conditions = compiled
+        return func
+
+    def evaluate_condition(self, condition, trigger=None):
+        """
+            Evaluate condition callable (:attr:`active_condition` or :attr:`update_condition`).
+            If :attr:`~automate.system.System.compile_conditions` is enabled, condition is evaluated
+            by a compiled function. If :attr:`~automate.system.System.incremental_evaluation` is enabled,
+            only the parts of the condition that depend on changed statuses are evaluated again.
+        """
+        kwargs = {} if trigger is None else {'trigger': trigger}
+        if self.system and self.system.compile_conditions:
+            return self._get_compiled_condition(condition)(self, **kwargs)
+        cache = self._get_condition_cache()
+        if cache is None:
+            return condition.call(self, **kwargs)
+        if trigger is not None:
+            cache.invalidate(trigger)
+        return cache.call(condition, self, **kwargs)
+
     @on_trait_change('actual_triggers')
     def actual_triggers_changed(self, obj, name, old, new):
         if old is None:
@@ -180,16 +232,13 @@ class ProgrammableSystemObject(SystemObject):
         if old == new:
             return
         self.logger.debug('Actual triggers changed by %s: %s->%s', name, old, new)
-        for t in old - new:
-            self.logger.debug("Removing trigger %s", t)
-            t.on_trait_change(self.trigger_status_changed, "status", remove=True)
-
-        for t in new - old:
-            self.logger.debug("Adding trigger %s", t)
-            t.on_trait_change(self.trigger_status_changed, "status")
+        # Status changes of triggers are dispatched to trigger_status_changed via the index
+        self.system.dependencies.update(self, 'triggers', old - new, new - old)
+        if self.system.defer_setup_evaluation(self):
+            return
 
         old_active = self.active
-        self.active = bool(self.active_condition.call(self))
+        self.active = bool(self.evaluate_condition(self.active_condition))
         if self.active != old_active:
             self.update_activation(self.active)
 
@@ -200,8 +249,11 @@ class ProgrammableSystemObject(SystemObject):
         if old is None:
             old = set()
         self.logger.debug('Actual targets changed %s->%s', old, new)
+        self.system.dependencies.update(self, 'targets', old - new, new - old)
+        if self.system.defer_setup_evaluation(self):
+            return
         old_active = self.active
-        new_active = self.active = bool(self.active_condition.call(self))
+        new_active = self.active = bool(self.evaluate_condition(self.active_condition))
         if new_active != old_active:
             self.update_activation(new_active)
 
@@ -218,7 +270,7 @@ class ProgrammableSystemObject(SystemObject):
                 t.activate_program(self)
             self.on_activate.setup_callable_system(self.system)
             self.on_activate.call(self, trigger=trigger, action='activate')
-            if bool(self.update_condition.call(self, trigger=trigger)):
+            if bool(self.evaluate_condition(self.update_condition, trigger=trigger)):
                 self.on_update.setup_callable_system(self.system)
                 self.on_update.cancel(self)
                 self.on_update.call(self, trigger=trigger, action='update')
@@ -232,25 +284,36 @@ class ProgrammableSystemObject(SystemObject):
 
     def trigger_status_changed(self, obj, name, old, new):
         self.logger.debug("Trigger status changed from %s %s: %s->%s", obj, name, old, new)
+        if self.system.defer_evaluation(self, obj):
+            self.logger.debug("Evaluation deferred to the end of batch")
+            return
+        self.evaluate(obj)
+
+    def evaluate(self, trigger):
+        """
+            Evaluate conditions and run actions, as a result of status change of trigger.
+        """
         with self._trigger_lock:
             old_active = self.active
-            new_active = self.active = bool(self.active_condition.call(self, trigger=obj))
+            new_active = self.active = bool(self.evaluate_condition(self.active_condition, trigger=trigger))
             if new_active != old_active:
-                self.update_activation(new_active, trigger=obj)
+                self.update_activation(new_active, trigger=trigger)
             if old_active == new_active == True:
-                if bool(self.update_condition.call(self, trigger=obj)):
+                if bool(self.evaluate_condition(self.update_condition, trigger=trigger)):
                     self.on_update.cancel(self)
-                    self.on_update.call(self, trigger=obj, action='update')
+                    self.on_update.call(self, trigger=trigger, action='update')
         self.logger.debug("Trigger status changing ready")
 
     @on_trait_change("active_condition, on_activate, on_deactivate")
     def _update_activation_actions(self, name, new):
         self.logger.debug('Update activation actions %s', name)
         getattr(self, name).setup_callable_system(self.system)
+        if self.system.defer_setup_evaluation(self):
+            return
 
         if name == 'active_condition':
             old_active = self.active
-            self.active = bool(self.active_condition.call(self))
+            self.active = bool(self.evaluate_condition(self.active_condition))
             if old_active != self.active:
                 self.update_activation(self.active)
 
@@ -262,14 +325,17 @@ class ProgrammableSystemObject(SystemObject):
     def _update_update_actions(self, name, new):
         self.logger.debug('Update update actions %s', name)
         getattr(self, name).setup_callable_system(self.system)
+        if self.system.defer_setup_evaluation(self):
+            return
 
-        if self.active and bool(self.update_condition.call(self)):
+        if self.active and bool(self.evaluate_condition(self.update_condition)):
             self.on_update.cancel(self)
             self.on_update.call(self, action='update')
 
     def setup_system(self, system, *args, **kwargs):
         from .callables import Value
         c = self.get_default_callables()
+        self._default_callables = c.copy()  # Creating callables is slow, so reuse in setup_callables
         c.pop('active_condition')  # We do not want to activate program at this phase.
         c.pop('update_condition')  # nor do we want to run on_update
         self.active_condition = Value(False)
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+# (c) 2015 Tuomas Airaksinen
+#
+# This file is part of Automate.
+#
+# Automate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Automate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Automate.  If not, see <http://www.gnu.org/licenses/>.
+#
+# ------------------------------------------------------------------
+#
+# If you like Automate, please take a look at this page:
+# http://evankelista.net/automate/
+
+"""
+    Shared timer scheduler (:attr:`automate.system.System.scheduler`), used instead of
+    a ``threading.Timer`` (i.e. a new thread) for each delayed or periodic action.
+"""
+
+import datetime
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+from .common import threaded
+
+logger = logging.getLogger('automate.scheduler')
+
+
+class ScheduledJob(object):
+
+    """
+        Handle of a job scheduled in :class:`Scheduler`. Provides the parts of the
+        ``threading.Timer`` interface that are used for timers: :meth:`cancel`,
+        :meth:`is_alive` and :attr:`name`.
+    """
+
+    def __init__(self, scheduler, when, func, name='', interval=None):
+        self.scheduler = scheduler
+        #: Time (as in time.time()) of the next run
+        self.time = when
+        self.func = func
+        self.name = name
+        #: Period of a periodic job (None for one-shot jobs)
+        self.interval = interval
+        self.cancelled = False
+        self.finished = False
+
+    @property
+    def next_action(self):
+        """ Time of the next run as datetime """
+        return datetime.datetime.fromtimestamp(self.time)
+
+    def cancel(self):
+        """ Cancel job. Job that is already running is not interrupted. """
+        self.cancelled = True
+        self.scheduler._cancelled(self)
+
+    def is_alive(self):
+        """ True until job is cancelled, or (one-shot job) has been run """
+        return not (self.cancelled or self.finished)
+
+    def __repr__(self):
+        return '<%s %s at %s>' % (self.__class__.__name__, self.name, self.next_action)
+
+
+class Scheduler(object):
+
+    """
+        Runs jobs at given times, from a single heap of jobs. Due jobs are run by a small
+        pool of threads (``num_threads``), that are started when the first job is scheduled.
+        Periodic jobs are scheduled at fixed intervals from their first run, so that they do
+        not drift even if running the job takes time.
+    """
+
+    def __init__(self, system=None, num_threads=1, name='Scheduler'):
+        self.system = system
+        self.num_threads = max(int(num_threads), 1)
+        self.name = name
+        self._heap = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._threads = []
+        self._stopped = False
+
+    def _start_threads(self):
+        # Must be called with self._condition
+        while len(self._threads) < self.num_threads:
+            t = threading.Thread(target=self._run, name='%s thread %d' % (self.name, len(self._threads)))
+            t.daemon = True
+            self._threads.append(t)
+            t.start()
+
+    def _push(self, job):
+        with self._condition:
+            if self._stopped:
+                job.cancelled = True
+                return job
+            heapq.heappush(self._heap, (job.time, next(self._counter), job))
+            self._start_threads()
+            self._condition.notify()
+        return job
+
+    def _wrap(self, func, args, kwargs):
+        if self.system is not None:
+            return threaded(self.system, func, *args, **kwargs)
+        return lambda: func(*args, **kwargs)
+
+    def schedule(self, delay, func, *args, name='', **kwargs):
+        """ Run ``func(*args, **kwargs)`` after ``delay`` seconds. Returns :class:`ScheduledJob`. """
+        job = ScheduledJob(self, time.time() + max(delay, 0.), self._wrap(func, args, kwargs),
+                           name=name or getattr(func, '__name__', ''))
+        return self._push(job)
+
+    def schedule_at(self, when, func, *args, name='', **kwargs):
+        """ Run ``func(*args, **kwargs)`` at time ``when`` (datetime or timestamp) """
+        if isinstance(when, datetime.datetime):
+            when = when.timestamp()
+        return self.schedule(when - time.time(), func, *args, name=name, **kwargs)
+
+    def schedule_periodic(self, interval, func, *args, name='', delay=0., **kwargs):
+        """
+            Run ``func(*args, **kwargs)`` every ``interval`` seconds, starting after ``delay``
+            seconds. Runs that are missed (because the previous run took longer than interval)
+            are skipped.
+        """
+        if interval <= 0:
+            raise ValueError('Interval must be positive')
+        job = ScheduledJob(self, time.time() + max(delay, 0.), self._wrap(func, args, kwargs),
+                           name=name or getattr(func, '__name__', ''), interval=interval)
+        return self._push(job)
+
+    def _cancelled(self, job):
+        with self._condition:
+            # Removed lazily from the heap; wake up threads so that they can skip it
+            self._condition.notify_all()
+
+    def upcoming(self, limit=None):
+        """ Pending jobs ordered by time of the next run """
+        with self._condition:
+            jobs = [job for t, c, job in sorted(self._heap) if not job.cancelled]
+        return jobs[:limit] if limit is not None else jobs
+
+    def __len__(self):
+        with self._condition:
+            return sum(1 for t, c, job in self._heap if not job.cancelled)
+
+    def _pop_due(self):
+        """
+            Must be called with ``self._condition``. Returns ``(job, None)`` if a job is due,
+            otherwise ``(None, seconds until the next job)`` (``None`` if there are no jobs).
+        """
+        while self._heap and self._heap[0][2].cancelled:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return None, None
+        wait = self._heap[0][0] - time.time()
+        if wait > 0:
+            return None, wait
+        return heapq.heappop(self._heap)[2], None
+
+    def _next_job(self):
+        with self._condition:
+            while True:
+                if self._stopped:
+                    return None
+                job, wait = self._pop_due()
+                if job is not None:
+                    return job
+                self._condition.wait(wait)
+
+    def _run_job(self, job):
+        if job.cancelled:
+            return
+        try:
+            job.func()
+        except Exception as e:
+            logger.exception('Exception in scheduled job %s: %s', job.name, e)
+        if not job.interval:
+            job.finished = True
+        elif not job.cancelled:
+            # Drift-free: next run is counted from the scheduled time, not from now. Job is
+            # pushed back only after it has finished, so that runs never overlap.
+            now = time.time()
+            job.time += job.interval
+            if job.time <= now:
+                job.time += ((now - job.time) // job.interval + 1) * job.interval
+            self._push(job)
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            self._run_job(job)
+
+    def stop(self, timeout=5.):
+        """ Cancel all jobs and stop threads """
+        with self._condition:
+            self._stopped = True
+            for t, c, job in self._heap:
+                job.cancelled = True
+            self._heap.clear()
+            self._condition.notify_all()
+            threads, self._threads = self._threads, []
+        for t in threads:
+            if t is not threading.current_thread():
+                t.join(timeout)
+
+    def __repr__(self):
+        return '<%s %d jobs, %d threads>' % (self.__class__.__name__, len(self), len(self._threads))
@@ -25,6 +25,7 @@
     Module for various Sensor classes.
 """
 
+import asyncio
 import socket
 import subprocess
 import types
@@ -39,7 +40,7 @@ from croniter import croniter
 from traits.api import Any, CInt, CFloat, Unicode, CUnicode, CBool, Instance, CStr, Int, Property
 
 from automate.common import get_modules_all, LogicStr
-from automate.common import threaded, Lock
+from automate.common import Lock
 from automate.statusobject import AbstractSensor
 from automate.callables import Value
 from automate.callable import AbstractCallable
@@ -220,9 +221,9 @@ class CronTimerSensor(AbstractSensor):
 
         delay = next_update_time - now + timedelta(seconds=5)
         self.logger.info('Setting timer to %s, %s seconds, at %s', delay, delay.seconds, now+delay)
-        self._update_timer = threading.Timer(delay.seconds, threaded(self.system, self.update_status,))
-        self._update_timer.name = ("Timer for TimerSensor %s at %s (%s seconds)" % (self.name, now + delay, delay.seconds))
-        self._update_timer.start()
+        self._update_timer = self.system.scheduler.schedule(
+            delay.seconds, self.update_status,
+            name="Timer for TimerSensor %s at %s (%s seconds)" % (self.name, now + delay, delay.seconds))
 
     def cleanup(self):
         with self._timerlock:
@@ -259,25 +260,41 @@ class FileChangeSensor(AbstractSensor):
 
     def setup(self):
         if self._notifier:
-            self._notifier.stop()
+            self._stop_notifier()
         wm = pyinotify.WatchManager()
         handler = self.InotifyEventHandler(self.notify)
-        self._notifier = pyinotify.ThreadedNotifier(wm, default_proc_fun=handler)
+        event_loop = self.system.event_loop
+        if event_loop:
+            self._notifier = event_loop.call(pyinotify.AsyncioNotifier, wm, event_loop.loop,
+                                             default_proc_fun=handler)
+        else:
+            self._notifier = pyinotify.ThreadedNotifier(wm, default_proc_fun=handler)
 
         wm.add_watch(self.filename, self.watch_flags, rec=True)
-        self._notifier.start()
+        if not event_loop:
+            self._notifier.start()
+
+    def _stop_notifier(self):
+        if isinstance(self._notifier, pyinotify.AsyncioNotifier):
+            self.system.event_loop.call(self._notifier.stop)
+        else:
+            self._notifier.stop()
 
     def cleanup(self):
-        self._notifier.stop()
+        self._stop_notifier()
 
 
 class AbstractPollingSensor(AbstractSensor):
 
     """ Abstract baseclass for sensor that polls periodically its status"""
 
-    #: How often to do polling
+    #: How often to do polling (seconds). Intervals shorter than :attr:`min_interval` are
+    #: rounded up to it.
     interval = CFloat(5)
 
+    #: Shortest polling interval (seconds)
+    min_interval = CFloat(0.01)
+
     #: This can be used to enable/disable polling
     poll_active = CBool(True)
 
@@ -295,7 +312,7 @@ class AbstractPollingSensor(AbstractSensor):
             return
         if new:
             self._restart()
-        else:
+        elif self._pollthread:
             self._pollthread.cancel()
 
     def _restart(self):
@@ -305,10 +322,22 @@ class AbstractPollingSensor(AbstractSensor):
             self._pollthread.cancel()
         if self.poll_active:
             self.update_status()
-            self._pollthread = threading.Timer(self.interval, threaded(self.system, self._restart))
-            time_after_interval = datetime.now() + timedelta(seconds=self.interval)
-            self._pollthread.name = "PollingSensor: %s next poll at %s (%.2f sek)" % (self.name, time_after_interval, self.interval)
-            self._pollthread.start()
+            self._schedule_polling()
+
+    def _schedule_polling(self):
+        # Periodic job of the system scheduler: polls are kept at fixed intervals, regardless of
+        # how long update_status takes
+        interval = max(self.interval, self.min_interval, 1e-6)
+        self._pollthread = self.system.scheduler.schedule_periodic(
+            interval, self.update_status, delay=interval,
+            name="PollingSensor: %s (%.2f sek)" % (self.name, interval))
+
+    def _interval_changed(self, old, new):
+        if not self.traits_inited() or self._stop:
+            return
+        if self._pollthread and self._pollthread.is_alive():
+            self._pollthread.cancel()
+            self._schedule_polling()
 
     def update_status(self):
         pass
@@ -397,8 +426,34 @@ class SocketSensor(AbstractSensor):
     stop = CBool(transient=True)
 
     _socket = Instance(socket.socket, transient=True)
+    _server = Any(transient=True)
     _status = CInt
 
+    class Protocol(asyncio.Protocol):
+
+        """ Connection handler, if event loop is used (see System.use_event_loop) """
+
+        def __init__(self, sensor):
+            self.sensor = sensor
+            self.transport = None
+
+        def connection_made(self, transport):
+            self.transport = transport
+            self.sensor.logger.info('%s connected from %s', self.sensor.name, transport.get_extra_info('peername'))
+
+        def data_received(self, data):
+            try:
+                self.sensor.status = int(data.strip())
+                self.transport.write(b'OK\n')
+            except ValueError:
+                if data.strip() == b'close':
+                    self.transport.close()
+                else:
+                    self.transport.write(b'NOK\n')
+
+        def connection_lost(self, exc):
+            self.sensor.logger.info('%s: connection closed', self.sensor.name)
+
     def listen_loop(self):
         while not self.stop:
             try:
@@ -440,11 +495,19 @@ class SocketSensor(AbstractSensor):
     def setup(self):
         self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self._socket.bind((self.host, self.port))
+        event_loop = self.system.event_loop
+        if event_loop:
+            self.logger.info('%s listening to connections in port %s', self.name, self.port)
+            self._server = event_loop.create_task(
+                event_loop.loop.create_server(lambda: self.Protocol(self), sock=self._socket)).result()
+            return
         t = threading.Thread(target=self.listen_loop, name='SocketSensor %s' % self.name)
         t.start()
 
     def cleanup(self):
         self.stop = True
+        if self._server:
+            self.system.event_loop.call(self._server.close)
 
 
 class ShellSensor(AbstractSensor):
@@ -491,6 +554,29 @@ class ShellSensor(AbstractSensor):
                 self.logger.debug('Process exiting (cmd_loop)')
                 break
 
+    async def read_output(self, simple):
+        """ Read output of the command in the event loop (see System.use_event_loop) """
+        reader = asyncio.StreamReader()
+        await self.system.event_loop.loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader),
+                                                            self._process.stdout)
+        args = (self,) if self.caller else ()
+        while True:
+            line = (await reader.readline()).decode('utf-8')
+            if simple and line:
+                self.status = self.filter(line, *args) if self.filter else line
+            elif not simple:
+                self._queue.put(line)
+            if not line:
+                self.logger.debug('Process exiting (read_output)')
+                break
+
+    def _test_filter(self):
+        # Let's test if filter is 'simple' or not
+        if self.filter:
+            tst = self.filter('test line')
+            if not isinstance(tst, types.GeneratorType):
+                self._simple = True
+
     def status_loop(self):
         args = (self,) if self.caller else ()
 
@@ -505,11 +591,7 @@ class ShellSensor(AbstractSensor):
         def simple_filter(line, *args):
             return line
 
-        # Let's test if filter is 'simple' or not
-        if self.filter:
-            tst = self.filter('test line')
-            if not isinstance(tst, types.GeneratorType):
-                self._simple = True
+        self._test_filter()
 
         if self._simple:
             filter = self.filter or simple_filter
@@ -530,6 +612,17 @@ class ShellSensor(AbstractSensor):
 
     def setup(self):
         self._queue = queue.Queue()
+        event_loop = self.system.event_loop
+        if event_loop:
+            # Output is read in the event loop. Only generator filters, that block on the queue,
+            # need a thread.
+            self._test_filter()
+            simple = self._simple or not self.filter
+            self._process = subprocess.Popen(self.cmd, shell=True, executable='bash', stdout=subprocess.PIPE)
+            event_loop.create_task(self.read_output(simple))
+            if not simple:
+                threading.Thread(target=self.status_loop, name='ShellSensor.status_loop %s' % self.name).start()
+            return
         t1 = threading.Thread(target=self.cmd_loop, name='ShellSensor.cmd_loop %s' % self.name)
         t1.start()
         t2 = threading.Thread(target=self.status_loop, name='ShellSensor.status_loop %s' % self.name)
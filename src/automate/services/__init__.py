@@ -25,3 +25,4 @@ from .logstore import LogStoreService
 from .statussaver import StatusSaverService
 from .textui import TextUIService
 from .plantumlserv import PlantUMLService
+from .historystore import HistoryStoreService
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+# (c) 2015 Tuomas Airaksinen
+#
+# This file is part of Automate.
+#
+# Automate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Automate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Automate.  If not, see <http://www.gnu.org/licenses/>.
+#
+# ------------------------------------------------------------------
+#
+# If you like Automate, please take a look at this page:
+# http://evankelista.net/automate/
+
+import bisect
+import math
+import mmap
+import os
+import struct
+import threading
+from numbers import Number
+
+from traits.api import Str, CInt, Dict
+
+from automate.service import AbstractUserService
+from automate.statusobject import StatusObject
+
+__all__ = ['HistoryStoreService']
+
+
+class HistoryFile(object):
+
+    """
+        Append-only file of fixed size records ``(timestamp, status, cumulative integral)``
+        (three little-endian doubles). Reads are done from a read-only memory map without
+        copying. File is grown in steps (zero padded, trimmed on close), so that it needs to
+        be mapped again only when it grows, not after each appended record.
+    """
+
+    record = struct.Struct('<ddd')
+
+    #: Minimum number of records that file is grown at a time
+    min_slack = 1024
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        mode = 'r+b' if os.path.exists(path) else 'w+b'
+        self._file = open(path, mode, buffering=0)
+        size = os.fstat(self._file.fileno()).st_size
+        self.capacity = size // self.record.size
+        if size % self.record.size:
+            self._file.truncate(self.capacity * self.record.size)
+        self.count = self._find_count()
+        self._last = self._read(self.count - 1)
+        self._prev = self._read(self.count - 2)
+        self._mmap = None
+        self._view = None
+
+    def _find_count(self):
+        # Padding (if file was not closed properly) has zero timestamps, records increasing ones
+        lo, hi = 0, self.capacity
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._read(mid)[0] > 0:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _read(self, index):
+        if index < 0:
+            return None
+        self._file.seek(index * self.record.size)
+        return self.record.unpack(self._file.read(self.record.size))
+
+    def _write(self, index, t, s, prev):
+        if prev:
+            t_prev, s_prev, c_prev = prev
+            c = c_prev + (0. if math.isnan(s_prev) else s_prev) * (t - t_prev)
+        else:
+            c = 0.
+        self._file.seek(index * self.record.size)
+        self._file.write(self.record.pack(t, s, c))
+        return t, s, c
+
+    def write(self, t, s):
+        """
+            Append a sample. If timestamp is the same as in the last record, last record
+            is replaced (see :attr:`~automate.statusobject.StatusObject.history_frequency`).
+        """
+        s = float(s) if isinstance(s, Number) else float('nan')
+        with self._lock:
+            if self._last and t == self._last[0]:
+                self._last = self._write(self.count - 1, t, s, self._prev)
+            elif not self._last or t > self._last[0]:
+                if self.count >= self.capacity:
+                    self.capacity = self.count + max(self.count // 8, self.min_slack)
+                    self._file.truncate(self.capacity * self.record.size)
+                self._prev, self._last = self._last, self._write(self.count, t, s, self._last)
+                self.count += 1
+
+    def _columns(self):
+        # Must be called with self._lock
+        if self._view is None or len(self._view) < self.count * 3:
+            # Whole file (with slack) is mapped. Old map is released when views to it are no
+            # longer used.
+            self._mmap = mmap.mmap(self._file.fileno(), self.capacity * self.record.size,
+                                   access=mmap.ACCESS_READ)
+            self._view = memoryview(self._mmap).cast('d')
+        view = self._view[:self.count * 3]
+        return view[0::3], view[1::3], view[2::3]
+
+    @property
+    def times(self):
+        """ Timestamps (memoryview of doubles) """
+        with self._lock:
+            return self._columns()[0] if self.count else []
+
+    @property
+    def statuses(self):
+        """ Statuses (memoryview of doubles) """
+        with self._lock:
+            return self._columns()[1] if self.count else []
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return zip(self.times, self.statuses)
+
+    def status_at(self, T, default=0.):
+        with self._lock:
+            if not self.count:
+                return default
+            times, statuses, cumulative = self._columns()
+            i = bisect.bisect_right(times, T)
+            return statuses[i - 1] if i else default
+
+    def statuses_at(self, Ts, default=0.):
+        return [self.status_at(T, default) for T in Ts]
+
+    def cumulative_at(self, T):
+        with self._lock:
+            if not self.count:
+                return 0.
+            times, statuses, cumulative = self._columns()
+            i = bisect.bisect_right(times, T)
+            if not i:
+                return cumulative[0]
+            s = statuses[i - 1]
+            return cumulative[i - 1] + (0. if math.isnan(s) else s) * (T - times[i - 1])
+
+    def integral(self, t_a, t_b):
+        return self.cumulative_at(t_b) - self.cumulative_at(t_a)
+
+    def close(self):
+        with self._lock:
+            self._view = None
+            if self._mmap is not None:
+                try:
+                    self._mmap.close()
+                except BufferError:
+                    pass  # Views are still in use, closed when they are released
+                self._mmap = None
+            self._file.truncate(self.count * self.record.size)
+            self._file.close()
+
+    def __repr__(self):
+        return '<%s %s (%d samples)>' % (self.__class__.__name__, self.path, self.count)
+
+
+class HistoryStoreService(AbstractUserService):
+
+    """
+        Persistent, long term history of numeric statuses of StatusObjects. Each object's
+        status changes are appended to a file of fixed size records in :attr:`directory`.
+
+        Files are read via memory maps, and objects' :attr:`~automate.statusobject.StatusObject.history_backend`
+        is set, such that :meth:`~automate.statusobject.StatusObject.integral`,
+        :meth:`~automate.statusobject.StatusObject.status_at_time` and history plots in Web UI
+        use it for time ranges that are not in the in-memory history any more.
+    """
+
+    #: Directory for history files. Default: :attr:`~automate.system.System.filename` + '.history'
+    directory = Str
+
+    #: If set, :attr:`~automate.statusobject.StatusObject.history_length` of objects is set to this
+    #: (i.e. in-memory history is just a short hot tail of the data)
+    hot_history_length = CInt(0)
+
+    _files = Dict(transient=True)
+
+    def setup(self):
+        if not self.directory:
+            if not self.system.filename:
+                self.logger.warning('Neither HistoryStoreService.directory or System.filename is set, '
+                                  'history is not stored')
+                return
+            self.directory = self.system.filename + '.history'
+        os.makedirs(self.directory, exist_ok=True)
+
+        for obj in self.system.objects:
+            if isinstance(obj, StatusObject):
+                if self.hot_history_length:
+                    obj.history_length = self.hot_history_length
+                if os.path.exists(self._path(obj)):
+                    self._get_file(obj)
+
+        self.system.on_trait_change(self.status_changed, 'objects.status')
+
+    def _path(self, obj):
+        return os.path.join(self.directory, '%s.hist' % obj.name)
+
+    def _get_file(self, obj):
+        history_file = self._files.get(obj.name)
+        if history_file is None:
+            history_file = self._files[obj.name] = HistoryFile(self._path(obj))
+            obj.history_backend = history_file
+        return history_file
+
+    def status_changed(self, obj, name, new):
+        if not isinstance(obj, StatusObject) or not obj.history:
+            return
+        t, s = obj.history[-1]
+        if not isinstance(s, Number):
+            return
+        self._get_file(obj).write(t, s)
+
+    def cleanup(self):
+        self.system.on_trait_change(self.status_changed, 'objects.status', remove=True)
+        for obj in self.system.objects:
+            if isinstance(obj, StatusObject) and obj.history_backend in self._files.values():
+                obj.history_backend = None
+        for history_file in self._files.values():
+            history_file.close()
+        self._files.clear()
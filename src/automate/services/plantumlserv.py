@@ -74,6 +74,7 @@ class PlantUMLService(AbstractUserService):
             s.write('BackGroundColor<<%s>> %s\n' % (k, v))
         s.write('}\n')
 
+        dependencies = self.system.dependencies
         for o in self.system.objects:
             if isinstance(o, DefaultProgram) or o.hide_in_uml:
                 continue
@@ -90,11 +91,11 @@ class PlantUMLService(AbstractUserService):
                 if getattr(o, 'is_program', False):
                     s.write('%s: Priority: %s\n' % (o, o.priority))
 
-                for t in o.actual_triggers:
+                for t in dependencies.triggers_of(o):
                     if isinstance(t, DefaultProgram) or t.hide_in_uml:
                         continue
                     s.write('%s -[%s]-> %s\n' % (t, self.arrow_colors['trigger'], o))
-                for t in o.actual_targets:
+                for t in dependencies.targets_of(o):
                     if t.hide_in_uml:
                         continue
                     if o.active:
@@ -21,19 +21,93 @@
 # If you like Automate, please take a look at this page:
 # http://evankelista.net/automate/
 
-from threading import Timer
+import os
+import pickle
+import time
+from functools import partial
+from threading import Lock
 
-from traits.api import Any, CBool, CFloat
+from traits.api import Any, CBool, CFloat, CInt, Dict
 
 from automate.service import AbstractUserService
+from automate.statusobject import StatusObject
 
 __all__ = ['StatusSaverService']
 
 
+def journal_filename(filename):
+    return filename + '.journal'
+
+
+def read_journal(filename):
+    """
+        Give records ``(time, [(object name, status, new history samples), ...])``
+        from a journal file. Incomplete record at the end (i.e. if writing was interrupted)
+        is ignored.
+    """
+    with open(filename, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except (EOFError, pickle.UnpicklingError, ValueError):
+                return
+
+
+def replay_journal(filename, obj_list, config=None):
+    """
+        Apply journal of state file ``filename`` to unpickled objects in ``obj_list`` (and
+        optionally to ``config`` dictionary) before they are set up in a System. Records
+        that are older than the state file are skipped. Returns number of applied records.
+    """
+    states = {obj._passed_arguments[1].get('name'): obj._passed_arguments[1] for obj in obj_list}
+    return replay_journal_states(filename, states, config)
+
+
+def replay_journal_states(filename, states, config=None):
+    """
+        Like :func:`replay_journal`, but apply journal to dictionary ``{name: state}``, where
+        state is a dictionary that may contain ``_status`` and ``history``.
+    """
+    journal = journal_filename(filename)
+    if not os.path.exists(journal):
+        return 0
+    snapshot_time = os.path.getmtime(filename) if os.path.exists(filename) else 0.
+    count = 0
+    for record_time, changes in read_journal(journal):
+        if record_time <= snapshot_time:
+            continue
+        for name, status, samples in changes:
+            if config is not None and name in config:
+                config[name] = status
+            state = states.get(name)
+            if state is None:
+                continue
+            if '_status' in state:
+                state['_status'] = status
+            history = state.get('history')
+            if history is None:
+                continue
+            for t, s in samples:
+                if history and history[-1][0] >= t:
+                    if history[-1][0] > t:
+                        continue
+                    history.pop()
+                history.append((t, s))
+        count += 1
+    return count
+
+
 class StatusSaverService(AbstractUserService):
 
     """
         Service which is responsible for scheduling dumping system into file periodically.
+
+        In :attr:`incremental` mode, only changes (statuses and new history entries) are
+        written to a journal file next to the state file every :attr:`journal_interval`
+        seconds, and the full state is dumped (and journal cleared) only every
+        :attr:`dump_interval` seconds or when the journal grows larger than
+        :attr:`journal_max_size`. Journal is replayed in
+        :meth:`~automate.system.System.load_or_create`.
     """
 
     autoload = True
@@ -41,25 +115,156 @@ class StatusSaverService(AbstractUserService):
     #: Dump saving interval, in seconds. Default 30 minutes.
     dump_interval = CFloat(30 * 60)
 
+    #: Write changes into a journal instead of dumping the whole system every time
+    incremental = CBool(False)
+
+    #: Journal writing interval, in seconds (incremental mode)
+    journal_interval = CFloat(60)
+
+    #: Full dump is written when journal exceeds this size, in bytes (incremental mode)
+    journal_max_size = CInt(1024 * 1024)
+
     _exit = CBool(False)
     _timer = Any(transient=True)
+    _journal_timer = Any(transient=True)
+    _journal_lock = Any(transient=True)
+
+    # Protects _changed. Not _journal_lock, which is held while state is saved, i.e. while
+    # the worker thread (that calls status_changed) is paused.
+    _changed_lock = Any(transient=True)
+
+    # Objects changed since last journal write
+    _changed = Dict(transient=True)
+
+    # Full state is being written in the background. Journal is not written meanwhile,
+    # because it is removed when the state has been written.
+    _saving = CBool(False, transient=True)
+
+    # Timestamp of the newest history entry that has been written, per object
+    _written_until = Dict(transient=True)
 
     def setup(self):
         if self.system.filename:
             self.system.on_trait_change(self.exit_save, "pre_exit_trigger")
+            if self.incremental:
+                self._journal_lock = Lock()
+                self._changed_lock = Lock()
+                self.system.on_trait_change(self.status_changed, 'objects.status')
+                if not os.path.exists(self.system.filename):
+                    self.save_snapshot()
+                if self.journal_interval:
+                    self.write_journal_periodically()
             if self.dump_interval:
                 self.save_system_periodically()
 
-    def save_system_periodically(self):
+    @property
+    def journal_filename(self):
+        return journal_filename(self.system.filename)
+
+    def status_changed(self, obj, name, new):
+        if isinstance(obj, StatusObject):
+            with self._changed_lock:
+                self._changed[obj.name] = obj
+
+    def write_journal(self):
+        """
+            Append changes since last write into the journal file.
+        """
+        with self._journal_lock:
+            if self._saving:
+                # Changes are kept in _changed and written after the state has been saved
+                return
+            with self._changed_lock:
+                changed, self._changed = self._changed, {}
+            if not changed:
+                return
+            changes = []
+            for name, obj in changed.items():
+                since = self._written_until.get(name, float('-inf'))
+                samples = []
+                for t, s in reversed(obj.history or ()):
+                    if t < since:
+                        break
+                    samples.append((t, s))
+                samples.reverse()
+                if samples:
+                    self._written_until[name] = samples[-1][0]
+                changes.append((name, obj._status, samples))
+
+            with open(self.journal_filename, 'ab') as f:
+                pickle.dump((time.time(), changes), f, pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            journal_size = os.path.getsize(self.journal_filename)
+        self.logger.debug('Wrote %d changes to journal', len(changes))
+        if journal_size > self.journal_max_size:
+            self.save_snapshot(wait=False)
+
+    def save_snapshot(self, wait=True):
+        """
+            Dump full system state and clear journal. If ``wait`` is ``False``, state is written
+            in the background, and journal is cleared when it has been written.
+        """
         self.logger.debug('Saving system state')
-        self.system.save_state()
-        self._timer = Timer(self.dump_interval, self.save_system_periodically)
-        self._timer.start()
+        if not self.incremental:
+            self.system.save_state(wait=wait)
+            return
+        if wait:
+            self.system.wait_state_saved()
+        with self._journal_lock:
+            if self._saving:
+                # Previous state is still being written
+                return
+            self._saving = True
+            with self._changed_lock:
+                changed, self._changed = self._changed, {}
+        try:
+            self.system.save_state(wait=wait, callback=partial(self._snapshot_saved, changed))
+        except Exception:
+            self._snapshot_saved(changed, False)
+            raise
+
+    def _snapshot_saved(self, changed, success):
+        # Called in the state saver thread
+        with self._journal_lock:
+            self._saving = False
+            if success:
+                try:
+                    os.remove(self.journal_filename)
+                except FileNotFoundError:
+                    pass
+            else:
+                # Changes are not in the state file, so they must still go to the journal
+                with self._changed_lock:
+                    for name, obj in changed.items():
+                        self._changed.setdefault(name, obj)
+
+    def write_journal_periodically(self):
+        self.write_journal()
+        if self._journal_timer:
+            self._journal_timer.cancel()
+        self._journal_timer = self.system.scheduler.schedule_periodic(
+            self.journal_interval, self.write_journal, delay=self.journal_interval, name='StatusSaver journal')
+
+    def save_system_periodically(self):
+        self.save_snapshot()
+        if self._timer:
+            self._timer.cancel()
+        self._timer = self.system.scheduler.schedule_periodic(
+            self.dump_interval, self.save_snapshot, delay=self.dump_interval, name='StatusSaver dump',
+            wait=False)
 
     def exit_save(self):
-        self.system.save_state()
+        if self.incremental:
+            self.system.wait_state_saved()
+            self.write_journal()
+        else:
+            self.system.save_state()
         self._exit = True
 
     def cleanup(self):
-        if self._timer and self._timer.is_alive():
-            self._timer.cancel()
+        for timer in [self._timer, self._journal_timer]:
+            if timer and timer.is_alive():
+                timer.cancel()
+        if self.incremental and self.system.filename:
+            self.system.on_trait_change(self.status_changed, 'objects.status', remove=True)
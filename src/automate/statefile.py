@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+# (c) 2015 Tuomas Airaksinen
+#
+# This file is part of Automate.
+#
+# Automate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Automate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Automate.  If not, see <http://www.gnu.org/licenses/>.
+#
+# ------------------------------------------------------------------
+#
+# If you like Automate, please take a look at this page:
+# http://evankelista.net/automate/
+
+"""
+    Binary state file format (``System.state_format = 'binary'``).
+
+    Unlike pickled state, only data is stored: statuses of the objects, user editable
+    configuration and histories. System is created from the program file as usual, and
+    the stored data is then applied to the objects by name (see :func:`restore_state`),
+    so changes in the program or in Automate do not invalidate the state file.
+
+    File layout::
+
+        MAGIC (8 bytes)
+        header: format version (uint16), metadata length (uint32), little-endian
+        metadata: JSON (utf-8)
+        data: packed little-endian float64 arrays of history timestamps and numeric statuses
+
+    Metadata contains, for each object, its name, class, status and offsets of its history
+    arrays within the data section. Histories of non-numeric statuses are stored in the
+    metadata as JSON lists. Readers ignore keys they do not know, so fields can be added
+    without bumping :data:`FORMAT_VERSION`.
+"""
+
+import json
+import logging
+import struct
+import sys
+import time
+from array import array
+
+MAGIC = b'\x89ASTATE\n'
+
+#: Bumped only if the layout changes in a way that older readers could not handle
+FORMAT_VERSION = 1
+
+HEADER = struct.Struct('<HI')
+
+# Status types that are stored in packed arrays and converted back on load
+NUMERIC_TYPES = {'bool': bool, 'int': int, 'float': float}
+
+logger = logging.getLogger('automate.statefile')
+
+
+class StateFileError(Exception):
+    pass
+
+
+def is_binary_state(file):
+    """ Check from the beginning of the (seekable) file whether it is in binary format """
+    pos = file.tell()
+    rv = file.read(len(MAGIC)) == MAGIC
+    file.seek(pos)
+    return rv
+
+
+def _pack(values):
+    a = array('d', values)
+    if sys.byteorder != 'little':
+        a.byteswap()
+    return a.tobytes()
+
+
+def _unpack(data, offset, count):
+    a = array('d')
+    a.frombytes(data[offset:offset + count * a.itemsize])
+    if sys.byteorder != 'little':
+        a.byteswap()
+    return a
+
+
+def _status_type(statuses):
+    types = {type(s) for s in statuses}
+    if len(types) == 1:
+        name = next(iter(types)).__name__
+        if name in NUMERIC_TYPES:
+            return name
+    if types <= {int, float}:
+        return 'float'
+    return None
+
+
+def write_state(file, objects, config, **info):
+    """
+        Write state into binary file.
+
+        :param objects: iterable of ``(name, class name, status, history)``, where history is
+                        an iterable of ``(timestamp, status)`` tuples (or None)
+        :param config: dictionary of user editable statuses
+        :param info: additional items to be stored in metadata
+    """
+    blob = bytearray()
+    records = []
+    for name, class_name, status, history in objects:
+        record = {'name': name, 'class': class_name}
+        try:
+            json.dumps(status)
+            record['status'] = status
+        except (TypeError, ValueError):
+            logger.warning('Status of %s can not be stored: %r', name, status)
+        if history:
+            times = [t for t, s in history]
+            statuses = [s for t, s in history]
+            status_type = _status_type(statuses)
+            rec = record['history'] = {'count': len(times), 'times': len(blob)}
+            blob += _pack(times)
+            if status_type:
+                rec['statuses'] = len(blob)
+                rec['status_type'] = status_type
+                blob += _pack(statuses)
+            else:
+                try:
+                    json.dumps(statuses)
+                    rec['statuses'] = statuses
+                except (TypeError, ValueError):
+                    logger.warning('History of %s can not be stored', name)
+                    del record['history']
+        records.append(record)
+
+    config = {k: v for k, v in config.items() if isinstance(v, (bool, int, float, str, type(None)))}
+    metadata = dict(info, format_version=FORMAT_VERSION, saved=time.time(), config=config,
+                    objects=records)
+    meta = json.dumps(metadata).encode('utf-8')
+    file.write(MAGIC)
+    file.write(HEADER.pack(FORMAT_VERSION, len(meta)))
+    file.write(meta)
+    file.write(blob)
+
+
+def read_state(file):
+    """
+        Read binary state file. Returns metadata dictionary, where ``objects`` is a dictionary
+        ``{name: {'class': class name, '_status': status, 'history': [(timestamp, status), ...]}}``.
+    """
+    if file.read(len(MAGIC)) != MAGIC:
+        raise StateFileError('Not a binary state file')
+    version, meta_len = HEADER.unpack(file.read(HEADER.size))
+    if version > FORMAT_VERSION:
+        raise StateFileError('State file format version %d is not supported (newest supported: %d)'
+                             % (version, FORMAT_VERSION))
+    metadata = json.loads(file.read(meta_len).decode('utf-8'))
+    data = file.read()
+    objects = {}
+    for record in metadata.get('objects', []):
+        state = {'class': record.get('class')}
+        if 'status' in record:
+            state['_status'] = record['status']
+        rec = record.get('history')
+        if rec:
+            count = rec['count']
+            times = _unpack(data, rec['times'], count)
+            statuses = rec['statuses']
+            if isinstance(statuses, int):
+                statuses = _unpack(data, statuses, count)
+                status_type = NUMERIC_TYPES.get(rec.get('status_type'), float)
+                if status_type is not float:
+                    statuses = map(status_type, statuses)
+            state['history'] = list(zip(times, statuses))
+        objects[record['name']] = state
+    metadata['objects'] = objects
+    metadata.setdefault('config', {})
+    return metadata
+
+
+def restore_state(system, objects):
+    """
+        Apply histories and statuses read by :func:`read_state` to objects of system. Used by
+        :meth:`automate.namespace.Namespace.set_system` before programs are set up, so that
+        programs are evaluated against the restored statuses. Objects whose name or class
+        does not match are skipped.
+    """
+    from .statusobject import StatusObject
+    for name, state in objects.items():
+        obj = system.namespace.get(name)
+        if not isinstance(obj, StatusObject):
+            continue
+        if state.get('class') != obj.__class__.__name__:
+            system.logger.info('Class of %s changed, not restoring its state', name)
+            continue
+        with obj._status_lock:
+            history = state.get('history')
+            if history is not None and obj.history is not None:
+                obj.history = obj._create_history(history)
+            if '_status' in state:
+                try:
+                    obj._status = state['_status']
+                except Exception as e:
+                    system.logger.warning('Could not restore status of %s: %s', name, e)
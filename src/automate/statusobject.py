@@ -23,24 +23,24 @@
 
 import logging
 import operator
-import statistics
-import threading
 import time
 import sys
-import collections
+import threading
 
 import datetime
-from functools import lru_cache
-from numbers import Number
+from collections import OrderedDict
 
 from traits.api import (cached_property, Any, CBool, Instance, Dict, Str, CFloat,
                         List, Enum, Bool, Property, Event, CInt)
 from traits.trait_errors import TraitError
 
 from .common import Lock, AbstractStatusObject, CompareMixin, nomutex
-from .worker import StatusWorkerTask, DummyStatusWorkerTask
+from .worker import StatusWorkerTask, DummyStatusWorkerTask, KeyedStatusWorkerTask
+from .scheduler import ScheduledJob
 from .program import ProgrammableSystemObject, DefaultProgram
 from .systemobject import SystemObject
+from .history import History, NumpyHistory, np
+from .windowstats import WindowStats
 
 
 class StatusObject(AbstractStatusObject, ProgrammableSystemObject, CompareMixin):
@@ -71,7 +71,8 @@ class StatusObject(AbstractStatusObject, ProgrammableSystemObject, CompareMixin)
     #: (property) Is delayed change taking place at the moment?
     changing = Property(trait=Bool, transient=True, depends_on='_timed_action, _queued_job')
 
-    # Deque of history, which consists of tuples (timestamp, status), read only
+    # History of tuples (timestamp, status), read only. Stored in :class:`~automate.history.History`
+    # (or :class:`~automate.history.NumpyHistory`). Other iterables that are assigned are converted.
     history = Any()  # transient=True)
 
     #: Transpose of history (timesstamps, statuses)
@@ -83,17 +84,34 @@ class StatusObject(AbstractStatusObject, ProgrammableSystemObject, CompareMixin)
     #: How often new values are saved to history, in seconds
     history_frequency = CFloat(0)
 
+    #: Maximum number of sliding windows (see :meth:`window_stats`) kept up to date. Windows
+    #: that have not been used for the longest time are discarded first.
+    max_windows = CInt(16)
+
+    #: Persistent history storage that is used for times older than in-memory history
+    #: (set by :class:`~automate.services.historystore.HistoryStoreService`)
+    history_backend = Any(transient=True)
+
+    #: Store history in compact numpy arrays (see :class:`~automate.history.NumpyHistory`)
+    #: instead of a deque of tuples. Only for numeric statuses. Requires numpy.
+    compact_history = CBool(False)
+
     #: Show stdev seconds (0 to disable)
     show_stdev_seconds = CInt(0)
 
+    #: If ``True``, status change request that is still waiting in the worker queue is replaced
+    #: by a newer one, i.e. intermediate values are dropped if worker can not keep up.
+    #: Useful for fast polling sensors.
+    coalesce_status_changes = CBool(False)
+
     @cached_property
     def _get_changing(self):
         if self._queued_job or self._timed_action:
             return True
         return False
 
-    # Thread of currently running action
-    _timed_action = Instance(threading.Timer, transient=True)
+    # Scheduled safety/change_delay action (job of the system scheduler)
+    _timed_action = Instance(ScheduledJob, transient=True)
 
     # Reference of status change job that is in the worker queue is saved here
     _queued_job = Instance(StatusWorkerTask, transient=True)
@@ -101,12 +119,18 @@ class StatusObject(AbstractStatusObject, ProgrammableSystemObject, CompareMixin)
     # Time when status was last changed
     _last_changed = CFloat
 
+    # Sliding window statistics engines, see window_stats(). Most recently used last.
+    _windows = Instance(OrderedDict, (), transient=True)
+
     # The time when last change started
     _change_start = CFloat(transient=True)
 
     # Lock that is acquired when changing the status
     _status_lock = Instance(Lock, transient=True)
 
+    # Lock that is held while history is modified, so that other threads can copy it consistently
+    _history_lock = Any(transient=True)
+
     logger = Instance(logging.Logger, transient=True)
 
     view = ["name", "status", "description", "safety_delay",
@@ -119,7 +143,11 @@ class StatusObject(AbstractStatusObject, ProgrammableSystemObject, CompareMixin)
     data_type = Str(transient=True)
 
     def _get_history_transpose(self):
-        return list(zip(*self.history)) if self.history else [[0], [0]]
+        if not self.history:
+            return [[0], [0]]
+        if hasattr(self.history, 'transpose'):
+            return self.history.transpose()
+        return list(zip(*self.history))
 
     @property
     def times(self):
@@ -133,20 +161,36 @@ class StatusObject(AbstractStatusObject, ProgrammableSystemObject, CompareMixin)
     def statuses(self):
         return self.history_transpose[1]
 
+    @staticmethod
+    def _to_timestamp(T):
+        return T.timestamp() if isinstance(T, datetime.datetime) else T
+
+    def _history_since(self, T):
+        # In-memory history, or history_backend if T is older than in-memory history
+        backend = self.history_backend
+        if backend is not None and len(backend) and (not self.history or T < self.history[0][0]):
+            return backend
+        return self.history
+
     def status_at_time(self, T):
-        if isinstance(T, datetime.datetime):
-            T = T.timestamp()
-        t_max = 0
-        times, statuses = self.history_transpose
-        if T < times[0]:
+        """
+            Status at time T (timestamp or datetime), according to history. O(log n).
+        """
+        T = self._to_timestamp(T)
+        history = self._history_since(T)
+        if not history:
             return 0.
-        for t in times:
-            if t <= T:
-                t_max = t
-            else:
-                break
-        t_index = times.index(t_max)
-        return statuses[t_index]
+        return history.status_at(T)
+
+    def statuses_at_times(self, Ts):
+        """
+            Statuses at each time in Ts (sequence of timestamps or datetimes), according to history.
+        """
+        Ts = [self._to_timestamp(T) for T in Ts]
+        history = self._history_since(min(Ts)) if Ts else None
+        if not history:
+            return [0.] * len(Ts)
+        return history.statuses_at(Ts)
 
     @staticmethod
     def _convert_times(t_a, t_b):
@@ -162,21 +206,16 @@ class StatusObject(AbstractStatusObject, ProgrammableSystemObject, CompareMixin)
 
         return t_a, t_b
 
-    @lru_cache()
     def integral(self, t_a=None, t_b=None):
-        self.logger.debug('Calculating integral for %s', self)
+        """
+            Integral of status over time from t_a (default: beginning) to t_b (default: now),
+            according to history. Non-numeric statuses are counted as 0. O(log n).
+        """
         t_a, t_b = self._convert_times(t_a, t_b)
-        history = ((t, s) for t, s in self.history if t_a <= t <= t_b and isinstance(s, Number))
-        t_prev = t_a
-        s_prev = self.status_at_time(t_a)
-        if not isinstance(s_prev, Number):
-            s_prev = 0.
-        s_sum = 0.
-        for t, s in history:
-            s_sum += s_prev * (t-t_prev)
-            s_prev, t_prev = s, t
-        s_sum += s_prev * (t_b-t_prev)
-        return s_sum
+        history = self._history_since(t_a)
+        if not history:
+            return 0.
+        return history.integral(t_a, t_b)
 
     def average(self, t_a=None, t_b=None):
         t_a, t_b = self._convert_times(t_a, t_b)
@@ -184,25 +223,63 @@ class StatusObject(AbstractStatusObject, ProgrammableSystemObject, CompareMixin)
             return 0.
         return self.integral(t_a, t_b) / (t_b-t_a)
 
+    def window_stats(self, seconds=None, count=None) -> WindowStats:
+        """
+            Give :class:`~automate.windowstats.WindowStats` of history samples within last
+            ``seconds`` or last ``count`` samples. Window is created on first use and kept
+            up to date as new samples are added to history, until it has not been used while
+            :attr:`max_windows` other windows have been.
+        """
+        key = (seconds, count)
+        window = self._windows.get(key)
+        if window is None:
+            window = WindowStats(seconds=seconds, count=count)
+            # Status that has not changed since history was cleared is in effect too
+            window.reset(self.history or [(self._last_changed or time.time(), self._status)])
+            self._windows[key] = window
+            while len(self._windows) > max(self.max_windows, 1):
+                self._windows.popitem(last=False)
+        else:
+            self._windows.move_to_end(key)
+        return window
+
     def stdev(self, t: int=10) -> float:
-        values = []
-        now = time.time()
-        for t_, value in reversed(self.history):
-            if t_ < now - t:
-                break
-            values.append(value)
-        return statistics.stdev(values) if len(values) > 1 else 0.0
+        """
+            Sample standard deviation of history samples within last ``t`` seconds. The newest
+            sample older than that (i.e. status in effect at the start of the window) is included
+            too, so that a status that has not changed for a while is taken into account.
+        """
+        return self.window_stats(seconds=t).stdev
 
     def __init__(self, *args, **kwargs):
         self._status_lock = Lock('statuslock')
+        self._history_lock = threading.Lock()
         super().__init__(*args, **kwargs)
 
     def __setstate__(self, *args, **kwargs):
         self._status_lock = Lock('statuslock')
+        self._history_lock = threading.Lock()
         super().__setstate__(*args, **kwargs)
 
-    def _history_length_changed(self, new_value):
-        self.history = collections.deque(list(self.history or [])[-new_value:], maxlen=new_value)
+    def _create_history(self, items=()):
+        if self.compact_history:
+            if np is not None:
+                return NumpyHistory(items, maxlen=self.history_length)
+            self.logger.warning('numpy is not installed, compact_history is not available')
+        return History(items, maxlen=self.history_length)
+
+    def _history_changed(self, new_value):
+        if new_value is not None and not isinstance(new_value, (History, NumpyHistory)):
+            self.history = self._create_history(new_value)
+            return
+        for window in list(self._windows.values()):
+            window.reset(new_value or ())
+
+    def _history_length_changed(self):
+        self.history = self._create_history(list(self.history or []))
+
+    def _compact_history_changed(self):
+        self.history = self._create_history(list(self.history or []))
 
     @property
     def is_program(self):
@@ -253,7 +330,7 @@ class StatusObject(AbstractStatusObject, ProgrammableSystemObject, CompareMixin)
     def setup_system(self, *args, **kwargs):
         super().setup_system(*args, **kwargs)
         if not self.history:
-            self.history = collections.deque(maxlen=self.history_length)
+            self.history = self._create_history()
         self.data_type = self._status.__class__.__name__
 
     def set_status(self, new_status, origin=None, force=False):
@@ -315,14 +392,18 @@ class StatusObject(AbstractStatusObject, ProgrammableSystemObject, CompareMixin)
             if self._status == status:
                 self._status_trigger = True
             else:
-                if self.history:
-                    last_time, last_value = self.history[-1]
-                    if self._last_changed - last_time < self.history_frequency:
-                        self.history.pop()
-                        change_time = last_time
-                if status is not None:
-                    self.history.append((change_time, status))
-                    self.integral.cache_clear()
+                with self._history_lock:
+                    if self.history:
+                        last_time, last_value = self.history[-1]
+                        if self._last_changed - last_time < self.history_frequency:
+                            self.history.pop()
+                            for window in list(self._windows.values()):
+                                window.pop()
+                            change_time = last_time
+                    if status is not None:
+                        self.history.append((change_time, status))
+                        for window in list(self._windows.values()):
+                            window.add(change_time, status)
                 self._status = status
         except TraitError as e:
             self.logger.warning('Wrong type of status %s was passed to %s. Error: %s', status, self, e)
@@ -363,7 +444,12 @@ class StatusObject(AbstractStatusObject, ProgrammableSystemObject, CompareMixin)
         This does not directly change status, but adds change request
         to queue.
         """
-        self.system.worker_thread.put(DummyStatusWorkerTask(self._request_status_change_in_queue, status, force=force))
+        if self.coalesce_status_changes:
+            task = KeyedStatusWorkerTask((self, '_request_status_change_in_queue'),
+                                         self._request_status_change_in_queue, status, force=force)
+        else:
+            task = DummyStatusWorkerTask(self._request_status_change_in_queue, status, force=force)
+        self.system.worker_thread.put(task)
 
     @property
     def next_scheduled_action(self):
@@ -419,12 +505,10 @@ class StatusObject(AbstractStatusObject, ProgrammableSystemObject, CompareMixin)
                 time_after_delay = datetime.datetime.now() + datetime.timedelta(seconds=delaytime)
                 self.logger.debug("Scheduling safety/change_delay timer for %f sek. Now %s. Going to change to %s.",
                        delaytime, self._status, status)
-                self._timed_action = threading.Timer(delaytime, timer_func,
-                                                     args=(self._add_statuschange_to_queue, status,
-                                                     getattr(self, "program", None), False))
-                self._timed_action.name = "Safety/change_delay for %s timed at %s (%f sek)" % (self.name, time_after_delay, delaytime)
-                self._timed_action.next_action = time_after_delay
-                self._timed_action.start()
+                self._timed_action = self.system.scheduler.schedule(
+                    delaytime, timer_func, self._add_statuschange_to_queue, status,
+                    getattr(self, "program", None), False,
+                    name="Safety/change_delay for %s timed at %s (%f sek)" % (self.name, time_after_delay, delaytime))
                 return False
 
 
@@ -466,8 +550,9 @@ class AbstractSensor(StatusObject):
         if self.reset_delay:
             if self._reset_timer and self._reset_timer.is_alive():
                 self._reset_timer.cancel()
-            self._reset_timer = threading.Timer(self.reset_delay, lambda: self.set_status(self.default))
-            self._reset_timer.start()
+            self._reset_timer = self.system.scheduler.schedule(
+                self.reset_delay, lambda: self.set_status(self.default),
+                name="Reset delay for %s (%f sek)" % (self.name, self.reset_delay))
 
     def set_status(self, status, origin=None, force=False):
         """
@@ -502,7 +587,8 @@ class AbstractSensor(StatusObject):
         if not default is None and not load_state:
             self.set_status(default)
         elif load_state and self._status is not None:
-            self.history.append((time.time(), self._status))
+            with self._history_lock:
+                self.history.append((time.time(), self._status))
 
 
 class AbstractActuator(StatusObject):
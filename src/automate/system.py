@@ -21,7 +21,8 @@
 # If you like Automate, please take a look at this page:
 # http://evankelista.net/automate/
 
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from contextlib import contextmanager
 
 from raven.handlers.logging import SentryHandler
 
@@ -30,21 +31,27 @@ import operator
 import os
 import logging
 import pickle
+import shutil
+import time
 import pkg_resources
 import argparse
 
 import raven
 
 from traits.api import (CStr, Instance, CBool, CList, Property, CInt, CUnicode, Event, CSet, Str, cached_property,
-                        on_trait_change)
+                        on_trait_change, Either, CFloat, Dict, Enum)
 
-from .common import (SystemBase, ExitException, has_baseclass, Object)
+from .common import (SystemBase, ExitException, has_baseclass, Object, Lock)
 from .namespace import Namespace
 from .service import AbstractService, AbstractUserService, AbstractSystemService
-from .statusobject import AbstractSensor, AbstractActuator
+from .statusobject import StatusObject, AbstractSensor, AbstractActuator
 from .systemobject import SystemObject
-from .worker import StatusWorkerThread
+from .worker import StatusWorkerThread, StatusWorkerPool, DummyStatusWorkerTask
 from .callable import AbstractCallable
+from .dependencies import DependencyIndex
+from .scheduler import Scheduler
+from .eventloop import EventLoop, EventLoopScheduler
+from . import statefile
 from . import __version__
 
 import typing
@@ -56,6 +63,55 @@ STATEFILE_VERSION = 1
 
 import sys
 
+
+class StateSnapshot(object):
+
+    """
+        Consistent snapshot of the system state, taken by :meth:`System.snapshot`.
+        Objects themselves are not copied, but their statuses and histories are, and
+        pickled states of the objects are overridden by those. Only these are copied while
+        the worker thread is paused. With pickled state format, other trait values are read
+        when the snapshot is written.
+    """
+
+    #: Attributes of objects that are captured in the snapshot
+    captured_attributes = ('_status', 'history')
+
+    def __init__(self, system):
+        self.system_name = system.name
+        self.format = system.state_format
+        self.obj_list = list(system.objects)
+        self.config = {obj.name: obj.status for obj in self.obj_list
+                       if getattr(obj, 'user_editable', False)}
+        self.overrides = {}
+        for obj in self.obj_list:
+            if isinstance(obj, StatusObject):
+                history = obj.history
+                self.overrides[id(obj)] = {'_status': obj._status,
+                                           'history': history.copy() if history is not None else None}
+
+    def _reduce(self, obj):
+        rv = obj.__reduce_ex__(pickle.HIGHEST_PROTOCOL)
+        override = self.overrides.get(id(obj))
+        if override is None or len(rv) < 3 or not isinstance(rv[2], dict):
+            return rv
+        state = rv[2].copy()
+        for key, value in override.items():
+            if key in state:
+                state[key] = value
+        return (rv[0], rv[1], state) + tuple(rv[3:])
+
+    def dump(self, file):
+        if self.format == 'binary':
+            objects = ((obj.name, obj.__class__.__name__, self.overrides[id(obj)]['_status'],
+                        self.overrides[id(obj)]['history'])
+                       for obj in self.obj_list if id(obj) in self.overrides)
+            statefile.write_state(file, objects, self.config, system=self.system_name)
+            return
+        pickler = pickle.Pickler(file, pickle.HIGHEST_PROTOCOL)
+        pickler.dispatch_table = {type(obj): self._reduce for obj in self.obj_list}
+        pickler.dump((STATEFILE_VERSION, (self.obj_list, self.config)))
+
 if sys.version_info >= (3, 0):
     TimerClass = threading.Timer
 else:
@@ -122,8 +178,30 @@ class System(SystemBase):
     #: List of servicenames that are desired to be avoided (even if normally autoloaded).
     exclude_services = CSet(trait=Str)
 
-    #: Reference to the worker thread (read-only)
-    worker_thread = Instance(StatusWorkerThread, transient=True)
+    #: Reference to the worker thread, or pool of worker threads if :attr:`worker_threads` > 1 (read-only)
+    worker_thread = Either(Instance(StatusWorkerThread), Instance(StatusWorkerPool), transient=True)
+
+    #: Number of status worker threads. If more than one, status changes are sharded by object
+    #: to the worker threads, such that changes of each object are processed in order, but
+    #: slow objects do not stall unrelated objects.
+    worker_threads = CInt(1)
+
+    #: Index of triggers and targets of all programs (read-only), see :class:`~automate.dependencies.DependencyIndex`
+    dependencies = Instance(DependencyIndex, transient=True)
+
+    #: Shared timer scheduler (read-only), that runs delayed and periodic actions (polling sensors,
+    #: safety/change delays, Delay callables etc.), see :class:`~automate.scheduler.Scheduler`
+    scheduler = Instance(Scheduler, transient=True)
+
+    #: Number of threads that run due jobs of :attr:`scheduler` (executor threads of :attr:`event_loop`)
+    scheduler_threads = CInt(4)
+
+    #: Run timers, socket and shell sensors, file change sensors and web services on a single asyncio
+    #: event loop (:attr:`event_loop`) instead of threads of their own. See :mod:`automate.eventloop`.
+    use_event_loop = CBool(False)
+
+    #: Event loop (read-only), if :attr:`use_event_loop` is enabled
+    event_loop = Instance(EventLoop, transient=True)
 
     #: System namespace (read-only)
     namespace = Instance(Namespace)
@@ -184,6 +262,20 @@ class System(SystemBase):
     #: Number of state backup files
     num_state_backups = CInt(5)
 
+    #: Format of the state file. ``'pickle'`` stores the whole objects. ``'binary'`` stores only
+    #: statuses and histories (see :mod:`automate.statefile`): system is then created from the
+    #: program file at load, and the stored data is applied to it. Both formats can be loaded
+    #: regardless of this setting.
+    state_format = Enum('pickle', 'binary')
+
+    #: Duration of the last state file writing (in background), in seconds (read-only)
+    last_save_duration = CFloat(transient=True)
+
+    #: How long worker thread(s) were paused when taking the last state snapshot, in seconds (read-only)
+    last_save_pause = CFloat(transient=True)
+
+    _save_thread = Instance(threading.Thread, transient=True)
+
     @cached_property
     def _get_all_tags(self):
         newset = set([])
@@ -193,9 +285,57 @@ class System(SystemBase):
                     newset.add(j)
         return newset
 
+    #: Evaluate program conditions incrementally: values of pure callables (:class:`.And`, :class:`.Or`,
+    #: :class:`.Sum` etc.) are cached per program, and when a status changes, only the callables
+    #: that depend on it are evaluated again (see :class:`~automate.callable.ConditionCache`).
+    incremental_evaluation = CBool(False)
+
+    #: Compile program conditions into Python functions (see :mod:`automate.compiler`).
+    #: Takes precedence over :attr:`incremental_evaluation`.
+    compile_conditions = CBool(False)
+
+    #: Automatic batching: status changes processed by the worker thread before its queue is drained
+    #: form a batch (see :meth:`batch`), i.e. each program is evaluated once per wave of changes.
+    #: Note that programs then do not see intermediate statuses that are overridden within the same wave.
+    batch_worker_drain = CBool(False)
+
+    #: Maximum number of jobs in an automatic batch (see :attr:`batch_worker_drain`). Programs are
+    #: evaluated at least after this many jobs, even if the queue is never drained.
+    batch_worker_drain_limit = CInt(100)
+
+    #: Set up program callables at startup within a batch (see :meth:`batch`): evaluation of programs
+    #: is deferred until all callables of all programs are set up, and then each program is evaluated
+    #: once, instead of after each callable assignment.
+    batched_startup = CBool(False)
+
+    #: Startup timings per object class: ``{class name: {'count': n, 'setup_system': seconds,
+    #: 'setup_callables': seconds}}``, plus ``'evaluation'`` for the deferred evaluation of
+    #: batched startup. See :meth:`startup_report`.
+    startup_timings = Dict(transient=True)
+
+    # True while setting up callables of a batched startup
+    _startup_batch = CBool(False, transient=True)
+
+    _batch_lock = Instance(Lock, transient=True)
+    _batch_depth = CInt(0, transient=True)
+    _dirty_programs = Instance(OrderedDict, (), transient=True)
+
     #: Enable experimental two-phase queue handling technique (not recommended)
     two_phase_queue = CBool(False)
 
+    #: Capture full stack trace on every lock acquire (slow, for debugging deadlocks only).
+    #: Otherwise, stacks are logged only when lock contention exceeds :attr:`lock_contention_threshold`.
+    #: This is a process-wide setting (see :class:`~automate.common.Lock`).
+    debug_locks = CBool(False)
+
+    #: If waiting for a lock takes longer than this (in seconds), stack traces are logged.
+    lock_contention_threshold = CFloat(1.0)
+
+    @on_trait_change('debug_locks, lock_contention_threshold')
+    def _lock_settings_changed(self):
+        Lock.debug = self.debug_locks
+        Lock.contention_threshold = self.lock_contention_threshold
+
     @classmethod
     def load_or_create(cls, filename=None, no_input=False, create_new=False, **kwargs):
         """
@@ -220,16 +360,30 @@ class System(SystemBase):
             return time_savefile > time_program
 
         def load_pickle():
+            """ Returns (obj_list, config), where obj_list is a dict of stored data in binary format """
+            from .services.statussaver import replay_journal, replay_journal_states
             with open(filename, 'rb') as of:
+                if statefile.is_binary_state(of):
+                    data = statefile.read_state(of)
+                    obj_list, config = data['objects'], data['config']
+                    if replay_journal_states(filename, obj_list, config):
+                        print('Journal replayed')
+                    return obj_list, config
                 statefile_version, data = pickle.load(of)
 
             if statefile_version != STATEFILE_VERSION:
                 raise RuntimeError(f'Wrong statefile version, please remove state file {filename}')
-            return data
+            obj_list, config = data
+            if replay_journal(filename, obj_list, config):
+                print('Journal replayed')
+            return obj_list, config
 
         def load():
             print('Loading %s' % filename)
             obj_list, config = load_pickle()
+            if isinstance(obj_list, dict):
+                # Binary format: objects are created from the program file
+                return cls(filename=filename, load_config=config, restore_state=obj_list, **kwargs)
             system = System(load_state=obj_list, filename=filename, **kwargs)
 
             return system
@@ -237,12 +391,18 @@ class System(SystemBase):
         def create():
             print('Creating new system')
             config = None
+            restore_state = None
             if filename:
                 try:
                     obj_list, config = load_pickle()
                 except FileNotFoundError:
                     config = None
-            return cls(filename=filename, load_config=config, **kwargs)
+                else:
+                    if isinstance(obj_list, dict):
+                        # Binary format: stored statuses are applied to the objects that are
+                        # still found (with the same class) in the program file
+                        restore_state = obj_list
+            return cls(filename=filename, load_config=config, restore_state=restore_state, **kwargs)
 
         if filename and os.path.isfile(filename):
             if savefile_more_recent() and not create_new:
@@ -260,28 +420,87 @@ class System(SystemBase):
         else:
             return create()
 
-    def save_state(self):
+    def snapshot(self) -> StateSnapshot:
+        """
+            Pause worker thread(s) for a moment and take a consistent snapshot of statuses
+            and histories of the objects.
         """
-            Save state of the system to a dump file :attr:`System.filename`
+        t0 = time.time()
+        with self.worker_thread.paused():
+            snapshot = StateSnapshot(self)
+        self.last_save_pause = time.time() - t0
+        return snapshot
+
+    def save_state(self, wait=True, callback=None):
+        """
+            Save state of the system to a dump file :attr:`System.filename`.
+
+            Snapshot is taken in the calling thread, and it is written to the file in a background
+            thread (via temporary file that is renamed). If ``wait`` is ``True``, wait until
+            it has been written. ``callback``, if given, is called in the background thread
+            with ``True`` if the state was written, ``False`` if writing failed.
         """
         if not self.filename:
             self.logger.error('Filename not specified. Could not save state')
             return
+        self.wait_state_saved()
+        snapshot = self.snapshot()
+        self._save_thread = threading.Thread(target=self._write_state, args=(snapshot, callback),
+                                             name='State saver thread')
+        self._save_thread.start()
+        if wait:
+            self._save_thread.join()
+
+    def wait_state_saved(self):
+        """ Wait until state that is being saved in the background (see :meth:`save_state`) is written """
+        if self._save_thread:
+            self._save_thread.join()
+
+    def _write_state(self, snapshot, callback=None):
+        success = self._replace_state_file(snapshot)
+        if callback:
+            callback(success)
+        return success
+
+    def _replace_state_file(self, snapshot):
+        t0 = time.time()
         self.logger.debug('Saving system state to %s', self.filename)
-        for i in reversed(range(self.num_state_backups)):
-            fname = self.filename if i == 0 else '%s.%d' % (self.filename, i)
-            new_fname = '%s.%d' % (self.filename, i+1)
+        tmp_fname = self.filename + '.tmp'
+        try:
+            with open(tmp_fname, 'wb') as file:
+                snapshot.dump(file)
+                file.flush()
+                os.fsync(file.fileno())
+        except Exception as e:
+            self.logger.exception('Saving state failed: %s', e)
             try:
-                os.rename(fname, new_fname)
-            except FileNotFoundError:
+                os.remove(tmp_fname)
+            except OSError:
                 pass
+            return False
 
-        with open(self.filename, 'wb') as file, self.worker_thread.queue.mutex:
-            obj_list = list(self.objects)
-            config = {obj.name: obj.status for obj in obj_list
-                      if getattr(obj, 'user_editable', False)}
-            data = obj_list, config
-            pickle.dump((STATEFILE_VERSION, data), file, pickle.HIGHEST_PROTOCOL)
+        for i in reversed(range(1, self.num_state_backups)):
+            try:
+                os.rename('%s.%d' % (self.filename, i), '%s.%d' % (self.filename, i+1))
+            except FileNotFoundError:
+                pass
+        if self.num_state_backups:
+            # Keep the old state file in place until the new one replaces it
+            backup_fname = '%s.1' % self.filename
+            try:
+                if os.path.exists(backup_fname):
+                    os.remove(backup_fname)
+                os.link(self.filename, backup_fname)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                # No hard links (e.g. FAT): copy, so that the state file exists until it is replaced
+                shutil.copy2(self.filename, backup_fname)
+        os.replace(tmp_fname, self.filename)
+        self.last_save_duration = time.time() - t0
+        self.logger.debug('System state saved in %.3f s (paused %.3f s)',
+                          self.last_save_duration, self.last_save_pause)
+        return True
 
     @property
     def cmd_namespace(self):
@@ -336,9 +555,95 @@ class System(SystemBase):
         """
         return set(self.services_by_name.keys())
 
+    def begin_batch(self):
+        """ Start a batch. See :meth:`batch`. """
+        with self._batch_lock:
+            self._batch_depth += 1
+
+    def end_batch(self):
+        """ End a batch. See :meth:`batch`. """
+        in_worker = self.worker_thread.is_current_thread()
+        wait = not in_worker and self.worker_thread.is_alive()
+        if wait:
+            # Apply the status changes queued within the batch, while still deferring evaluation
+            self.flush()
+        with self._batch_lock:
+            self._batch_depth -= 1
+            dirty = None
+            if not self._batch_depth:
+                dirty, self._dirty_programs = self._dirty_programs, OrderedDict()
+        if dirty:
+            if in_worker or not self.worker_thread.is_alive():
+                # No worker running (i.e. at startup): evaluate right away
+                self._evaluate_programs(dirty)
+            else:
+                self.worker_thread.put(DummyStatusWorkerTask(self._evaluate_programs, dirty))
+        if wait:
+            # Wait for evaluation, which may also happen at the end of a batch in the worker thread
+            self.flush()
+
+    @contextmanager
+    def batch(self):
+        """
+            Context manager that defers evaluation of programs until the end of the batch.
+            Status changes are applied first, and then each program whose triggers changed
+            is evaluated exactly once, against the final statuses::
+
+                with system.batch():
+                    system.s1.status = 1
+                    system.s2.status = 2
+
+            Batches may be nested. See also :attr:`batch_worker_drain`.
+        """
+        self.begin_batch()
+        try:
+            yield
+        finally:
+            self.end_batch()
+
+    def defer_evaluation(self, program, trigger):
+        """
+            If batch is in progress, mark program to be evaluated at the end of it and return True.
+        """
+        if self._batch_depth:
+            with self._batch_lock:
+                if self._batch_depth:
+                    self._dirty_programs[program] = trigger
+                    return True
+        # Automatic batch (batch_worker_drain) is scoped to the worker thread that is draining
+        thread = threading.current_thread()
+        if isinstance(thread, StatusWorkerThread) and thread.system is self:
+            return thread.defer_evaluation(program, trigger)
+        return False
+
+    def defer_setup_evaluation(self, program):
+        """
+            In batched startup (see :attr:`batched_startup`), mark program to be evaluated
+            once its callables are all set up and return True.
+        """
+        return self._startup_batch and self.defer_evaluation(program, None)
+
+    def startup_report(self):
+        """
+            Give startup timings (see :attr:`startup_timings`) as a table, slowest classes first.
+        """
+        rows = sorted(((name, t) for name, t in self.startup_timings.items() if isinstance(t, dict)),
+                      key=lambda i: i[1]['setup_system'] + i[1]['setup_callables'], reverse=True)
+        lines = ['%-30s %6s %14s %17s' % ('Class', 'Count', 'setup_system', 'setup_callables')]
+        for name, t in rows:
+            lines.append('%-30s %6d %12.1f ms %15.1f ms' % (name, t['count'], t['setup_system'] * 1000,
+                                                             t['setup_callables'] * 1000))
+        if 'evaluation' in self.startup_timings:
+            lines.append('Deferred evaluation of programs: %.1f ms' % (self.startup_timings['evaluation'] * 1000))
+        return '\n'.join(lines)
+
+    def _evaluate_programs(self, dirty):
+        for program, trigger in dirty.items():
+            program.evaluate(trigger)
+
     def flush(self):
         """
-            Flush the worker queue. Usefull in unit tests.
+            Flush the worker queue (all shards, if using multiple worker threads). Usefull in unit tests.
         """
         self.worker_thread.flush()
 
@@ -401,11 +706,13 @@ class System(SystemBase):
         """
 
         self.pre_exit_trigger = True
+        self.wait_state_saved()
 
         self.logger.info("Shutting down %s, please wait a moment.", self.name)
         for t in threading.enumerate():
             if isinstance(t, TimerClass):
                 t.cancel()
+        self.scheduler.stop()
         self.logger.debug('Timers cancelled')
 
         for i in self.objects:
@@ -423,6 +730,9 @@ class System(SystemBase):
         for ser in (i for i in self.services if isinstance(i, AbstractSystemService)):
             ser.cleanup_system()
         self.logger.debug('System services cleaned up')
+        if self.event_loop:
+            self.event_loop.stop()
+            self.logger.debug('Event loop stopped')
         threads = list(t.name for t in threading.enumerate() if t.is_alive() and not t.daemon)
         if threads:
             self.logger.info('After cleanup, we have still the following threads '
@@ -474,8 +784,11 @@ class System(SystemBase):
         return rval
 
     def __init__(self, load_state: 'List[SystemObject]'=None, load_config: 'Dict[str, Any]'=None,
-                 **traits):
+                 restore_state: 'Dict[str, Dict[str, Any]]'=None, **traits):
+        self._batch_lock = Lock('Batch lock')
+        self.dependencies = DependencyIndex()
         super().__init__(**traits)
+        self._lock_settings_changed()
         if not self.name:
             self.name = self.__class__.__name__
             if self.name == 'System':
@@ -487,11 +800,21 @@ class System(SystemBase):
                                              tags={'automate-system': self.name})
 
         self._initialize_logging()
-        self.worker_thread = StatusWorkerThread(name="Status worker thread", system=self)
+        if self.use_event_loop:
+            self.event_loop = EventLoop(self, num_threads=self.scheduler_threads)
+            self.event_loop.start()
+            self.scheduler = EventLoopScheduler(self, self.event_loop, name='Scheduler')
+        else:
+            self.scheduler = Scheduler(self, num_threads=self.scheduler_threads, name='Scheduler')
+        if self.worker_threads > 1:
+            self.worker_thread = StatusWorkerPool(name="Status worker thread", system=self,
+                                                  num_workers=self.worker_threads)
+        else:
+            self.worker_thread = StatusWorkerThread(name="Status worker thread", system=self)
         self.logger.info('Initializing services')
         self._initialize_services()
         self.logger.info('Initializing namespace')
-        self._initialize_namespace(load_state)
+        self._initialize_namespace(load_state, restore_state)
 
         if load_config:
             self.logger.info('Loading config')
@@ -544,9 +867,9 @@ class System(SystemBase):
 
         self.logger.info('Logging setup ready')
 
-    def _initialize_namespace(self, load_state=None):
+    def _initialize_namespace(self, load_state=None, restore_state=None):
         self.namespace = Namespace(system=self)
-        self.namespace.set_system(load_state)
+        self.namespace.set_system(load_state, restore_state)
 
         self.logger.info('Setup loggers per object')
         for name, obj in self.namespace.items():
@@ -105,6 +105,8 @@ class SystemObject(HasStrictTraits):
 
     _passed_arguments = Tuple(transient=True)
     _postponed_callables = Dict(transient=True)
+    # Default callables already created in setup_system, reused by setup_callables
+    _default_callables = Dict(transient=True)
 
     @property
     def class_name(self):
@@ -197,7 +199,8 @@ class SystemObject(HasStrictTraits):
         """
             Setup Callable attributes that belong to this object.
         """
-        defaults = self.get_default_callables()
+        defaults = self._default_callables or self.get_default_callables()
+        self._default_callables = {}
         for key, value in list(defaults.items()):
             self._postponed_callables.setdefault(key, value)
         for key in self.callables:
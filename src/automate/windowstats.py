@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+# (c) 2015 Tuomas Airaksinen
+#
+# This file is part of Automate.
+#
+# Automate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Automate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Automate.  If not, see <http://www.gnu.org/licenses/>.
+#
+# ------------------------------------------------------------------
+#
+# If you like Automate, please take a look at this page:
+# http://evankelista.net/automate/
+
+"""
+    Streaming statistics over a sliding window of samples.
+"""
+
+import collections
+import math
+import threading
+import time
+from numbers import Number
+
+
+class WindowStats(object):
+
+    """
+        Statistics (count, mean, stdev, min, max) of ``(timestamp, value)`` samples within
+        a sliding window. Window is either time based (samples within last ``seconds``)
+        or count based (last ``count`` samples). Time based window also keeps the newest
+        sample older than the window, because that value is in effect at the start of
+        the window, so a value that has not changed is still in the window.
+
+        Mean and variance are updated with Welford's algorithm and min/max with monotonic
+        deques, so adding and expiring samples is O(1) amortized. Non-numeric values
+        are ignored.
+
+        Usage::
+
+            w = WindowStats(seconds=60)
+            w.add(time.time(), 1.5)
+            w.stdev
+    """
+
+    def __init__(self, seconds=None, count=None):
+        if (seconds is None) == (count is None):
+            raise ValueError('Either seconds or count must be given')
+        self.seconds = seconds
+        self.count = count
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self._samples = collections.deque()  # (seq, timestamp, value)
+        self._seq = 0
+        self._mean = 0.
+        self._m2 = 0.
+        self._min = collections.deque()  # (seq, value), increasing values
+        self._max = collections.deque()  # (seq, value), decreasing values
+        self._minmax_dirty = False
+
+    def reset(self, samples=()):
+        """ Clear and add samples (iterable of ``(timestamp, value)``) """
+        with self._lock:
+            self.clear()
+            for t, value in samples:
+                self._add(t, value)
+
+    def add(self, t, value):
+        with self._lock:
+            self._add(t, value)
+
+    def pop(self):
+        """ Remove newest sample """
+        with self._lock:
+            if not self._samples:
+                return
+            seq, t, value = self._samples.pop()
+            self._remove_stats(value)
+            # Values evicted by the removed one are lost, rebuild min/max when needed
+            self._minmax_dirty = True
+
+    def _add(self, t, value):
+        if not isinstance(value, Number):
+            return
+        self._seq += 1
+        self._samples.append((self._seq, t, value))
+        n = len(self._samples)
+        delta = value - self._mean
+        self._mean += delta / n
+        self._m2 += delta * (value - self._mean)
+        if not self._minmax_dirty:
+            self._push_minmax(self._seq, value)
+        if self.count is not None and n > self.count:
+            self._remove_oldest()
+        elif self.seconds is not None:
+            # Expire also here, so that windows that are rarely read do not grow
+            self._expire(t - self.seconds)
+
+    def _push_minmax(self, seq, value):
+        while self._min and self._min[-1][1] >= value:
+            self._min.pop()
+        self._min.append((seq, value))
+        while self._max and self._max[-1][1] <= value:
+            self._max.pop()
+        self._max.append((seq, value))
+
+    def _remove_stats(self, value):
+        n = len(self._samples)
+        if n == 0:
+            self._mean = self._m2 = 0.
+            return
+        delta = value - self._mean
+        self._mean -= delta / n
+        self._m2 = max(self._m2 - delta * (value - self._mean), 0.)
+
+    def _remove_oldest(self):
+        seq, t, value = self._samples.popleft()
+        self._remove_stats(value)
+        if self._min and self._min[0][0] == seq:
+            self._min.popleft()
+        if self._max and self._max[0][0] == seq:
+            self._max.popleft()
+
+    def _expire(self, limit):
+        # Sample preceding the first one newer than limit is the value in effect at limit
+        while len(self._samples) > 1 and self._samples[1][1] <= limit:
+            self._remove_oldest()
+
+    def _update(self):
+        if self.seconds is not None:
+            self._expire(time.time() - self.seconds)
+        if self._minmax_dirty:
+            self._min.clear()
+            self._max.clear()
+            for seq, t, value in self._samples:
+                self._push_minmax(seq, value)
+            self._minmax_dirty = False
+
+    @property
+    def n(self):
+        """ Number of samples in window """
+        with self._lock:
+            self._update()
+            return len(self._samples)
+
+    @property
+    def mean(self):
+        with self._lock:
+            self._update()
+            return self._mean
+
+    @property
+    def variance(self):
+        """ Sample variance """
+        with self._lock:
+            self._update()
+            n = len(self._samples)
+            return self._m2 / (n - 1) if n > 1 else 0.
+
+    @property
+    def stdev(self):
+        """ Sample standard deviation """
+        return math.sqrt(self.variance)
+
+    @property
+    def min(self):
+        with self._lock:
+            self._update()
+            return self._min[0][1] if self._min else None
+
+    @property
+    def max(self):
+        with self._lock:
+            self._update()
+            return self._max[0][1] if self._max else None
+
+    def __repr__(self):
+        window = '%ss' % self.seconds if self.seconds is not None else '%d samples' % self.count
+        return '<%s %s>' % (self.__class__.__name__, window)
@@ -24,6 +24,51 @@
 import queue
 import logging
 import threading
+from collections import OrderedDict
+from contextlib import ExitStack
+
+
+class CoalescingQueue(queue.Queue):
+
+    """
+        Unbounded queue where a job that has ``coalesce_key`` replaces (in place) a job with
+        the same key that is still waiting in the queue. Thus, the queue depth is bounded by
+        the number of distinct keys rather than by the rate of events.
+    """
+
+    def _init(self, maxsize):
+        super()._init(maxsize)
+        self._pending = {}
+        #: Number of jobs that have been replaced by newer ones
+        self.coalesced = 0
+
+    def put(self, item, block=True, timeout=None):
+        key = getattr(item, 'coalesce_key', None)
+        with self.mutex:
+            entry = self._pending.get(key) if key is not None else None
+            if entry is not None:
+                item.coalesce(entry[0])
+                entry[0] = item
+                self.coalesced += 1
+                return
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+    def _put(self, item):
+        entry = [item]
+        key = getattr(item, 'coalesce_key', None)
+        if key is not None:
+            self._pending[key] = entry
+        self.queue.append(entry)
+
+    def _get(self):
+        entry = self.queue.popleft()
+        item = entry[0]
+        key = getattr(item, 'coalesce_key', None)
+        if key is not None and self._pending.get(key) is entry:
+            del self._pending[key]
+        return item
 
 
 class StatusWorkerTask:
@@ -37,6 +82,14 @@ class StatusWorkerTask:
     def status(self):
         return self.args[0]
 
+    @property
+    def coalesce_key(self):
+        # Newer _set_real_status task of the same object supersedes the older one
+        return self.object, '_set_real_status'
+
+    def coalesce(self, older):
+        pass
+
     def run(self):
         with self.object._status_lock:
             if self is self.object._queued_job:
@@ -58,11 +111,17 @@ class StatusWorkerTask:
 
 class DummyStatusWorkerTask:
 
+    coalesce_key = None
+
     def __init__(self, func, *args, **kwargs):
         self.func = func
         self.args = args
         self.kwargs = kwargs
 
+    @property
+    def object(self):
+        return getattr(self.func, '__self__', None)
+
     def run(self):
         self.func(*self.args, **self.kwargs)
 
@@ -70,6 +129,25 @@ class DummyStatusWorkerTask:
         return '<Dummy %s %s %s>' % (self.func, self.args, self.kwargs)
 
 
+class KeyedStatusWorkerTask(DummyStatusWorkerTask):
+
+    """
+        Task that replaces a pending task with the same key in the worker queue.
+    """
+
+    def __init__(self, key, func, *args, **kwargs):
+        self.coalesce_key = key
+        super().__init__(func, *args, **kwargs)
+
+    def coalesce(self, older):
+        """ Called when this task replaces older one in the queue. ``force`` of older one is kept. """
+        if older.kwargs.get('force'):
+            self.kwargs['force'] = True
+
+    def __repr__(self):
+        return '<Keyed %s %s %s>' % (self.func, self.args, self.kwargs)
+
+
 class StatusWorkerThread(threading.Thread):
 
     def _set_stop(self):
@@ -77,7 +155,14 @@ class StatusWorkerThread(threading.Thread):
         self.logger.debug('Stop set')
 
     def __init__(self, system=None, *args, **kwargs):
-        self.queue = queue.Queue()
+        self.queue = CoalescingQueue()
+        # Held while a job is being run, see paused()
+        self.job_lock = threading.RLock()
+        # True while processing jobs within an automatic batch (see System.batch_worker_drain).
+        # Evaluation of programs triggered in this thread is deferred to the end of the batch.
+        self._in_drain_batch = False
+        self._drain_jobs = 0
+        self._drain_dirty = OrderedDict()
         self._stop_now = False
         self.system = system
         self.logger = system.logger.getChild('StatusWorkerThread')
@@ -95,13 +180,42 @@ class StatusWorkerThread(threading.Thread):
     def process_job(self):
         job = self.queue.get()
         try:
-            job.run()
+            with self.job_lock:
+                if self.system.batch_worker_drain and not self._in_drain_batch:
+                    self._in_drain_batch = True
+                    self._drain_jobs = 0
+                try:
+                    job.run()
+                finally:
+                    if self._in_drain_batch:
+                        self._drain_jobs += 1
+                        # Batch ends when queue is drained, or after a bounded number of
+                        # jobs, so that programs are evaluated also under sustained load
+                        if not self.queue.queue or self._drain_jobs >= self.system.batch_worker_drain_limit:
+                            self._end_drain_batch()
         except Exception as e:
             if self.system.raven_client:
                 self.system.raven_client.captureException()
             self.logger.exception('Error occurred when executing job %s: %s', job, e)
         self.queue.task_done()
 
+    def defer_evaluation(self, program, trigger):
+        """
+            If automatic batch is in progress in this thread, mark program to be evaluated
+            at the end of it and return True.
+        """
+        if not self._in_drain_batch:
+            return False
+        self._drain_dirty[program] = trigger
+        return True
+
+    def _end_drain_batch(self):
+        # Evaluate programs whose triggers changed within the batch
+        self._in_drain_batch = False
+        dirty, self._drain_dirty = self._drain_dirty, OrderedDict()
+        if dirty:
+            self.system._evaluate_programs(dirty)
+
     def run(self):
         self.logger.debug('StatusWorkerThread starting')
         while not self._stop_now:
@@ -122,6 +236,29 @@ class StatusWorkerThread(threading.Thread):
         self.logger.debug('Putting now %s', id(job))
         self.queue.put(job)
 
+    def locked_queues(self):
+        """
+            Context manager that prevents jobs from being put to or taken from the queue
+        """
+        return self.queue.mutex
+
+    def is_current_thread(self):
+        return threading.current_thread() is self
+
+    def paused(self):
+        """
+            Context manager that waits until the job that is currently running is finished and
+            prevents new jobs from being run. Jobs can still be put to the queue.
+        """
+        return self.job_lock
+
+    @property
+    def coalesced(self):
+        """
+            Number of jobs that were replaced by newer ones while waiting in the queue
+        """
+        return self.queue.coalesced
+
     def stop(self):
         self.logger.debug('Stopping: pre-flush')
         self.flush()
@@ -132,3 +269,78 @@ class StatusWorkerThread(threading.Thread):
         self.logger.debug('... entries: %s', self.queue.queue)
         self.flush()
         self.logger.debug('Stopping ready')
+
+
+class StatusWorkerPool:
+
+    """
+        Pool of StatusWorkerThreads. Jobs are sharded by the object they concern, such that jobs of
+        a single object are always processed (in order) by the same thread, while jobs of unrelated
+        objects may be processed in parallel.
+
+        Has the same interface as StatusWorkerThread.
+    """
+
+    def __init__(self, system=None, num_workers=2, name='Status worker thread'):
+        self.system = system
+        self.logger = system.logger.getChild('StatusWorkerPool')
+        self.workers = [StatusWorkerThread(name='%s %d' % (name, i), system=system)
+                        for i in range(num_workers)]
+
+    def worker_for(self, obj):
+        return self.workers[hash(obj) % len(self.workers)]
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+
+    def is_alive(self):
+        return any(worker.is_alive() for worker in self.workers)
+
+    def manual_flush(self):
+        # Jobs may put new jobs to other shards, so loop until all queues are empty
+        while any(worker.queue.queue for worker in self.workers):
+            for worker in self.workers:
+                worker.manual_flush()
+
+    def flush(self):
+        """
+            Wait until all shards are empty. A job being processed in one shard
+            may put new jobs into other shards, so loop until all of them are idle.
+        """
+        self.logger.debug('Flush joining')
+        while True:
+            for worker in self.workers:
+                worker.flush()
+            if not any(worker.queue.unfinished_tasks for worker in self.workers):
+                break
+        self.logger.debug('Flush joining ready')
+
+    def put(self, job):
+        self.worker_for(job.object).put(job)
+
+    @property
+    def coalesced(self):
+        return sum(worker.coalesced for worker in self.workers)
+
+    def is_current_thread(self):
+        return any(worker.is_current_thread() for worker in self.workers)
+
+    def locked_queues(self):
+        stack = ExitStack()
+        for worker in self.workers:
+            stack.enter_context(worker.locked_queues())
+        return stack
+
+    def paused(self):
+        stack = ExitStack()
+        for worker in self.workers:
+            stack.enter_context(worker.paused())
+        return stack
+
+    def stop(self):
+        self.logger.debug('Stopping: pre-flush')
+        self.flush()
+        for worker in self.workers:
+            worker.stop()
+        self.logger.debug('Stopping ready')
@@ -134,6 +134,19 @@ def test_namechange(mysys):
     assert 'mysensor' not in mysys.namespace
 
 
+def test_name_resolution_cache(mysys):
+    v = Value('later')
+    v.setup_callable_system(mysys)
+    assert v.call(None) == 'later'
+    generation = mysys.namespace.generation
+    a = FloatActuator('later', system=mysys, default=2.0)
+    mysys.flush()
+    assert mysys.namespace.generation > generation
+    assert v.call(None) == 2.0
+    a.name = 'renamed'
+    assert v.call(None) == 'later'
+
+
 def test_new_systemobj(mysys):
     a1 = FloatActuator('somename', system=mysys)
     assert 'somename' in mysys.namespace
@@ -174,6 +187,55 @@ def test_lock(sysloader):
     l.release() # final release.
 
 
+def test_lock_contention_logging(caplog):
+    import threading
+    import time
+    l = Lock('contended')
+    threshold = Lock.contention_threshold
+    Lock.contention_threshold = 0.05
+    try:
+        l.acquire()
+        owner, acquired_at = l.context
+        assert owner is threading.current_thread()
+        t = threading.Timer(0.2, l.release)
+        t.start()
+        l.acquire()
+        l.release()
+        t.join()
+
+        held = threading.Event()
+
+        def hold_lock_for_a_while():
+            with l:
+                held.set()
+                time.sleep(0.2)
+        t = threading.Thread(target=hold_lock_for_a_while)
+        t.start()
+        held.wait()
+        l.acquire()
+        l.release()
+        t.join()
+    finally:
+        Lock.contention_threshold = threshold
+    assert 'Waiting for lock contended' in caplog.text()
+    # Stack of the owner thread is logged
+    assert 'hold_lock_for_a_while' in caplog.text()
+
+
+def test_debug_locks():
+    s = System(exclude_services=['TextUIService'], name='DebugLocks', debug_locks=True)
+    try:
+        assert Lock.debug
+        l = Lock('debug')
+        with l:
+            assert isinstance(l.context, list)
+        s.debug_locks = False
+        assert not Lock.debug
+    finally:
+        s.cleanup()
+        Lock.debug = False
+
+
 def test_sysobject_callable(sysloader):
     class mysys(System):
         mysens = UserIntSensor(on_activate=Run('mycal'), priority=50)
@@ -302,3 +364,439 @@ def test_setup_system(sysloader):
 #    g.start()
 #    g.stop = True
 #    g.trigger()
+
+
+def test_worker_pool():
+    class mysys(System):
+        s1 = UserIntSensor()
+        a1 = IntActuator(active_condition=Value(True), on_update=SetStatus('a1', 's1'))
+        a2 = IntActuator(active_condition=Value(True), on_update=SetStatus('a2', Add('a1', 1)))
+
+    s = mysys(exclude_services=['TextUIService'], name='PoolSys', worker_threads=4)
+    try:
+        assert len(s.worker_thread.workers) == 4
+        assert s.worker_thread.worker_for(s.a1) is s.worker_thread.worker_for(s.a1)
+        for i in range(10):
+            s.s1.status = i
+        s.flush()
+        assert s.a1.status == 9
+        assert s.a2.status == 10
+        assert not any(w.queue.unfinished_tasks for w in s.worker_thread.workers)
+    finally:
+        s.cleanup()
+    assert not s.worker_thread.is_alive()
+
+
+def test_coalescing_queue():
+    from automate.worker import CoalescingQueue, KeyedStatusWorkerTask, DummyStatusWorkerTask
+    q = CoalescingQueue()
+    q.put(KeyedStatusWorkerTask('a', print, 1))
+    q.put(DummyStatusWorkerTask(print, 2))
+    q.put(KeyedStatusWorkerTask('a', print, 3))
+    q.put(KeyedStatusWorkerTask('b', print, 4))
+    assert q.qsize() == 3
+    assert q.coalesced == 1
+    assert [q.get().args for i in range(3)] == [(3,), (2,), (4,)]
+    q.put(KeyedStatusWorkerTask('a', print, 5))
+    assert q.qsize() == 1
+    assert q.coalesced == 1
+
+
+def test_coalesce_status_changes():
+    class mysys(System):
+        s1 = UserIntSensor(coalesce_status_changes=True)
+        s2 = UserIntSensor()
+
+    s = mysys(exclude_services=['TextUIService'], name='CoalesceSys', worker_autostart=False)
+    for i in range(1, 101):
+        s.s1.status = i
+        s.s2.status = i
+    assert s.worker_thread.queue.qsize() == 101
+    assert s.worker_thread.coalesced == 99
+    s.worker_thread.manual_flush()
+    assert s.s1.status == 100
+    assert s.s2.status == 100
+    assert len(s.s1.history) == 1
+    assert len(s.s2.history) == 100
+
+    # Forced request is not lost when a non-forced one replaces it
+    s.s1.set_status(100, force=True)
+    s.s1.set_status(100)
+    job, = [entry[0] for entry in s.worker_thread.queue.queue]
+    assert job.kwargs['force'] is True
+    s.cleanup()
+
+
+def test_history_store_service(tmpdir):
+    import os
+    class mysys(System):
+        s = UserFloatSensor()
+        t = UserStrSensor()
+
+    directory = str(tmpdir.join('history'))
+    s = mysys(exclude_services=['TextUIService'], name='HistorySys',
+              services=[HistoryStoreService(directory=directory, hot_history_length=2)])
+    for i in range(1, 6):
+        s.s.status = i
+        s.t.status = str(i)
+        s.flush()
+    backend = s.s.history_backend
+    assert len(s.s.history) == 2
+    assert len(backend) == 5
+    assert list(backend.statuses) == [1., 2., 3., 4., 5.]
+    assert s.t.history_backend is None
+
+    t0 = backend.times[0]
+    t_end = backend.times[-1]
+    assert s.s.status_at_time(t0) == 1.
+    assert s.s.integral(t0, t_end + 1) == pytest.approx(sum(
+        v * (t2 - t1) for v, t1, t2 in zip(range(1, 6), backend.times, list(backend.times[1:]) + [t_end + 1])))
+
+    backend.write(t_end, 10.)
+    assert len(backend) == 5
+    assert backend.status_at(t_end) == 10.
+    # File is mapped again only when it grows over its slack
+    mapping = backend._mmap
+    backend.write(t_end + 1, 11.)
+    assert backend.status_at(t_end + 1) == 11.
+    assert backend._mmap is mapping
+    backend.write(t_end + 1, 10.)
+    s.cleanup()
+    # Slack is trimmed when file is closed
+    assert os.path.getsize(backend.path) == 6 * backend.record.size
+
+    s = mysys(exclude_services=['TextUIService'], name='HistorySys',
+              services=[HistoryStoreService(directory=directory)])
+    assert list(s.s.history_backend.statuses) == [1., 2., 3., 4., 10., 10.]
+    s.cleanup()
+
+
+def test_statussaver_journal(tmpdir):
+    import os
+    import pickle
+    from automate.services.statussaver import replay_journal
+
+    class mysys(System):
+        s = UserFloatSensor()
+
+    filename = str(tmpdir.join('state.dmp'))
+    saver = StatusSaverService(incremental=True, journal_interval=0, dump_interval=0)
+    s = mysys(exclude_services=['TextUIService'], name='JournalSys', filename=filename, services=[saver])
+    assert os.path.exists(filename)
+    s.s.status = 1.
+    s.flush()
+    saver.write_journal()
+    s.s.status = 2.
+    s.flush()
+    s.s.status = 3.
+    s.flush()
+    s.cleanup()
+    assert os.path.exists(saver.journal_filename)
+
+    with open(filename, 'rb') as f:
+        version, (obj_list, config) = pickle.load(f)
+    assert replay_journal(filename, obj_list, config) == 2
+    s = System(load_state=obj_list, exclude_services=['TextUIService'], name='JournalSys')
+    sensor = s.namespace['s']
+    assert sensor.status == 3.
+    assert [v for t, v in sensor.history][:3] == [1., 2., 3.]
+    s.cleanup()
+
+
+def test_statussaver_background_snapshot(tmpdir):
+    import os
+    import threading
+    import mock
+
+    class mysys(System):
+        s = UserFloatSensor()
+
+    filename = str(tmpdir.join('state.dmp'))
+    saver = StatusSaverService(incremental=True, journal_interval=0, dump_interval=0)
+    s = mysys(exclude_services=['TextUIService'], name='JournalSys', filename=filename, services=[saver])
+    s.s.status = 1.
+    s.flush()
+    saver.write_journal()
+    assert os.path.exists(saver.journal_filename)
+
+    release = threading.Event()
+    replace_state_file = System._replace_state_file
+
+    def slow_replace(self, snapshot):
+        release.wait(5)
+        return replace_state_file(self, snapshot)
+
+    try:
+        with mock.patch.object(System, '_replace_state_file', autospec=True, side_effect=slow_replace):
+            saver.save_snapshot(wait=False)
+            # State is written in the background: journal is kept and not written until then
+            s.s.status = 2.
+            s.flush()
+            saver.write_journal()
+            assert os.path.exists(saver.journal_filename)
+            assert 's' in saver._changed
+            release.set()
+            s.wait_state_saved()
+        assert not os.path.exists(saver.journal_filename)
+        saver.write_journal()
+        assert os.path.exists(saver.journal_filename)
+    finally:
+        release.set()
+        s.cleanup()
+
+
+def test_state_snapshot(tmpdir, caplog):
+    import os
+    import pickle
+
+    class mysys(System):
+        s = UserFloatSensor()
+
+    filename = str(tmpdir.join('state.dmp'))
+
+    def load_sensor_state():
+        with open(filename, 'rb') as f:
+            version, (obj_list, config) = pickle.load(f)
+        state, = [o._passed_arguments[1] for o in obj_list if o._passed_arguments[1]['name'] == 's']
+        return state
+
+    s = mysys(exclude_services=['TextUIService', 'StatusSaverService'], name='SnapshotSys',
+              filename=filename)
+    s.s.status = 1.
+    s.flush()
+    snapshot = s.snapshot()
+    s.s.status = 2.
+    s.flush()
+    s._write_state(snapshot)
+    state = load_sensor_state()
+    assert state['_status'] == 1.
+    assert [v for t, v in state['history']] == [1.]
+
+    s.save_state()
+    state = load_sensor_state()
+    assert state['_status'] == 2.
+    assert [v for t, v in state['history']] == [1., 2.]
+    assert s.last_save_duration > 0.
+    assert s.last_save_pause >= 0.
+    assert os.path.exists(filename + '.1')
+    assert not os.path.exists(filename + '.tmp')
+
+    # Failed write leaves the state file as it was, and no temporary file
+    snapshot = s.snapshot()
+    snapshot.dump = None  # not callable, so writing fails
+    caplog.error_ok = True
+    s._write_state(snapshot)
+    assert not os.path.exists(filename + '.tmp')
+    assert load_sensor_state()['_status'] == 2.
+    s.cleanup()
+
+
+def test_binary_state(tmpdir):
+    from automate.statefile import is_binary_state
+
+    def mysys():
+        # Objects are set up by the system, so create new ones for each system
+        class mysys(System):
+            s = UserFloatSensor()
+            b = UserBoolSensor()
+            t = UserStrSensor()
+            a = FloatActuator()
+            p = Program(active_condition=Value('b'), on_activate=SetStatus('a', 's'))
+        return mysys
+
+    filename = str(tmpdir.join('state.dmp'))
+    kwargs = dict(exclude_services=['TextUIService', 'StatusSaverService'], name='BinarySys',
+                  state_format='binary')
+    s = mysys()(filename=filename, **kwargs)
+    for i in range(1, 4):
+        s.s.status = float(i)
+        s.flush()
+    s.b.status = True
+    s.t.status = 'hello'
+    s.flush()
+    assert s.a.status == 3.
+    s.save_state()
+    history = list(s.s.history)
+    s.cleanup()
+
+    with open(filename, 'rb') as f:
+        assert is_binary_state(f)
+
+    import mock
+    with mock.patch.object(sys, 'argv', [__file__]):
+        s = mysys().load_or_create(filename, **kwargs)
+    s.flush()
+    assert s.s.status == 3.
+    assert list(s.s.history) == history
+    assert s.b.status is True
+    assert [v for t, v in s.b.history][-1] is True
+    assert s.t.status == 'hello'
+    assert s.a.status == 3.
+    s.cleanup()
+
+    # Program file more recent: objects come from the program file, statuses from the state file
+    os.utime(filename, (0, 0))
+    with mock.patch.object(sys, 'argv', [__file__]):
+        s = mysys().load_or_create(filename, no_input=True, **kwargs)
+    s.flush()
+    assert s.s.status == 3.
+    assert list(s.s.history) == history
+    assert s.t.status == 'hello'
+    s.cleanup()
+
+
+def test_scheduler():
+    from automate.scheduler import Scheduler
+    scheduler = Scheduler(num_threads=2)
+    calls = []
+    try:
+        scheduler.schedule(0.2, calls.append, 'b', name='b')
+        scheduler.schedule(0.1, calls.append, 'a', name='a')
+        cancelled = scheduler.schedule(0.15, calls.append, 'c', name='c')
+        assert [j.name for j in scheduler.upcoming()] == ['a', 'c', 'b']
+        cancelled.cancel()
+        assert not cancelled.is_alive()
+        assert [j.name for j in scheduler.upcoming()] == ['a', 'b']
+        time.sleep(0.4)
+        assert calls == ['a', 'b']
+        assert len(scheduler) == 0
+    finally:
+        scheduler.stop()
+
+
+def test_scheduler_periodic_drift():
+    from automate.scheduler import Scheduler
+    scheduler = Scheduler()
+    times = []
+
+    def slow():
+        times.append(time.time())
+        time.sleep(0.03)
+    try:
+        job = scheduler.schedule_periodic(0.1, slow)
+        time.sleep(0.55)
+        job.cancel()
+    finally:
+        scheduler.stop()
+    assert 5 <= len(times) <= 7
+    # Runs stay at fixed intervals from the first one, despite time taken by each run
+    for i, t in enumerate(times):
+        assert abs(t - times[0] - i * 0.1) < 0.05
+
+
+def test_scheduler_periodic_no_overlap():
+    import threading
+    from automate.scheduler import Scheduler
+    scheduler = Scheduler(num_threads=3)
+    lock = threading.Lock()
+    running = []
+    overlaps = []
+
+    def slow():
+        with lock:
+            running.append(1)
+            if len(running) > 1:
+                overlaps.append(len(running))
+        time.sleep(0.12)
+        with lock:
+            running.pop()
+    try:
+        job = scheduler.schedule_periodic(0.05, slow)
+        time.sleep(0.5)
+        job.cancel()
+    finally:
+        scheduler.stop()
+    assert not overlaps
+
+
+def test_polling_sensor_uses_scheduler(sysloader):
+    class mysys(System):
+        p = PollingSensor(interval=0.05, status_updater=Value(1))
+
+    s = sysloader.new_system(mysys)
+    job = s.p._pollthread
+    assert job in s.scheduler.upcoming()
+    assert job.interval == 0.05
+    s.p.interval = 0.1
+    assert not job.is_alive()
+    assert s.p._pollthread.interval == 0.1
+    s.p.interval = 0
+    assert s.p._pollthread.interval == s.p.min_interval
+    job = s.p._pollthread
+    s.p.poll_active = False
+    assert job not in s.scheduler.upcoming()
+
+
+def test_event_loop(tmpdir):
+    import threading
+    from automate.eventloop import EventLoopScheduler
+    lines = []
+
+    def myfunc(line):
+        lines.append(line)
+        return line[:-1]
+
+    def generator_filter(q):
+        while True:
+            line = q.get()
+            if not line:
+                break
+            yield line[:-1]
+
+    filename = str(tmpdir.join('watched'))
+    open(filename, 'w').close()
+
+    class mysys(System):
+        poll = PollingSensor(interval=0.05, status_updater=Func(time.time))
+        shell = ShellSensor(cmd='echo test\necho test2', filter=myfunc)
+        shell2 = ShellSensor(cmd='echo test\necho test3', filter=generator_filter)
+        files = FileChangeSensor(filename=filename)
+        s = UserBoolSensor()
+        a = BoolActuator()
+        p = Program(on_activate=Delay(0.05, SetStatus('a', True)), active_condition=Value('s'))
+
+    s = mysys(exclude_services=['TextUIService'], name='EventLoopSys', use_event_loop=True)
+    try:
+        assert isinstance(s.scheduler, EventLoopScheduler)
+        assert s.event_loop.is_alive()
+        s.s.status = True
+        with open(filename, 'a') as f:
+            f.write('x')
+        time.sleep(0.3)
+        s.flush()
+        assert s.shell.status == 'test2'
+        assert lines == ['test line', 'test\n', 'test2\n']
+        assert s.shell2.status == 'test3'
+        assert s.files.status > 0
+        assert s.a.status is True
+        first = s.poll.status
+        time.sleep(0.15)
+        assert s.poll.status > first
+        assert not [t for t in threading.enumerate() if isinstance(t, threading.Timer)]
+    finally:
+        s.cleanup()
+    assert not s.event_loop.is_alive()
+
+
+def test_event_loop_shell_no_wait():
+    import os
+    import threading
+
+    class mysys(System):
+        s = UserBoolSensor()
+        pid = UserIntSensor()
+        p = Program(active_condition=Value('s'),
+                    on_activate=SetStatus('pid', Shell('echo test; sleep 0.1', no_wait=True)))
+
+    s = mysys(exclude_services=['TextUIService'], name='EventLoopSys2', use_event_loop=True)
+    try:
+        threads = threading.active_count()
+        s.s.status = True
+        s.flush()
+        assert s.pid.status > 0
+        assert threading.active_count() == threads
+        time.sleep(0.5)
+        with pytest.raises(ChildProcessError):
+            os.waitpid(s.pid.status, os.WNOHANG)
+    finally:
+        s.cleanup()
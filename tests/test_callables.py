@@ -1322,6 +1322,86 @@ def test_logical2(prog):
         c.call(prog)
 
 
+def test_window_callables(sysloader):
+    class ms(System):
+        # Initial value is in the windows too
+        s = UserFloatSensor(default=5)
+        mean = FloatActuator()
+        mn = FloatActuator()
+        mx = FloatActuator()
+        prog = Program(on_update=Run(SetStatus('mean', Mean('s', 2)),
+                                     SetStatus('mn', MinOverTime('s', 60)),
+                                     SetStatus('mx', MaxOverTime('s', 60))),
+                       exclude_triggers=['mean', 'mn', 'mx'])
+    s = sysloader.new_system(ms)
+    for v in [4., 2., 6.]:
+        s.s.status = v
+        s.flush()
+    assert s.mean.status == 4.
+    assert s.mn.status == 2.
+    assert s.mx.status == 6.
+
+
+def test_compile_callable(mysys):
+    from automate.compiler import compile_callable
+    sens, act = mysys.sens, mysys.act
+    conditions = [
+        And(Or(sens, 'a2'), More(act, 1)),
+        Sum(act, 1, Neg(act), Product(2, Inv(4))),
+        Min(act, 4), Max(), Not(sens), Equal(act, ORIGVAL), Division(act, 2),
+        Less(act, 'x'), And([sens, act]), Or(), Value(float('inf')),
+    ]
+    for c in conditions:
+        c.setup_callable_system(mysys)
+        f = compile_callable(c)
+        for status in [False, True]:
+            sens.status = status
+            mysys.flush()
+            assert f(mysys.prog) == c.call(mysys.prog), f.source
+    assert compile_callable(conditions[0]).opaque == []
+    assert compile_callable(conditions[8]).opaque == [conditions[8]]
+
+
+def test_compile_callable_iterable_children(sysloader):
+    from automate.compiler import compile_callable
+
+    class ms(System):
+        b1 = UserBoolSensor()
+        b2 = UserBoolSensor()
+
+    s = sysloader.new_system(ms)
+    conditions = [
+        And(OfType(UserBoolSensor)), Or(OfType(UserBoolSensor)),
+        And(Value(['b1', 'b2'])), Or(Value(['b1', 'b2'])),
+        Or(And(OfType(UserBoolSensor)), Value('b1')),
+    ]
+    for c in conditions:
+        c.setup_callable_system(s)
+        f = compile_callable(c)
+        for b1, b2 in [(False, False), (True, False), (False, True), (True, True)]:
+            s.b1.status = b1
+            s.b2.status = b2
+            s.flush()
+            assert f() == c.call(), (f.source, b1, b2)
+
+
+def test_compile_conditions(mysys):
+    mysys.compile_conditions = True
+    prog = mysys.prog
+    prog.active_condition = And(Value('sens'), More('a2', 1))
+    mysys.sens.status = True
+    mysys.flush()
+    assert prog.active
+    assert mysys.act.status == NEWVAL
+    # Compiled function is invalidated when arguments change
+    prog.active_condition[1][1] = 5
+    mysys.sens.status = False
+    mysys.sens.status = True
+    mysys.flush()
+    assert not prog.active
+    assert mysys.act.status == ORIGVAL
+
+
 def test_logic_cmp():
     v1 = Value(1)
     v2 = Value(2)
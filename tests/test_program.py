@@ -283,3 +283,179 @@ def test_logicstr(mysys):
     mysys.p3.targets_str = '{a1}'
     assert mysys.p3.targets_str in ["TraitSetObject(['a1'])", "TraitSetObject({'a1'})"]
     assert mysys.p3.targets == {mysys.a1}
+
+
+def test_incremental_evaluation(sysloader):
+    import mock
+
+    class ms(System):
+        s1 = UserFloatSensor()
+        s2 = UserFloatSensor()
+        s3 = UserFloatSensor()
+        p = Program(active_condition=And(More(Sum('s1', 's2'), 1), More('s3', 1)))
+
+    s = sysloader.new_system(ms)
+    s.incremental_evaluation = True
+    s.s3.status = 2
+    s.flush()
+    assert not s.p.active
+
+    def program_calls():
+        # Callable.status properties are evaluated with caller None
+        return len([c for c in sum_call.call_args_list if c[0][1] is s.p])
+
+    with mock.patch.object(Sum, 'call', autospec=True, side_effect=Sum.call) as sum_call:
+        s.s3.status = 3
+        s.flush()
+        assert program_calls() == 0
+        s.s1.status = 2
+        s.flush()
+        assert program_calls() == 1
+        assert s.p.active
+
+        # Tree edits invalidate cache
+        s.p.active_condition[0][1] = 5
+        s.s3.status = 4
+        s.flush()
+        assert not s.p.active
+        assert program_calls() == 2
+
+    s.incremental_evaluation = False
+    s.s2.status = 4
+    s.flush()
+    assert s.p.active
+
+
+@pytest.mark.parametrize('worker_drain', [False, True])
+def test_batch(sysloader, worker_drain):
+    import mock
+
+    class ms(System):
+        s1 = UserIntSensor()
+        s2 = UserIntSensor()
+        start = UserBoolSensor()
+        a = IntActuator()
+        setter = Program(active_condition=Value('start'),
+                         on_activate=SetStatus(['s1', 's2'], [3, 4]))
+        p = Program(active_condition=More(Sum('s1', 's2'), 0),
+                    on_activate=SetStatus('a', Sum('s1', 's2')))
+
+    s = sysloader.new_system(ms)
+    s.batch_worker_drain = worker_drain
+
+    def evaluations():
+        return [c[0][1] for c in evaluate.call_args_list if c[0][0] is s.p]
+
+    with mock.patch.object(Program, 'evaluate', autospec=True, side_effect=Program.evaluate) as evaluate:
+        with s.batch():
+            s.s1.status = 1
+            s.s2.status = 2
+            with s.batch():
+                s.s1.status = 5
+            assert evaluations() == []
+        assert evaluations() == [s.s1]
+        assert s.a.status == 7
+
+        s.start.status = True
+        s.flush()
+        assert s.a.status == 7
+        assert len(evaluations()) == (2 if worker_drain else 3)
+
+
+@pytest.mark.parametrize('limit, count', [(100, 1), (1, 2)])
+def test_batch_worker_drain_limit(sysloader, limit, count):
+    import mock
+
+    class ms(System):
+        s1 = UserIntSensor()
+        s2 = UserIntSensor()
+        p = Program(active_condition=More(Sum('s1', 's2'), 0))
+
+    s = sysloader.new_system(ms)
+    s.batch_worker_drain = True
+    s.batch_worker_drain_limit = limit
+    with mock.patch.object(Program, 'evaluate', autospec=True, side_effect=Program.evaluate) as evaluate:
+        with s.worker_thread.paused():
+            s.s1.status = 1
+            s.s2.status = 2
+        s.flush()
+        # Batch ends after limit jobs even if the queue is not drained yet
+        assert len([c for c in evaluate.call_args_list if c[0][0] is s.p]) == count
+    assert s.p.active
+
+
+def test_dependency_index(mysys):
+    deps = mysys.dependencies
+    for p in mysys.programs:
+        assert deps.triggers_of(p) == p.actual_triggers
+        assert deps.targets_of(p) == p.actual_targets
+    p3 = mysys.p3
+    assert p3 in deps.targeting_programs(mysys.a2)
+    assert p3 in deps.triggered_programs(mysys.s1)
+
+    p3.on_activate = SetStatus('a1', 's2')
+    assert deps.triggers_of(p3) == {mysys.s2}
+    assert p3 not in deps.triggered_programs(mysys.s1)
+    assert p3 in deps.triggered_programs(mysys.s2)
+    assert p3 not in deps.targeting_programs(mysys.a2)
+    assert p3 in deps.targeting_programs(mysys.a1)
+
+    del mysys.namespace['p3']
+    assert p3 not in deps.triggered_programs(mysys.s2)
+    assert deps.triggers_of(p3) == set()
+
+
+def test_dependency_dispatch(sysloader):
+    class ms(System):
+        s1 = UserBoolSensor()
+        s2 = UserBoolSensor()
+        a1 = BoolActuator()
+        a2 = BoolActuator()
+        p1 = Program(active_condition=Value('s1'), on_activate=SetStatus('a1', True))
+        p2 = Program(active_condition=Value('a1'), on_activate=SetStatus('a2', True))
+        p3 = Program(active_condition=Value('s2'), on_activate=SetStatus('s1', True))
+
+    s = sysloader.new_system(ms)
+    deps = s.dependencies
+    assert deps.affected_programs(s.s2) == {s.p3, s.p1, s.p2}
+    assert deps.affected_programs(s.a1) == {s.p2}
+    assert deps.affected_programs(s.a2) == set()
+    assert deps.affecting_objects(s.a2) == {s.a1, s.s1, s.s2}
+
+    # One dispatching listener per trigger, regardless of number of programs
+    s.namespace['p4'] = Program(active_condition=Or('s1', 's2'))
+    assert deps.triggered_programs(s.s1) == {s.p1, s.namespace['p4']}
+    notifiers = s.s1._trait('status', 2)._notifiers(True)
+    assert len([n for n in notifiers if n.equals(deps.status_changed)]) == 1
+
+    s.s2.status = True
+    s.flush()
+    assert s.a1.status and s.a2.status
+    assert s.namespace['p4'].active
+
+
+@pytest.mark.parametrize('batched', [False, True])
+def test_batched_startup(sysloader, batched):
+    class ms(System):
+        s1 = UserBoolSensor(default=True)
+        a1 = BoolActuator()
+        a2 = IntActuator()
+        p1 = Program(active_condition=Value('s1'), on_activate=SetStatus('a1', True))
+        p2 = Program(active_condition=Value('a1'), on_activate=SetStatus('a2', 5),
+                     on_deactivate=SetStatus('a2', 1))
+        p3 = Program(priority=2, active_condition=Not('s1'), on_activate=SetStatus('a2', 3))
+
+    import mock
+    with mock.patch.object(Program, 'evaluate', autospec=True, side_effect=Program.evaluate) as evaluate:
+        s = sysloader.new_system(ms, batched_startup=batched)
+    if batched:
+        # Each program is evaluated once, after all callables are set up
+        assert sorted(c[0][0].name for c in evaluate.call_args_list if c[0][1] is None) == ['p1', 'p2', 'p3']
+    assert s.batched_startup == batched
+    assert s.p1.active and s.p2.active and not s.p3.active
+    assert s.a1.status is True
+    assert s.a2.status == 5
+    timings = s.startup_timings
+    assert timings['Program']['count'] == 3
+    assert ('evaluation' in timings) == batched
+    assert 'Program' in s.startup_report()
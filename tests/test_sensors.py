@@ -89,6 +89,8 @@ def test_history_math(sysloader):
 
     assert s.status_at_time(2) == approx(0.5)
     assert s.status_at_time(3) == approx(0.5)
+    assert s.statuses_at_times([-1, 0.5, 1, 1.5, 3]) == approx([0., 0., 1., 1., 0.5])
+    assert s.status_at_time(datetime.fromtimestamp(1.5)) == approx(1.)
 
     assert s.integral(-1,1) == approx(0)
 
@@ -108,6 +110,197 @@ def test_history_math(sysloader):
     assert s.integral(0,4) == approx(2)
 
 
+def test_history_store():
+    from automate.history import History
+    h = History(maxlen=3)
+    for i in range(10):
+        h.append((i, i * 10))
+    assert len(h) == 3
+    assert list(h) == [(7, 70), (8, 80), (9, 90)]
+    assert h[0] == (7, 70)
+    assert h[-1] == (9, 90)
+    assert h.times == [7, 8, 9]
+    assert h.status_at(6) == 0.
+    assert h.status_at(8.5) == 80
+    assert h.pop() == (9, 90)
+    assert list(reversed(h)) == [(8, 80), (7, 70)]
+
+
+@pytest.mark.parametrize('store', ['History', 'NumpyHistory'])
+def test_history_store_integral(store):
+    if store == 'NumpyHistory':
+        pytest.importorskip('numpy')
+    from automate import history
+    h = getattr(history, store)(maxlen=4)
+    h.extend([(0, 0.), (1, 1.), (2, 0.5)])
+    assert h.integral(0, 4) == approx(2.)
+    assert h.integral(-1, 0.5) == approx(0.)
+    # pop and replace, as with history_frequency
+    h.pop()
+    h.append((2, 2.))
+    assert h.integral(0, 4) == approx(5.)
+    # samples dropping off the beginning
+    h.extend([(3, 0.), (4, 1.), (5, 1.)])
+    assert list(h.times) == [2, 3, 4, 5]
+    assert h.integral(0, 6) == approx(4.)
+    assert h.integral(2.5, 4.5) == approx(1.5)
+
+
+def test_history_integral_non_numeric():
+    from automate.history import History
+    h = History([(0, 1.), (1, 'a'), (2, 2.)])
+    assert h.integral(0, 3) == approx(3.)
+
+
+@pytest.mark.parametrize('store', ['History', 'NumpyHistory'])
+def test_history_range(store):
+    if store == 'NumpyHistory':
+        pytest.importorskip('numpy')
+    from automate import history
+    h = getattr(history, store)([(i, i * 10.) for i in range(10)], maxlen=100)
+    assert history.history_range(h, 2.5, 5) == ([2.5, 3, 4, 5], [20., 30., 40., 50.])
+    assert history.history_range(h, end=1) == ([0, 1], [0., 10.])
+    assert history.history_range(h, 20) == ([20], [90.])
+    assert history.history_range(h, -5, -1) == ([], [])
+    assert history.history_since(h, 7) == ([7, 8, 9], [70., 80., 90.])
+    assert history.history_since(h, 7.5) == ([8, 9], [80., 90.])
+    assert history.history_since(h, 10) == ([], [])
+
+
+def test_downsampling():
+    from automate.history import lttb, minmax
+    times = list(range(1000))
+    values = [0.] * 1000
+    values[123] = 10.
+    values[777] = -5.
+    for method in lttb, minmax:
+        points = method(times, values, 50)
+        assert len(points) <= 50
+        assert points[0][0] == 0
+        assert (123, 10.) in points
+        assert (777, -5.) in points
+        assert [t for t, v in points] == sorted(t for t, v in points)
+    assert lttb(times, values, 50)[-1] == (999, 0.)
+    assert len(lttb(times, values, 50)) == 50
+    assert lttb(times[:10], values[:10], 50) == list(zip(times[:10], values[:10]))
+
+
+def test_compact_history(sysloader):
+    pytest.importorskip('numpy')
+    from automate.history import NumpyHistory
+
+    class HistoryTest(System):
+        s = UserFloatSensor(history_length=5, default=0, compact_history=True)
+    sys = sysloader.new_system(HistoryTest)
+
+    s = sys.s
+    assert isinstance(s.history, NumpyHistory)
+    s.history.clear()
+    s.history.extend([(0, 0.), (1, 1.), (2, 0.5)])
+    assert list(s.history) == [(0., 0.), (1., 1.), (2., 0.5)]
+    assert s.history[-1] == (2., 0.5)
+    assert list(s.times) == [0., 1., 2.]
+    assert s.status_at_time(1.5) == approx(1.)
+    assert s.integral(0, 3) == approx(1.5)
+
+    for i in range(3, 500):
+        s.history.append((i, i))
+    assert len(s.history) == 5
+    assert list(s.times) == [495., 496., 497., 498., 499.]
+    assert s.history.pop() == (499., 499.)
+    assert len(s.history) == 4
+
+    s.history_length = 3
+    assert list(s.statuses) == [496., 497., 498.]
+    assert list(s.statuses_at_times([0, 496.5, 1000])) == [0., 496., 498.]
+
+
+def test_compact_history_pickle():
+    pytest.importorskip('numpy')
+    import pickle
+    from automate.history import NumpyHistory
+    h = NumpyHistory([(1, 2.), (3, 4.)], maxlen=10)
+    h2 = pickle.loads(pickle.dumps(h))
+    assert h2.maxlen == 10
+    assert list(h2) == [(1., 2.), (3., 4.)]
+
+
+def test_window_stats():
+    import statistics
+    from automate.windowstats import WindowStats
+    values = [3., 1., 4., 1., 5., 9., 2., 6.]
+    w = WindowStats(count=4)
+    for i, v in enumerate(values):
+        w.add(i, v)
+    assert w.n == 4
+    assert w.mean == approx(statistics.mean(values[-4:]))
+    assert w.stdev == approx(statistics.stdev(values[-4:]))
+    assert w.min == 2.
+    assert w.max == 9.
+    w.pop()
+    w.add(7, 0.)
+    assert w.min == 0.
+    assert w.max == 9.
+    assert w.mean == approx(statistics.mean([5., 9., 2., 0.]))
+
+    w = WindowStats(seconds=3)
+    w.reset(enumerate(values))
+    with mock.patch('time.time', lambda: 9.):
+        assert w.n == 2
+        assert w.min == 2.
+        assert w.stdev == approx(statistics.stdev([2., 6.]))
+    with mock.patch('time.time', lambda: 10.):
+        assert w.n == 1
+        assert w.max == 6.
+
+    # Samples expire also when window is not read
+    w = WindowStats(seconds=1)
+    for i in range(1000):
+        w.add(i * .1, float(i))
+    assert len(w._samples) <= 12
+
+    with pytest.raises(ValueError):
+        WindowStats()
+
+
+def test_window_stats_sensor(sysloader):
+    import statistics
+    import time
+
+    class WindowTest(System):
+        s = UserFloatSensor(history_length=20, default=0)
+    sys = sysloader.new_system(WindowTest)
+
+    s = sys.s
+    w = s.window_stats(count=3)
+    assert s.window_stats(count=3) is w
+    for v in [1., 2., 3., 4.]:
+        s.status = v
+        sys.flush()
+    assert w.mean == approx(3.)
+    assert s.stdev(60) == approx(statistics.stdev([1., 2., 3., 4.]))
+
+    s.history_frequency = 60
+    s.status = 10.
+    sys.flush()
+    assert [v for t, v in s.history][-2:] == [3., 10.]
+    assert w.max == 10.
+    assert w.mean == approx(statistics.mean([2., 3., 10.]))
+
+    s.history = [(0, 1.), (1, 5.)]
+    assert w.mean == approx(3.)
+
+    # Value that has not changed during the window is in effect for the whole window
+    s.history = [(time.time() - 100, 7.)]
+    assert s.window_stats(seconds=10).min == 7.
+    assert s.window_stats(seconds=10).n == 1
+
+    s.max_windows = 2
+    for i in range(5):
+        s.window_stats(seconds=i + 1)
+    assert len(s._windows) == 2
+
+
 def test_history_integral(sysloader):
     class HistoryTest(System):
         s = UserFloatSensor(history_length=20, default=0)
@@ -123,7 +316,6 @@ def test_history_integral(sysloader):
     s2 = sys.s2
     assert s2.status == approx(0.)
     s.history.extend([(0, 0.), (1, 1.), (2, 0.5)])
-    s.integral.cache_clear()
     assert s.integral(0,3) == approx(1.5)
 
     sys.trig.status = 1
@@ -148,7 +340,6 @@ def test_full_integral(sysloader):
     s2 = sys.s2
     assert s2.status == approx(0.)
     s.history.extend([(0, 0.), (1, 1.), (2, 0.5)])
-    s.integral.cache_clear()
     with mock.patch("time.time", new_callable=lambda *args: lambda *args: 2):
         assert s.integral() == approx(1)
 
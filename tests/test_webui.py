@@ -14,6 +14,8 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with Automate.  If not, see <http://www.gnu.org/licenses/>.
+import json
+from collections import deque
 from urllib.parse import urlparse
 
 import pytest
@@ -117,6 +119,205 @@ def test_web(sys_with_web, logged_client, constants):
         assert res.status_code == Http.OK
 
 
+
+class FakeSocket(object):
+    def __init__(self, *objects):
+        self.subscribed_objects = set(objects)
+        self.last_message = None
+        self.log_requested = False
+        self.session_id = None
+        self.messages = []
+        self.history_subscriptions = {}
+
+    def send(self, msg):
+        self.messages.append(json.loads(msg))
+
+
+def test_websocket_batching(sys_with_web):
+    import mock
+    web = sys_with_web.request_service('WebService')
+    sockets = [FakeSocket('s1', 's2'), FakeSocket('s2')]
+    web._sockets.extend(sockets)
+    # Frames are flushed here manually, instead of in IOLoop
+    web._frame_callback = True
+    try:
+        with mock.patch.object(sys_with_web.s2.__class__, 'get_status_display',
+                               autospec=True, return_value='x') as display:
+            for i in range(5):
+                sys_with_web.s1.status = i % 2 == 0
+                sys_with_web.s2.status = i % 2 == 0
+            sys_with_web.flush()
+            assert not sockets[0].messages
+            web.flush_sockets()
+            # Encoded once per object per frame, not per change or per client
+            assert display.call_count == 2
+    finally:
+        web._frame_callback = None
+        del web._sockets[:]
+
+    batch, = sockets[0].messages
+    assert batch['action'] == 'batch'
+    assert [(m['name'], m['status']) for m in batch['messages']] == [('s1', True), ('s2', True)]
+    msg, = sockets[1].messages
+    assert msg['action'] == 'object_status'
+    assert (msg['name'], msg['status']) == ('s2', True)
+    web.flush_sockets()
+    assert len(sockets[0].messages) == 1
+
+    # Without clients, changes are not collected
+    sys_with_web.s1.status = False
+    sys_with_web.flush()
+    assert not web._pending_changes
+
+
+def test_push_log_without_clients(sys_with_web):
+    import mock
+    web = sys_with_web.request_service('WebService')
+    with mock.patch('tornado.ioloop.IOLoop.instance') as instance:
+        web.push_log('line')
+        assert not instance.return_value.add_callback.called
+        socket = FakeSocket()
+        web._sockets.append(socket)
+        try:
+            web.push_log('line')
+            assert not instance.return_value.add_callback.called
+            socket.log_requested = True
+            web.push_log('line')
+            instance.return_value.add_callback.assert_called_once_with(web._push_log, 'line')
+        finally:
+            del web._sockets[:]
+
+
+def test_history_json(sys_with_web, logged_client):
+    from automate.extensions.webui.djangoapp.views import history_cache
+    s1 = sys_with_web.s1
+    s1.history.clear()
+    s1.history.extend((i, float(i % 2)) for i in range(1000))
+    res = logged_client.get('/history.json/object/s1')
+    assert len(json.loads(res.content.decode())) == 1000
+    res = logged_client.get('/history.json/object/s1', {'start': 100000, 'end': 199500, 'max_points': 20})
+    points = json.loads(res.content.decode())
+    assert len(points) == 20
+    assert points[0][0] == 100000 and points[-1][0] == 199000
+    cached = len(history_cache)
+    logged_client.get('/history.json/object/s1', {'start': 100000, 'end': 199500, 'max_points': 20})
+    assert len(history_cache) == cached
+    res = logged_client.get('/history.json/object/s1', {'max_points': 20, 'method': 'minmax'})
+    assert len(json.loads(res.content.decode())) == 20
+    res = logged_client.get('/history.json/object/s1', {'max_points': 'x'})
+    assert res.status_code == 400
+    res = logged_client.get('/history.json/object/s1', {'max_points': 20, 'method': 'x'})
+    assert res.status_code == 400
+
+
+def test_render_cache(sys_with_web, logged_client, constants):
+    import mock
+    s1 = sys_with_web.s1
+    s1.tags.add('cachetest')
+    url = r('single_tag', 'cachetest')
+    with mock.patch.object(s1.__class__, 'get_status_display', autospec=True, return_value='xyz') as display:
+        s1.status = True
+        sys_with_web.flush()
+        assert b'xyz' in logged_client.get(url).content
+        calls = display.call_count
+        assert calls
+        # Unchanged row is not rendered again
+        assert b'xyz' in logged_client.get(url).content
+        assert display.call_count == calls
+        s1.status = False
+        sys_with_web.flush()
+        logged_client.get(url)
+        assert display.call_count > calls
+    # Cached rows are shared by clients
+    cached = len(sys_with_web.request_service('WebService').render_cache)
+    from django.test import Client
+    client = Client()
+    client.post(constants.LOGIN, {'username': 'test', 'password': 'test'})
+    assert b'object_status_s1' in client.get(url).content
+    assert len(sys_with_web.request_service('WebService').render_cache) == cached
+    # Configuration changes invalidate groups
+    assert b'cachetest2' not in logged_client.get(constants.TAGS).content
+    s1.tags.add('cachetest2')
+    assert b'cachetest2' in logged_client.get(constants.TAGS).content
+
+
+def test_websocket_outbox(sys_with_web):
+    from tornado.concurrent import Future
+    web = sys_with_web.request_service('WebService')
+    web.websocket_queue_size = 3
+    WebSocket = web.get_websocket()
+    written = []
+
+    class Socket(WebSocket):
+        def __init__(self):
+            # Not connected, just the parts that send() uses
+            self.outbox = deque(maxlen=web.websocket_queue_size)
+            self.dropped = 0
+            self._writing = False
+            self.session_id = None
+
+        def write_message(self, msg):
+            written.append((msg, Future()))
+            return written[-1][1]
+
+    s = Socket()
+    for i in range(6):
+        s.send(str(i))
+    # One write in progress, others wait in bounded outbox
+    assert [m for m, f in written] == ['0']
+    assert list(s.outbox) == ['3', '4', '5']
+    assert s.dropped == 2
+    written[-1][1].set_result(None)
+    assert [m for m, f in written] == ['0', '3']
+    for i in range(3):
+        written[-1][1].set_result(None)
+    assert [m for m, f in written] == ['0', '3', '4', '5']
+    assert not s.outbox and not s._writing
+
+
+def test_websocket_history_stream(sys_with_web):
+    web = sys_with_web.request_service('WebService')
+    WebSocket = web.get_websocket()
+
+    class Socket(FakeSocket, WebSocket):
+        pass
+
+    def points(msg):
+        t, times = msg['t0'], [msg['t0']]
+        for dt in msg['dt']:
+            t += dt
+            times.append(t)
+        return list(zip(times, msg['v']))
+
+    s1 = sys_with_web.s1
+    for i in range(3):
+        s1.status = i % 2 == 0
+        sys_with_web.flush()
+    s = Socket('s1')
+    s._subscribe_history(['s1'], since=0)
+    backlog, = s.messages
+    assert backlog['action'] == 'history' and backlog['name'] == 's1'
+    assert points(backlog) == [(int(t * 1000), float(v)) for t, v in s1.history]
+
+    web._sockets.append(s)
+    web._frame_callback = True
+    try:
+        for i in range(3):
+            s1.status = i % 2 == 1
+            sys_with_web.flush()
+        web.flush_sockets()
+    finally:
+        web._frame_callback = None
+        del web._sockets[:]
+    msg = [m for m in s.messages[-1]['messages'] if m['action'] == 'history'][-1]
+    # Only new samples, and the last one already sent (it may have been replaced)
+    assert points(msg) == [(int(t * 1000), float(v)) for t, v in s1.history][-4:]
+    assert points(msg)[0] == points(backlog)[-1]
+
+    s._unsubscribe_history(['s1'])
+    assert not s.history_subscriptions
+
+
 # TODO:
 # - test creating new objects
 # - test editing objects via web